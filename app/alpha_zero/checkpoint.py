@@ -0,0 +1,116 @@
+import os
+import random
+import threading
+from typing import Optional
+
+import numpy as np
+import torch
+
+
+def save_checkpoint(state: dict, path: str) -> None:
+    """学習の状態をファイルに保存する
+
+    一時ファイルに書き終えてから置き換えるので，途中で止まっても
+    pathには前回か今回のどちらかの完全な状態が残る
+
+    Args:
+        state (dict): 学習の状態
+        path (str): 保存先
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """save_checkpointで保存した学習の状態を読み込む
+
+    Args:
+        path (str): ファイルのパス
+
+    Returns:
+        dict: 学習の状態
+    """
+    return torch.load(path)
+
+
+def get_rng_state() -> dict:
+    """random，numpy，torchの乱数の状態を返す
+
+    numpyの状態はtorch.loadで重みと同じように読めるようテンソルにする
+
+    Returns:
+        dict: 乱数の状態
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "random": random.getstate(),
+        "numpy": {
+            "name": name,
+            "keys": torch.from_numpy(keys.astype(np.int64)),
+            "pos": int(pos),
+            "has_gauss": int(has_gauss),
+            "cached_gaussian": float(cached_gaussian),
+        },
+        "torch": torch.get_rng_state(),
+    }
+
+
+def set_rng_state(state: dict) -> None:
+    """get_rng_stateで得た乱数の状態に戻す
+
+    Args:
+        state (dict): 乱数の状態
+    """
+    random.setstate(state["random"])
+    s = state["numpy"]
+    keys = s["keys"].numpy().astype(np.uint32)
+    np.random.set_state(
+        (s["name"], keys, s["pos"], s["has_gauss"], s["cached_gaussian"])
+    )
+    torch.set_rng_state(state["torch"])
+
+
+class CheckpointWriter:
+    """学習の状態を別スレッドでファイルに書き出す
+
+    書き出しの間も学習を進められるよう，渡す状態は学習中に書き換わらない
+    コピーでなければならない．前回の書き出しが終わっていなければ終わるまで待つ
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): 保存先
+        """
+        self.path = path
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def save(self, state: dict) -> None:
+        """状態の書き出しを始める
+
+        Args:
+            state (dict): 学習の状態のコピー
+        """
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(state,))
+        self._thread.start()
+
+    def wait(self) -> None:
+        """書き出し中なら終わるまで待つ．書き出しに失敗していたら例外を送出する"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, state: dict) -> None:
+        try:
+            save_checkpoint(state, self.path)
+        except BaseException as e:
+            self._error = e
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import threading
+from typing import Hashable, Optional, Tuple
+import weakref
+
+import numpy as np
+
+
+class EvaluationCache:
+    """モデルによる評価(p, v)をプレイヤー1から見た盤面ごとに保存するLRUキャッシュ
+
+    MCTSのインスタンスやエピソード，対戦をまたいで共有できる．
+    エントリはモデルごとのバージョンをキーに含むので，
+    異なるモデルの評価が混ざることはなく，invalidateでモデル単位に捨てられる．
+    スレッド間では共有でき，各操作はロックの中で行う．
+    プロセス間では共有せず，pickleすると空のキャッシュになる
+    """
+
+    def __init__(self, max_size: int = 100000):
+        """
+        Args:
+            max_size (int, optional): 保存する最大局面数. Defaults to 100000.
+        """
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, model: object, key: Hashable) -> Optional[Tuple[np.ndarray, float]]:
+        """保存された評価を返す
+
+        Args:
+            model (object): 評価に用いるモデル
+            key (Hashable): プレイヤー1から見た盤面のハッシュ
+
+        Returns:
+            Optional[Tuple[np.ndarray, float]]: (p, v), 保存されていなければNone
+        """
+        with self._lock:
+            k = (self._version(model), key)
+            value = self._entries.get(k)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(k)
+            return value
+
+    def put(self, model: object, key: Hashable, p: np.ndarray, v: float) -> None:
+        """評価を保存し，あふれたら最も長く使われていないものを捨てる
+
+        Args:
+            model (object): 評価に用いたモデル
+            key (Hashable): プレイヤー1から見た盤面のハッシュ
+            p (np.ndarray): 行動確率
+            v (float): 評価値
+        """
+        with self._lock:
+            k = (self._version(model), key)
+            self._entries[k] = (p, v)
+            self._entries.move_to_end(k)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model: object) -> None:
+        """modelの評価を全て捨てる．以降のmodelの評価は新しいバージョンで保存される
+
+        Args:
+            model (object): 重みが変わった，または使わなくなったモデル
+        """
+        with self._lock:
+            version = self._versions.pop(model, None)
+            if version is None:
+                return
+            for k in [k for k in self._entries if k[0] == version]:
+                del self._entries[k]
+
+    def clear(self) -> None:
+        """全ての評価と統計を捨てる"""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._versions = weakref.WeakKeyDictionary()
+            self._next_version = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """ヒット数，ミス数，ヒット率，保存している局面数を返す
+
+        Returns:
+            dict: 統計
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+    def _version(self, model: object) -> int:
+        """モデルのバージョンを返す．初めて見るモデルには新しい番号を割り当てる．ロックの中で呼ぶ"""
+        version = self._versions.get(model)
+        if version is None:
+            version = self._next_version
+            self._next_version += 1
+            self._versions[model] = version
+        return version
+
+    def __getstate__(self) -> dict:
+        return {"max_size": self.max_size}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["max_size"])
@@ -0,0 +1,164 @@
+import copy
+import logging
+from typing import Optional, Tuple, Union
+import warnings
+import weakref
+
+import torch
+import torch.nn as nn
+
+from ..games.game import Game
+
+
+class InferenceModel:
+    """モデルを推論専用にTorchScriptへ変換して呼び出すラッパー
+
+    モデルのコピーを評価モードでトレースし，重みを定数として凍結して
+    層を融合したものを自動微分を切って呼び出す．
+    quantizeならトレースする前に全結合層の重みをint8に動的量子化する．
+    モデルと同じように呼び出せるので，MCTSのmodelの代わりに渡せる．
+    元のモデルの重みが書き換えられたら次の呼び出しで作り直す．
+    トレースできないモデル(バッチの大きさで処理が変わるものなど)は元のモデルをそのまま使う
+    """
+
+    def __init__(self, model: nn.Module, game: Game, quantize: bool = False):
+        """
+        Args:
+            model (nn.Module): 盤面を受け取り(p, v)を返すモデル
+            game (Game): トレースに用いる盤面の大きさを得るゲーム
+            quantize (bool, optional): int8に量子化するならTrue. Defaults to False.
+        """
+        self._model = model
+        self._model_ref: Optional[weakref.ref] = None
+        self.game = game
+        self.quantize = quantize
+        self.compiled = None
+        self.num_builds = 0
+        self._versions = None
+
+    @property
+    def model(self) -> nn.Module:
+        """元のモデル"""
+        if self._model_ref is None:
+            return self._model
+        model = self._model_ref()
+        if model is None:
+            raise ReferenceError("the wrapped model has been garbage-collected")
+        return model
+
+    def _hold_weakly(self) -> None:
+        """元のモデルを弱参照で持つようにする"""
+        self._model_ref = weakref.ref(self._model)
+        self._model = None
+
+    def __call__(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """盤面を評価する
+
+        Args:
+            x (torch.Tensor): 1局面または複数局面の盤面
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: (p, v)
+        """
+        if self.compiled is None or self._versions != self._param_versions():
+            self.refresh()
+        with torch.inference_mode():
+            return self.compiled(x)
+
+    def refresh(self) -> None:
+        """元のモデルの今の重みで推論用のモデルを作り直す"""
+        self._versions = self._param_versions()
+        self.num_builds += 1
+        model = copy.deepcopy(self.model).eval()
+        for p in model.parameters():
+            p.requires_grad_(False)
+        if self.quantize:
+            # 活性は呼び出しごとに量子化するので，較正用の盤面はいらない
+            model = torch.quantization.quantize_dynamic(
+                model, {nn.Linear}, dtype=torch.qint8
+            )
+        # バッチの大きさが違う入力でも同じ結果になるかをトレース時に確かめる
+        shape = (2, self.game.get_height(), self.game.get_width())
+        examples = [torch.rand(n, *shape) for n in (1, 2, 5)]
+        try:
+            with warnings.catch_warnings():
+                # 新しいtorchではTorchScriptが非推奨だという警告が出るので抑える
+                warnings.simplefilter("ignore", FutureWarning)
+                traced = torch.jit.trace(
+                    model, examples[0], check_inputs=[(x,) for x in examples[1:]]
+                )
+                self.compiled = torch.jit.optimize_for_inference(
+                    torch.jit.freeze(traced)
+                )
+        except Exception as e:
+            logging.warning(f"failed to trace model, falling back to eager: {e}")
+            self.compiled = model
+
+    def _param_versions(self) -> Tuple[int, ...]:
+        """元のモデルの重みの書き換え回数．optimizer.stepやload_state_dictで増える"""
+        return tuple(p._version for p in self.model.parameters())
+
+    def __getstate__(self) -> dict:
+        # TorchScriptのモデルはpickleできないので，送り先で作り直す
+        return {"model": self.model, "game": self.game, "quantize": self.quantize}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["model"], state["game"], state["quantize"])
+
+
+_inference_models = weakref.WeakKeyDictionary()
+
+
+def inference_model(
+    model: nn.Module, game: Game, quantize: bool = False
+) -> InferenceModel:
+    """モデルと量子化の有無ごとに共有する推論用のラッパーを返す
+
+    同じモデルには同じラッパーを返すので，トレースはモデルの重みが変わったときだけ行われ，
+    評価のキャッシュもMCTSのインスタンスをまたいで共有できる．
+    ラッパーはモデルを弱参照で持ち，モデルが使われなくなればラッパーごと解放されるので，
+    モデルより長く使ってはならない
+
+    Args:
+        model (nn.Module): 盤面を受け取り(p, v)を返すモデル
+        game (Game): ゲーム
+        quantize (bool, optional): int8に量子化するならTrue. Defaults to False.
+
+    Returns:
+        InferenceModel: 推論用のラッパー
+    """
+    wrappers = _inference_models.setdefault(model, dict())
+    if quantize not in wrappers:
+        wrapper = InferenceModel(model, game, quantize)
+        # 登録表の値からモデルを強く参照すると，キーのモデルがいつまでも解放されない
+        wrapper._hold_weakly()
+        wrappers[quantize] = wrapper
+    return wrappers[quantize]
+
+
+def compare_models(
+    reference: nn.Module,
+    model: Union[nn.Module, InferenceModel],
+    x: torch.Tensor,
+) -> dict:
+    """同じ盤面に対するmodelの評価のreferenceからのずれを測る
+
+    量子化などで近似したモデルが元のモデルと同じように指せるかの確認に用いる
+
+    Args:
+        reference (nn.Module): 基準のモデル
+        model (Union[nn.Module, InferenceModel]): 比べるモデル
+        x (torch.Tensor): 盤面
+
+    Returns:
+        dict: 行動確率のKLダイバージェンスの平均(policy_kl)と評価値の平均二乗誤差(value_mse)
+    """
+    EPS = 1e-5
+    with torch.no_grad():
+        p_ref, v_ref = reference(x)
+        p, v = model(x)
+    kl = torch.sum(p_ref * (torch.log(p_ref + EPS) - torch.log(p + EPS)), dim=1)
+    return {
+        "policy_kl": float(kl.mean()),
+        "value_mse": float(torch.mean((v - v_ref) ** 2)),
+    }
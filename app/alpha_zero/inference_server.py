@@ -0,0 +1,203 @@
+from collections import Counter, deque
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+from typing import Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class InferenceServer:
+    """複数の探索から盤面を受け取り，まとめてモデルで評価するサーバ
+
+    モデルと同じように呼び出せるので，MCTSのmodelの代わりに渡せる．
+    呼び出したスレッドは評価が終わるまで待ち，その間に他のスレッドから来た盤面と
+    一緒に最大max_batch_size局面ずつ評価される
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        max_batch_size: int = 64,
+        max_wait: float = 0.001,
+        num_latency_samples: int = 10000,
+    ):
+        """
+        Args:
+            model (nn.Module): 盤面を受け取り(p, v)を返すモデル
+            max_batch_size (int, optional): 1回のモデル呼び出しで評価する最大局面数. Defaults to 64.
+            max_wait (float, optional): 最初の要求が来てからバッチが埋まるのを待つ最大秒数. Defaults to 0.001.
+            num_latency_samples (int, optional): 待ち時間の統計に用いる直近の要求数. Defaults to 10000.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=num_latency_samples)
+        self.num_requests = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        # 止めたかどうかとキューへの追加，統計の読み書きを守るロック
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def __call__(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """盤面を評価する．評価が終わるまで待つ
+
+        Args:
+            x (torch.Tensor): 1局面または複数局面の盤面
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: (p, v)
+        """
+        return self.submit(x).result()
+
+    def submit(self, x: torch.Tensor) -> Future:
+        """盤面の評価を依頼する
+
+        asyncioからはasyncio.wrap_futureで待てる
+
+        Args:
+            x (torch.Tensor): 1局面または複数局面の盤面
+
+        Returns:
+            Future: (p, v)が結果として入るFuture
+        """
+        # 1局面の盤面にはバッチの次元を加える
+        if x.dim() == 3:
+            x = x.unsqueeze(0)
+        future = Future()
+        # 止める合図より後に要求が入らないよう，確認と追加をまとめて行う
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("InferenceServer is closed")
+            self._queue.put((x, future, time.perf_counter()))
+        return future
+
+    def close(self) -> None:
+        """サーバを止める．キューに残っている要求は評価してから止まる"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+        # 評価されずに残った要求があれば待っている呼び出し元にエラーを返す
+        while not self._queue.empty():
+            request = self._queue.get_nowait()
+            if request is not None:
+                request[1].set_exception(RuntimeError("InferenceServer is closed"))
+
+    def __enter__(self) -> "InferenceServer":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def stats(self) -> dict:
+        """バッチサイズの分布と待ち時間の統計を返す
+
+        Returns:
+            dict: バッチサイズのヒストグラム，要求数，バッチ数，待ち時間(秒)の統計
+        """
+        # 評価中のスレッドが書き換えるので，ロックを取って写しておく
+        with self._lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = dict(self.batch_sizes)
+            num_requests = self.num_requests
+        num_batches = sum(batch_sizes.values())
+        num_positions = sum(k * c for k, c in batch_sizes.items())
+        result = {
+            "batch_size_histogram": dict(sorted(batch_sizes.items())),
+            "num_requests": num_requests,
+            "num_batches": num_batches,
+            "mean_batch_size": num_positions / num_batches if num_batches else 0.0,
+        }
+        if len(latencies):
+            result.update(
+                {
+                    "latency_mean": float(latencies.mean()),
+                    "latency_p50": float(np.percentile(latencies, 50)),
+                    "latency_p99": float(np.percentile(latencies, 99)),
+                    "latency_max": float(latencies.max()),
+                }
+            )
+        return result
+
+    def log_stats(self) -> None:
+        logging.info(f"inference server: {self.stats()}")
+
+    def _loop(self) -> None:
+        """要求を集めてバッチにし，モデルで評価し続ける"""
+        pending = None
+        while True:
+            request = pending if pending is not None else self._queue.get()
+            pending = None
+            if request is None:
+                return
+
+            # 最初の要求からmax_wait秒以内に来た要求をmax_batch_sizeまでまとめる
+            batch = [request]
+            size = request[0].shape[0]
+            deadline = time.perf_counter() + self.max_wait
+            stop = False
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = (
+                        self._queue.get(timeout=timeout)
+                        if timeout > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                if size + request[0].shape[0] > self.max_batch_size:
+                    pending = request
+                    break
+                batch.append(request)
+                size += request[0].shape[0]
+
+            self._run(batch)
+            if stop:
+                # 止める前に残りの要求を評価する
+                while not self._queue.empty():
+                    request = self._queue.get_nowait()
+                    if request is not None:
+                        self._run([request])
+                return
+
+    def _run(self, batch: list) -> None:
+        """まとめた要求をモデルで評価して結果を返す
+
+        Args:
+            batch (list): (x, future, 要求時刻)のリスト
+        """
+        start = time.perf_counter()
+        x = torch.cat([x for x, _, _ in batch])
+        with self._lock:
+            for _, _, t in batch:
+                self.latencies.append(start - t)
+            self.num_requests += len(batch)
+            self.batch_sizes[x.shape[0]] += 1
+        try:
+            with torch.no_grad():
+                p, v = self.model(x)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        i = 0
+        for x, future, _ in batch:
+            j = i + x.shape[0]
+            future.set_result((p[i:j], v[i:j]))
+            i = j
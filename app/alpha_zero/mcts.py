@@ -1,35 +1,90 @@
-from math import sqrt
-from typing import List
+from collections import Counter
+import time
+from typing import List, Tuple, Hashable, Optional
 
 import torch
 import torch.nn as nn
 import numpy as np
 
-from ..games.game import Game
+from ..games.game import Game, GameState
+from .eval_cache import EvaluationCache
+from .node_store import NodeStore
 from .utils import get_board_view
 
 
 class MCTS:
+    SELECTIONS = ("puct", "ucb")
+
     def __init__(
-        self, game: Game, model: nn.Module, alpha: float, tau: float, num_search: int
+        self,
+        game: Game,
+        model: nn.Module,
+        alpha: float,
+        tau: float,
+        num_search: int,
+        batch_size: int = 1,
+        virtual_loss: float = 1.0,
+        cache: Optional[EvaluationCache] = None,
+        use_symmetry: bool = False,
+        time_limit: Optional[float] = None,
+        selection: str = "puct",
+        fpu: float = 0.0,
+        dirichlet_alpha: Optional[float] = None,
+        dirichlet_eps: float = 0.25,
+        rng: Optional[np.random.RandomState] = None,
     ):
         """
         Args:
             game (Game): ゲーム
             model (nn.Module): 盤面を受け取り(p, v)を返すモデル
-            alpha (float): 探索の重み
+            alpha (float): 探索の重み．PUCTの係数c
             tau (float): 温度パラメータ
             num_search (int): シミュレーション回数
+            batch_size (int, optional): まとめてモデルで評価するシミュレーション数. Defaults to 1.
+            virtual_loss (float, optional): 評価待ちの経路に一時的に与える損失. Defaults to 1.0.
+            cache (Optional[EvaluationCache], optional): 他のMCTSと共有するモデルの評価のキャッシュ.
+                Defaults to None.
+            use_symmetry (bool, optional): 対称変換で移り合う盤面を同じノードとして扱うならTrue.
+                Defaults to False.
+            time_limit (Optional[float], optional): 1手の探索の最大秒数．指定すると
+                num_search回に達するか時間切れになるまで探索する. Defaults to None.
+            selection (str, optional): 子の選び方．"puct"ならQ + alpha * P * sqrt(Ns) / (1 + N)，
+                "ucb"ならモデルの行動確率を使わずQ + alpha * sqrt(Ns) / (1 + N). Defaults to "puct".
+            fpu (float, optional): 一度も訪れていない子のQとして使う値. Defaults to 0.0.
+            dirichlet_alpha (Optional[float], optional): 指定すると根の行動確率に
+                このパラメータのディリクレ分布のノイズを混ぜる．自己対戦で手を散らすのに用いる.
+                Defaults to None.
+            dirichlet_eps (float, optional): 根の行動確率に混ぜるノイズの割合. Defaults to 0.25.
+            rng (Optional[np.random.RandomState], optional): ノイズに使う乱数生成器．
+                Noneならnp.randomを使う. Defaults to None.
         """
+        if selection not in self.SELECTIONS:
+            raise ValueError(f"Invalid selection: {selection}")
         self.game = game
-        self.visited = set()
         self.model = model
-        self.Q = dict()
-        self.N = dict()
-        self.P = dict()
+        self.nodes = NodeStore(game.get_action_size())
         self.alpha = alpha
         self.tau = tau
         self.num_search = num_search
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.cache = cache
+        self.use_symmetry = use_symmetry
+        self.time_limit = time_limit
+        self.selection = selection
+        self.fpu = fpu
+        self.dirichlet_alpha = dirichlet_alpha
+        self.dirichlet_eps = dirichlet_eps
+        self.rng = rng
+        # 子への辺の対称変換として現れた行動の並べ替えと，その番号への辞書
+        self._transforms: List[np.ndarray] = []
+        self._transform_index = dict()
+        # ノイズを混ぜた根のノード番号と元の行動確率
+        self._noised: Optional[Tuple[int, np.ndarray]] = None
+        self.last_search = {"simulations": 0, "time": 0.0}
+        # 作ってからの累計．探索数，シミュレーション数，展開したノード数，
+        # モデルの呼び出し回数と評価した局面数，キャッシュのヒット数，探索後の木の大きさの合計
+        self.counters = Counter()
 
     def search(self, board: List[List[float]], player: int) -> float:
         """MCTS探索
@@ -41,96 +96,588 @@ class MCTS:
         Returns:
             float: playerから見た盤面の評価値の推定値
         """
+        return self.search_batch(board, player, 1)[0]
 
-        # ゲームが終了したらplayerから見た報酬を返す
-        if self.game.get_game_ended(board, player):
-            return self.game.get_reward(board, player)
+    def search_batch(
+        self, board: List[List[float]], player: int, k: int
+    ) -> List[float]:
+        """k回分のシミュレーションをまとめて行い，葉の評価を1回のモデル呼び出しで行う
 
-        s = self.game.hash(board, player)
-        action_size = self.game.get_action_size()
-
-        # これまで訪れたことのない状態なら(p, v)を計算して保存
-        if s not in self.visited:
-            self.visited.add(s)
-            cboard = self.game.get_canonical_form(board, player)
-            p, v = self.model(torch.Tensor(get_board_view(cboard)))
-            p = p.detach().numpy()[0].tolist()
-            v = v.detach().numpy()[0, 0]
-            self.P[s] = p
-            self.Q[s] = [0] * action_size
-            self.N[s] = [0] * action_size
-            return v
-
-        # UCBが最大となるactionを選択
-        best_action = 0
-        max_ucb = -float("inf")
-        Ns = sum(self.N[s])
-
-        for action in range(action_size):
-            if self.game.is_valid(board, player, action):
-                ucb = self.Q[s][action] + self.alpha * sqrt(Ns) / (
-                    1 + self.N[s][action]
-                )
-                if ucb > max_ucb:
-                    max_ucb = ucb
-                    best_action = action
-
-        # 次の状態を取得
-        next_board, next_player = self.game.get_next_state(board, player, best_action)
-
-        # 再帰的に探索する
-        v = (
-            self.search(next_board, next_player)
-            if player == next_player
-            else -self.search(next_board, next_player)
+        同じ経路に探索が集中しないよう，評価待ちの経路にはvirtual lossを与える
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): プレイヤー
+            k (int): シミュレーション回数
+
+        Returns:
+            List[float]: 各シミュレーションのplayerから見た評価値の推定値
+        """
+        sims, leaves = self._collect(board, player, k)
+        evals = self._evaluate(
+            [self.game.get_canonical_form(b, p) for _, b, p in leaves]
+        )
+        return self._finish(sims, leaves, evals, player)
+
+    def _collect(
+        self, board: List[List[float]], player: int, k: int
+    ) -> Tuple[list, List[Tuple[Hashable, List[List[float]], int]]]:
+        """k回分の探索で葉まで降り，評価が必要な葉を重複なく集める
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): プレイヤー
+            k (int): シミュレーション回数
+
+        Returns:
+            Tuple[list, List[Tuple[Hashable, List[List[float]], int]]]:
+                各シミュレーションの(経路, 葉, 報酬)と，評価が必要な(s, board, player)のリスト
+        """
+        sims = []
+        leaves = dict()
+        state = self.game.get_state(board, player)
+        # 根の代表の向きはバッチごとに1度だけ求める
+        root_form = self._symmetric_form(board, player) if self.use_symmetry else None
+        for _ in range(k):
+            path, leaf, v = self._select(state, root_form)
+            sims.append((path, leaf, v))
+            if v is None and leaf[0] not in leaves:
+                leaves[leaf[0]] = leaf
+        return sims, list(leaves.values())
+
+    def _finish(
+        self,
+        sims: list,
+        leaves: List[Tuple[Hashable, List[List[float]], int]],
+        evals: List[Tuple[np.ndarray, float]],
+        player: int,
+    ) -> List[float]:
+        """評価した葉を展開して親の子としてつなぎ，各シミュレーションの経路を更新する
+
+        Args:
+            sims (list): _collectで得た各シミュレーションの(経路, 葉, 報酬)
+            leaves (List[Tuple[Hashable, List[List[float]], int]]): 評価が必要な葉
+            evals (List[Tuple[np.ndarray, float]]): 各葉の(p, v)
+            player (int): 根のプレイヤー
+
+        Returns:
+            List[float]: 各シミュレーションのplayerから見た評価値の推定値
+        """
+        values = self._expand(leaves, evals)
+
+        results = []
+        for path, (s, _, leaf_player), v in sims:
+            if v is None:
+                v = values[s]
+                # つないでおかないと部分木の再利用のときに解放されてしまう
+                if path:
+                    parent, a, _ = path[-1]
+                    self.nodes.children[parent, a] = self.nodes.get(s)
+            results.append(self._backup(path, leaf_player, v) * player)
+        return results
+
+    def _select(
+        self,
+        state: GameState,
+        root_form: Optional[Tuple[List[List[float]], np.ndarray]] = None,
+    ) -> Tuple[list, Tuple[Hashable, List[List[float]], int], Optional[float]]:
+        """UCBに従って葉まで降り，経路にvirtual lossを加える
+
+        局面はmake_moveで書き換えながら降り，戻る前に元に戻す．
+        対称な盤面をまとめる場合，代表の向きを求めるのは初めてたどる辺だけで，
+        つないだ子へは辺に記録した対称変換を合成して降りる
+
+        Args:
+            state (GameState): 根の局面
+            root_form (Optional[Tuple[List[List[float]], np.ndarray]], optional):
+                use_symmetryのとき，求めてあれば根の代表の盤面と行動の並べ替え. Defaults to None.
+
+        Returns:
+            Tuple[list, Tuple[Hashable, List[List[float]], int], Optional[float]]:
+                (node, action, player)の経路, (s, board, player)の葉, 終局ならleaf playerから見た報酬
+        """
+        game = self.game
+        nodes = self.nodes
+        path = []
+        undos = []
+        node = -1
+        # 対称な盤面を同じノードにまとめる場合は代表の向きで探索し，
+        # 選んだ行動をこの並べ替えで実際の盤面の向きに戻して着手する
+        perm = None
+        try:
+            while True:
+                board, player = state.board, state.player
+
+                if node < 0:
+                    # ゲームが終了したらplayerから見た報酬を返す
+                    # 終局と報酬は盤面の向きによらないので，対称変換の前に判定する
+                    if game.get_game_ended(board, player):
+                        return (
+                            path,
+                            (None, None, player),
+                            game.get_reward(board, player),
+                        )
+
+                    parent_perm = perm
+                    if self.use_symmetry:
+                        if path or root_form is None:
+                            board, perm = self._symmetric_form(board, player)
+                        else:
+                            board, perm = root_form
+
+                    s = game.hash(board, player)
+                    node = nodes.get(s)
+
+                    # これまで訪れたことのない状態ならモデルで評価する
+                    # 局面は書き換えるので盤面は複製して渡す
+                    if node is None:
+                        if perm is None:
+                            board = game.get_board(state)
+                        elif path:
+                            # 辺の対称変換を記録しておき，展開したときに子としてつなぐ
+                            parent, a, _ = path[-1]
+                            nodes.transforms[parent, a] = self._transform(parent_perm, perm)
+                        return path, (s, board, player), None
+
+                    # 別の経路で展開済みの状態なら子としてつないでおく
+                    if path:
+                        parent, a, _ = path[-1]
+                        nodes.children[parent, a] = node
+                        if perm is not None:
+                            nodes.transforms[parent, a] = self._transform(parent_perm, perm)
+
+                best_action = self._select_action(node)
+                nodes.VL[node, best_action] += 1
+                path.append((node, best_action, player))
+
+                # 次の状態に進む
+                action = best_action if perm is None else int(perm[best_action])
+                undos.append(game.make_move(state, action))
+                child = nodes.children[node, best_action]
+                if child >= 0 and perm is not None:
+                    perm = perm[self._transforms[nodes.transforms[node, best_action]]]
+                node = child
+        finally:
+            for undo in reversed(undos):
+                game.unmake_move(state, undo)
+
+    def _select_action(self, node: int) -> int:
+        """PUCT(またはUCB)が最大となるactionを選択
+
+        Args:
+            node (int): ノード番号
+
+        Returns:
+            int: 選択されたaction
+        """
+        nodes = self.nodes
+        N, VL = nodes.N[node], nodes.VL[node]
+        n = N + VL
+        Ns = n.sum()
+
+        # 評価待ちの分だけ負けたものとして扱い，訪れていない子はfpuとする
+        q = nodes.Q[node]
+        if VL.any():
+            q = np.where(VL > 0, (q * N - self.virtual_loss * VL) / np.maximum(n, 1), q)
+        if self.fpu != 0:
+            q = np.where(n == 0, self.fpu, q)
+        u = self.alpha * np.sqrt(Ns) / (1 + n)
+        if self.selection == "puct":
+            u = u * nodes.P[node]
+        ucb = q + u
+        ucb[~nodes.valid[node]] = -np.inf
+        return int(np.argmax(ucb))
+
+    def _symmetric_form(
+        self, board: List[List[float]], player: int
+    ) -> Tuple[List[List[float]], np.ndarray]:
+        """対称変換した盤面のうちハッシュが最小のものを代表として返す
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): プレイヤー
+
+        Returns:
+            Tuple[List[List[float]], np.ndarray]: 代表の盤面と行動の並べ替え
+        """
+        return min(
+            self.game.get_symmetries(board),
+            key=lambda sym: self.game.hash(sym[0], player),
         )
 
-        # Q, N を更新
-        self.Q[s][best_action] = (
-            self.Q[s][best_action] * self.N[s][best_action] + v
-        ) / (self.N[s][best_action] + 1)
-        self.N[s][best_action] += 1
-        return v
+    def _transform(self, parent_perm: np.ndarray, perm: np.ndarray) -> int:
+        """親の代表の向きで着手した盤面から子の代表の向きへの並べ替えの番号を返す
+
+        Args:
+            parent_perm (np.ndarray): 親の代表の盤面から実際の盤面への行動の並べ替え
+            perm (np.ndarray): 子の代表の盤面から実際の盤面への行動の並べ替え
+
+        Returns:
+            int: 並べ替えの番号．perm == parent_perm[self._transforms[番号]]となる
+        """
+        transform = np.argsort(parent_perm)[perm]
+        key = transform.tobytes()
+        index = self._transform_index.get(key)
+        if index is None:
+            index = len(self._transforms)
+            self._transforms.append(transform)
+            self._transform_index[key] = index
+        return index
+
+    def _expand(
+        self,
+        leaves: List[Tuple[Hashable, List[List[float]], int]],
+        evals: List[Tuple[np.ndarray, float]],
+    ) -> dict:
+        """評価した葉のノードを追加する
+
+        Args:
+            leaves (List[Tuple[Hashable, List[List[float]], int]]): (s, board, player)のリスト
+            evals (List[Tuple[np.ndarray, float]]): 各葉の(p, v)
+
+        Returns:
+            dict: sから葉のplayerから見た評価値への辞書
+        """
+        values = dict()
+        for (s, board, player), (p, v) in zip(leaves, evals):
+            valid = self.game.get_valid_moves(board, player)
+            self.nodes.add(s, _legal_prior(p, valid), valid)
+            values[s] = v
+        self.counters["nodes_expanded"] += len(leaves)
+        return values
+
+    def _evaluate(
+        self, cboards: List[List[List[float]]]
+    ) -> List[Tuple[np.ndarray, float]]:
+        """プレイヤー1から見た盤面をまとめてモデルで評価する
+
+        キャッシュにある盤面はモデルを呼ばずにキャッシュの値を使う
+
+        Args:
+            cboards (List[List[List[float]]]): プレイヤー1から見た盤面のリスト
+
+        Returns:
+            List[Tuple[np.ndarray, float]]: 各盤面の(p, v)
+        """
+        evals = [None] * len(cboards)
+        keys = [self.game.hash(cboard, 1) for cboard in cboards]
+        if self.cache is not None:
+            for i, key in enumerate(keys):
+                evals[i] = self.cache.get(self.model, key)
+
+        todo = [i for i in range(len(cboards)) if evals[i] is None]
+        self.counters["cache_hits"] += len(cboards) - len(todo)
+        if todo:
+            self.counters["network_calls"] += 1
+            self.counters["network_positions"] += len(todo)
+            x = np.array([get_board_view(cboards[i]) for i in todo], dtype=np.float32)
+            with torch.no_grad():
+                p, v = self.model(torch.from_numpy(x))
+            p = p.numpy()
+            v = v.numpy()
+            for j, i in enumerate(todo):
+                evals[i] = (p[j], float(v[j, 0]))
+                if self.cache is not None:
+                    self.cache.put(self.model, keys[i], *evals[i])
+        return evals
+
+    def _backup(self, path: list, leaf_player: int, v: float) -> float:
+        """経路上のQ, Nを更新しvirtual lossを取り除く
 
-    def get_action_prob(self, board: List[List[float]]) -> List[float]:
+        Args:
+            path (list): (node, action, player)の経路
+            leaf_player (int): 葉のプレイヤー
+            v (float): leaf_playerから見た評価値
+
+        Returns:
+            float: プレイヤー1から見た評価値
+        """
+        nodes = self.nodes
+        for node, a, player in reversed(path):
+            # 各ノードのplayerから見た評価値に直して更新
+            w = v * player * leaf_player
+            n = nodes.N[node, a]
+            nodes.VL[node, a] -= 1
+            nodes.Q[node, a] = (nodes.Q[node, a] * n + w) / (n + 1)
+            nodes.N[node, a] = n + 1
+        return v * leaf_player
+
+    def get_action_prob(self, board: List[List[float]], player: int = 1) -> List[float]:
         """行動確率を取得
 
+        前回までの探索の木にこの局面があれば，その部分木を残して再利用し，
+        既にある根の訪問回数もnum_searchに数える
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int, optional): 手番のプレイヤー. Defaults to 1.
+
+        Returns:
+            List[float]: playerの行動確率
+        """
+
+        start = time.perf_counter()
+        board, perm, s = self._root(board, player)
+
+        # 根を先に展開し，最初のバッチからノイズを混ぜた行動確率で子を選ぶ
+        done = self._root_visits(s)
+        simulations = 0
+        if s not in self.nodes:
+            self.search(board, player)
+            done += 1
+            simulations += 1
+        self._add_root_noise(s)
+
+        # 探索が合計num_search回になるか時間切れになるまで行う
+        while not self._search_done(s, done, start):
+            k = self._next_batch_size(done)
+            self.search_batch(board, player, k)
+            done += k
+            simulations += k
+        self._record_search(simulations, start)
+        return self._action_prob(s, perm)
+
+    def _root(
+        self, board: List[List[float]], player: int = 1
+    ) -> Tuple[List[List[float]], Optional[np.ndarray], Hashable]:
+        """探索する根の盤面，元の盤面の向きに戻す並べ替え，根のハッシュを返す
+
+        根から到達できないノードは解放する
+        """
+        perm = None
+        if self.use_symmetry:
+            board, perm = self._symmetric_form(board, player)
+        s = self.game.hash(board, player)
+        # 前の根に混ぜたノイズは，その根が子として残るかもしれないので取り除く
+        if self._noised is not None:
+            node, p = self._noised
+            self.nodes.P[node] = p
+            self._noised = None
+        root = self.nodes.get(s)
+        if root is None:
+            self.nodes.reset()
+        else:
+            self.nodes.prune(root)
+        return board, perm, s
+
+    def _add_root_noise(self, s: Hashable) -> None:
+        """根が展開済みでまだノイズを混ぜていなければ，行動確率にディリクレノイズを混ぜる
+
+        Args:
+            s (Hashable): 根のハッシュ
+        """
+        if self.dirichlet_alpha is None or self._noised is not None:
+            return
+        root = self.nodes.get(s)
+        if root is None:
+            return
+        p = self.nodes.P[root].copy()
+        valid = self.nodes.valid[root]
+        rng = np.random if self.rng is None else self.rng
+        noise = rng.dirichlet([self.dirichlet_alpha] * int(valid.sum()))
+        noised = p.copy()
+        noised[valid] = (1 - self.dirichlet_eps) * p[valid] + self.dirichlet_eps * noise
+        self.nodes.P[root] = noised
+        self._noised = (root, p)
+
+    def _root_visits(self, s: Hashable) -> int:
+        """根の訪問回数の合計を返す．未展開なら0"""
+        root = self.nodes.get(s)
+        if root is None:
+            return 0
+        return int(self.nodes.N[root].sum())
+
+    def _search_done(self, s: Hashable, done: int, start: float) -> bool:
+        """探索を終えるか判定する
+
+        時間切れでも，根の子を1回も訪れていなければ行動確率が決まらないので続ける
+
         Args:
-            board (List[List[float]]): プレイヤー1から見た盤面
+            s (Hashable): 根のハッシュ
+            done (int): 根の訪問回数を含めたこれまでのシミュレーション数
+            start (float): 探索を始めた時刻
+
+        Returns:
+            bool: 終えるならTrue
+        """
+        if done >= self.num_search:
+            return True
+        if self.time_limit is None or self._root_visits(s) == 0:
+            return False
+        return time.perf_counter() - start >= self.time_limit
+
+    def _record_search(self, simulations: int, start: float) -> None:
+        """直前の探索のシミュレーション数と時間を記録し，累計に加える"""
+        self.last_search = {
+            "simulations": simulations,
+            "time": time.perf_counter() - start,
+        }
+        self.counters["searches"] += 1
+        self.counters["simulations"] += simulations
+        self.counters["search_time"] += self.last_search["time"]
+        self.counters["tree_size"] += len(self.nodes)
+
+    def stats(self) -> dict:
+        """直前の探索のシミュレーション数，時間(秒)，1秒あたりのシミュレーション数と
+        探索後の木のノード数を返す
 
         Returns:
-            List[float]: プレイヤー1の行動確率
+            dict: 統計
         """
+        simulations = self.last_search["simulations"]
+        elapsed = self.last_search["time"]
+        return {
+            "simulations": simulations,
+            "time": elapsed,
+            "nodes_per_second": simulations / elapsed if elapsed > 0 else 0.0,
+            "tree_size": len(self.nodes),
+        }
 
-        # 探索をnum_search回行う
-        for i in range(self.num_search):
-            self.search(board, 1)
-        s = self.game.hash(board, 1)
+    def _next_batch_size(self, done: int) -> int:
+        """次にまとめて行うシミュレーション数を返す．根は展開済みとする"""
+        return min(self.batch_size, self.num_search - done)
 
-        p = []
+    def _action_prob(self, s: Hashable, perm: Optional[np.ndarray]) -> List[float]:
+        """根の訪問回数から行動確率を計算する"""
+        counts = self.nodes.N[self.nodes.get(s)].astype(np.float64)
+
+        # 代表の向きでの訪問回数を元の盤面の向きに戻す
+        if perm is not None:
+            counts[perm] = counts.copy()
 
         # tau == 0ならargmaxを返す
         if self.tau == 0:
-            for a in range(self.game.get_action_size()):
-                p.append(self.N[s][a])
-            best_action = np.argmax(p)
-            p = [0.0] * len(p)
-            p[best_action] = 1
-            return p
-
-        # 行動確率を計算
-        for a in range(self.game.get_action_size()):
-            p.append(self.N[s][a] ** (1 / self.tau))
+            p = np.zeros_like(counts)
+            p[np.argmax(counts)] = 1
+            return p.tolist()
 
-        # 正規化
-        sm = sum(p)
-        for a in range(len(p)):
-            p[a] /= sm
+        # 行動確率を計算して正規化
+        p = counts ** (1 / self.tau)
+        return (p / p.sum()).tolist()
 
-        return p
+    def clone(self) -> "MCTS":
+        """同じ設定とモデル，キャッシュを持つ空の木のMCTSを返す"""
+        return MCTS(
+            self.game,
+            self.model,
+            self.alpha,
+            self.tau,
+            self.num_search,
+            batch_size=self.batch_size,
+            virtual_loss=self.virtual_loss,
+            cache=self.cache,
+            use_symmetry=self.use_symmetry,
+            time_limit=self.time_limit,
+            selection=self.selection,
+            fpu=self.fpu,
+            dirichlet_alpha=self.dirichlet_alpha,
+            dirichlet_eps=self.dirichlet_eps,
+            rng=self.rng,
+        )
 
     def reset(self) -> None:
-        self.visited = set()
-        self.Q = dict()
-        self.N = dict()
-        self.P = dict()
+        self.nodes.reset()
+        self._noised = None
+
+
+def _legal_prior(p: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """モデルの行動確率を合法手だけで正規化する．合法手に確率がなければ一様にする
+
+    Args:
+        p (np.ndarray): モデルの行動確率
+        valid (np.ndarray): 合法手のマスク
+
+    Returns:
+        np.ndarray: 合法手の行動確率
+    """
+    prior = np.where(valid, p, 0)
+    total = prior.sum()
+    if total > 0:
+        return prior / total
+    return valid / max(valid.sum(), 1)
+
+
+def get_action_probs(
+    mcts_list: List[MCTS],
+    boards: List[List[List[float]]],
+    players: Optional[List[int]] = None,
+) -> List[List[float]]:
+    """同じモデルを持つ複数のMCTSを同時に進め，行動確率をまとめて求める
+
+    各ラウンドで全ての木から評価が必要な葉を集め，1回のモデル呼び出しで評価する
+
+    Args:
+        mcts_list (List[MCTS]): MCTSのリスト
+        boards (List[List[List[float]]]): 各MCTSの根となる盤面
+        players (Optional[List[int]], optional): 各盤面の手番のプレイヤー．
+            Noneなら全てプレイヤー1. Defaults to None.
+
+    Returns:
+        List[List[float]]: 各盤面での手番のプレイヤーの行動確率
+    """
+    assert all(mcts.model is mcts_list[0].model for mcts in mcts_list)
+    if players is None:
+        players = [1] * len(mcts_list)
+    roots = [
+        mcts._root(board, player)
+        for mcts, board, player in zip(mcts_list, boards, players)
+    ]
+    done = [mcts._root_visits(s) for mcts, (_, _, s) in zip(mcts_list, roots)]
+    simulations = [0] * len(mcts_list)
+    start = time.perf_counter()
+
+    # 未展開の根を先にまとめて展開し，最初のバッチからノイズを混ぜた行動確率で子を選ぶ
+    ks = [0 if s in mcts.nodes else 1 for mcts, (_, _, s) in zip(mcts_list, roots)]
+    _search_round(mcts_list, roots, players, ks)
+    for i, (mcts, (_, _, s)) in enumerate(zip(mcts_list, roots)):
+        done[i] += ks[i]
+        simulations[i] += ks[i]
+        mcts._add_root_noise(s)
+
+    while True:
+        ks = [
+            0 if mcts._search_done(s, done[i], start) else mcts._next_batch_size(done[i])
+            for i, (mcts, (_, _, s)) in enumerate(zip(mcts_list, roots))
+        ]
+        if not any(ks):
+            break
+        _search_round(mcts_list, roots, players, ks)
+        for i, k in enumerate(ks):
+            done[i] += k
+            simulations[i] += k
+
+    for mcts, k in zip(mcts_list, simulations):
+        mcts._record_search(k, start)
+    return [mcts._action_prob(s, perm) for mcts, (_, perm, s) in zip(mcts_list, roots)]
+
+
+def _search_round(
+    mcts_list: List[MCTS],
+    roots: List[Tuple[List[List[float]], Optional[np.ndarray], Hashable]],
+    players: List[int],
+    ks: List[int],
+) -> None:
+    """各MCTSでks回分のシミュレーションを行い，全ての木の葉を1回のモデル呼び出しで評価する
+
+    Args:
+        mcts_list (List[MCTS]): MCTSのリスト
+        roots (List[Tuple[List[List[float]], Optional[np.ndarray], Hashable]]): 各MCTSの_rootの結果
+        players (List[int]): 各根の手番のプレイヤー
+        ks (List[int]): 各MCTSのシミュレーション回数．0の木は進めない
+    """
+    # 全ての木の葉を集める
+    rounds = []
+    cboards = []
+    for mcts, (board, _, _), player, k in zip(mcts_list, roots, players, ks):
+        if k == 0:
+            continue
+        sims, leaves = mcts._collect(board, player, k)
+        rounds.append((mcts, sims, leaves, player, len(cboards)))
+        cboards.extend(mcts.game.get_canonical_form(b, p) for _, b, p in leaves)
+    if not rounds:
+        return
+
+    # まとめて評価し，それぞれの木に戻す
+    evals = rounds[0][0]._evaluate(cboards)
+    for mcts, sims, leaves, player, offset in rounds:
+        mcts._finish(sims, leaves, evals[offset : offset + len(leaves)], player)
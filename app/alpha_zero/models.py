@@ -13,7 +13,8 @@ class ConstantModel(nn.Module):
 
     def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         action_size = self.game.get_action_size()
-        return torch.Tensor([[1 / action_size] * action_size]), torch.Tensor([[0]])
+        batch = x.numel() // (self.game.get_height() * self.game.get_width() * 2)
+        return torch.full((batch, action_size), 1 / action_size), torch.zeros(batch, 1)
 
 
 # 1層ニューラルネット
@@ -23,13 +24,13 @@ class OneLayerModel(nn.Module):
         self.height = game.get_height()
         self.width = game.get_width()
         self.action_size = game.get_action_size()
-        self.fc_p = nn.Linear(self.height * self.width, self.action_size)
-        self.fc_v = nn.Linear(self.height * self.width, 1)
+        self.fc_p = nn.Linear(self.height * self.width * 2, self.action_size)
+        self.fc_v = nn.Linear(self.height * self.width * 2, 1)
         self.softmax = nn.Softmax(dim=1)
         self.tanh = nn.Tanh()
 
     def forward(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
-        x = x.view(-1, self.height * self.width)
+        x = x.view(-1, self.height * self.width * 2)
         p = self.fc_p(x)
         p = self.softmax(p)
         v = self.fc_v(x)
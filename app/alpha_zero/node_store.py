@@ -0,0 +1,137 @@
+from typing import Hashable, List, Optional
+
+import numpy as np
+
+
+class NodeStore:
+    """MCTSのノードを行ごとに持つ配列のアリーナ
+
+    N, Q, P, VL, 合法手, 子ノードの番号, 子への対称変換の番号をノードごとに
+    1行ずつ確保した配列で持ち，盤面のハッシュからノード番号への辞書は展開時の参照にのみ用いる
+    """
+
+    def __init__(self, action_size: int, capacity: int = 1024):
+        """
+        Args:
+            action_size (int): 非合法手を含めたactionの数
+            capacity (int, optional): 最初に確保するノード数. Defaults to 1024.
+        """
+        self.action_size = action_size
+        self.capacity = 0
+        self.N = np.zeros((0, action_size), dtype=np.int32)
+        self.Q = np.zeros((0, action_size), dtype=np.float32)
+        self.P = np.zeros((0, action_size), dtype=np.float32)
+        self.VL = np.zeros((0, action_size), dtype=np.int32)
+        self.valid = np.zeros((0, action_size), dtype=bool)
+        self.children = np.zeros((0, action_size), dtype=np.int32)
+        self.transforms = np.zeros((0, action_size), dtype=np.int8)
+        self.keys: List[Optional[Hashable]] = []
+        self.index = dict()
+        self.free = []
+        self.size = 0
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.index
+
+    def get(self, key: Hashable) -> Optional[int]:
+        """keyに対応するノード番号を返す
+
+        Args:
+            key (Hashable): 盤面のハッシュ
+
+        Returns:
+            Optional[int]: ノード番号, 存在しなければNone
+        """
+        return self.index.get(key)
+
+    def add(self, key: Hashable, p: np.ndarray, valid: np.ndarray) -> int:
+        """ノードを確保して初期化する
+
+        Args:
+            key (Hashable): 盤面のハッシュ
+            p (np.ndarray): モデルによる行動確率
+            valid (np.ndarray): 合法手のマスク
+
+        Returns:
+            int: ノード番号
+        """
+        if self.free:
+            node = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow(max(1, self.capacity * 2))
+            node = self.size
+            self.size += 1
+
+        self.N[node] = 0
+        self.Q[node] = 0
+        self.P[node] = p
+        self.VL[node] = 0
+        self.valid[node] = valid
+        self.children[node] = -1
+        self.transforms[node] = -1
+        self.keys[node] = key
+        self.index[key] = node
+        return node
+
+    def prune(self, root: int) -> int:
+        """rootから子をたどって到達できないノードを全て解放する
+
+        Args:
+            root (int): 残す部分木の根のノード番号
+
+        Returns:
+            int: 解放したノード数
+        """
+        reachable = np.zeros(self.size, dtype=bool)
+        reachable[root] = True
+        frontier = np.array([root])
+        while len(frontier):
+            children = self.children[frontier].ravel()
+            children = np.unique(children[children >= 0])
+            frontier = children[~reachable[children]]
+            reachable[frontier] = True
+
+        freed = 0
+        for node in np.flatnonzero(~reachable):
+            key = self.keys[node]
+            if key is None:
+                continue
+            del self.index[key]
+            self.keys[node] = None
+            self.free.append(int(node))
+            freed += 1
+        return freed
+
+    def reset(self) -> None:
+        """全てのノードを解放する．配列は確保したまま再利用する"""
+        self.keys = [None] * self.capacity
+        self.index = dict()
+        self.free = []
+        self.size = 0
+
+    def _grow(self, capacity: int) -> None:
+        """配列をcapacity行に拡張する
+
+        Args:
+            capacity (int): 新しいノード数の上限
+        """
+        extra = capacity - self.capacity
+        A = self.action_size
+        self.N = np.concatenate([self.N, np.zeros((extra, A), dtype=np.int32)])
+        self.Q = np.concatenate([self.Q, np.zeros((extra, A), dtype=np.float32)])
+        self.P = np.concatenate([self.P, np.zeros((extra, A), dtype=np.float32)])
+        self.VL = np.concatenate([self.VL, np.zeros((extra, A), dtype=np.int32)])
+        self.valid = np.concatenate([self.valid, np.zeros((extra, A), dtype=bool)])
+        self.children = np.concatenate(
+            [self.children, np.full((extra, A), -1, dtype=np.int32)]
+        )
+        self.transforms = np.concatenate(
+            [self.transforms, np.full((extra, A), -1, dtype=np.int8)]
+        )
+        self.keys.extend([None] * extra)
+        self.capacity = capacity
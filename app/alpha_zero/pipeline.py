@@ -0,0 +1,283 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+import copy
+import logging
+import queue
+import time
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from .profiling import MetricsLogger
+
+if TYPE_CHECKING:
+    from .replay_buffer import ReplayBuffer
+    from .trainer import Trainer
+
+
+def _actor_loop(
+    trainer: "Trainer",
+    shared_model: nn.Module,
+    version: mp.Value,
+    lock: mp.Lock,
+    episodes: mp.Queue,
+    stop: mp.Event,
+    seed: Optional[int],
+) -> None:
+    """最新の採用されたモデルで自己対戦を続け，エピソードをキューに入れる
+
+    Args:
+        trainer (Trainer): 自己対戦の設定
+        shared_model (nn.Module): 共有メモリ上の採用されたモデル
+        version (mp.Value): shared_modelの版．採用されるたびに増える
+        lock (mp.Lock): shared_modelを書き換える間のロック
+        episodes (mp.Queue): (版, エピソード)を入れるキュー
+        stop (mp.Event): 止めるときにセットされる
+        seed (Optional[int]): 乱数のシード
+    """
+    torch.set_num_threads(1)
+    np.random.seed(seed)
+    torch.manual_seed(np.random.randint(2**31))
+    model = copy.deepcopy(shared_model)
+    model_version = -1
+    while not stop.is_set():
+        if version.value != model_version:
+            with lock:
+                model.load_state_dict(shared_model.state_dict())
+                model_version = version.value
+            # 重みが変わったモデルの評価はキャッシュから捨てる
+            if trainer.eval_cache is not None:
+                trainer.eval_cache.invalidate(trainer.search_model(model))
+
+        for episode in trainer._play_seeded_episodes(
+            model, [None] * trainer.num_parallel_episodes
+        ):
+            while not stop.is_set():
+                try:
+                    episodes.put((model_version, episode), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+
+def _gate(
+    trainer: "Trainer", model: nn.Module, candidate: nn.Module
+) -> Tuple[bool, float, int]:
+    """別プロセスでモデル更新の判定を行う"""
+    torch.set_num_threads(1)
+    return trainer.gate(model, candidate)
+
+
+class ActorLearnerPipeline:
+    """自己対戦，学習，モデル更新の判定を並行して進める
+
+    actorのプロセスは最新の採用されたモデルで自己対戦を続けてエピソードをキューに入れ，
+    learnerはキューから受け取った経験をリプレイバッファに加えながら学習を続ける．
+    learnerはgate_interval回更新するごとに今の重みを候補として別のプロセスで判定にかけ，
+    採用されたら共有メモリ上のモデルを書き換える．actorは次のエピソードからそれを使う．
+    学習に使うサンプル数は受け取ったサンプル数のsample_reuse倍までに抑える
+    """
+
+    def __init__(
+        self,
+        trainer: "Trainer",
+        num_actors: int = 1,
+        sample_reuse: float = 4.0,
+        gate_interval: int = 100,
+        max_queue: int = 64,
+    ):
+        """
+        Args:
+            trainer (Trainer): 自己対戦，学習，判定の設定
+            num_actors (int, optional): 自己対戦を行うプロセス数. Defaults to 1.
+            sample_reuse (float, optional): 1つの経験を平均して何回学習に使うか. Defaults to 4.0.
+            gate_interval (int, optional): 判定にかける間隔(学習の更新回数). Defaults to 100.
+            max_queue (int, optional): キューに溜めておく最大エピソード数．
+                溜まるとactorは学習が追いつくまで待つ. Defaults to 64.
+        """
+        self.trainer = trainer
+        self.num_actors = num_actors
+        self.sample_reuse = sample_reuse
+        self.gate_interval = gate_interval
+        self.max_queue = max_queue
+
+    def run(self, model_: nn.Module, num_steps: int) -> nn.Module:
+        """学習の更新をnum_steps回行うまで進める
+
+        Args:
+            model_ (nn.Module): 初期モデル
+            num_steps (int): 学習の更新回数
+
+        Returns:
+            nn.Module: 最後に採用されたモデル
+        """
+        trainer = self.trainer
+        model = copy.deepcopy(model_)
+        shared_model = copy.deepcopy(model).share_memory()
+        # Trainerとtorchの状態を持ったままforkしないよう，actorと判定のプロセスはspawnで立てる
+        ctx = mp.get_context("spawn")
+        version = ctx.Value("i", 0)
+        lock = ctx.Lock()
+        episodes = ctx.Queue(self.max_queue)
+        stop = ctx.Event()
+        actors = [
+            ctx.Process(
+                target=_actor_loop,
+                args=(
+                    trainer,
+                    shared_model,
+                    version,
+                    lock,
+                    episodes,
+                    stop,
+                    None if trainer.seed is None else trainer.seed + j,
+                ),
+                daemon=True,
+            )
+            for j in range(self.num_actors)
+        ]
+        for actor in actors:
+            actor.start()
+
+        buffer = trainer.make_buffer()
+        learner = copy.deepcopy(model)
+        optimizer = torch.optim.Adam(learner.parameters(), trainer.lr)
+        gating = ProcessPoolExecutor(1, mp_context=ctx)
+        pending: Optional[Future] = None
+        candidate = None
+        received = 0
+        trained = 0
+        step = 0
+        start = time.perf_counter()
+        try:
+            with MetricsLogger(trainer.use_wandb) as metrics:
+                while step < num_steps:
+                    # 学習が経験の生成に追いついたらエピソードが来るまで待つ
+                    can_train = (
+                        len(buffer) >= trainer.batch_size
+                        and trained < self.sample_reuse * received
+                    )
+                    received += self._receive(episodes, buffer, not can_train)
+                    if not can_train:
+                        if not any(actor.is_alive() for actor in actors):
+                            raise RuntimeError("all self-play actors exited")
+                        continue
+
+                    x, (p, v) = buffer.sample(trainer.batch_size)
+                    p_pred, v_pred = learner(x)
+                    loss_p = trainer.loss_p(p, p_pred)
+                    loss_v = trainer.loss_v(v, v_pred)
+                    loss = loss_p + loss_v
+                    loss.backward()
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    trained += len(x)
+                    step += 1
+
+                    if step % self.gate_interval == 0:
+                        metrics.log(
+                            {
+                                "step": step,
+                                "loss": loss.item(),
+                                "received_samples": received,
+                                "trained_samples": trained,
+                                "model_version": version.value,
+                                "samples_per_sec": received
+                                / (time.perf_counter() - start),
+                            }
+                        )
+                        # 判定中でなければ今の重みを候補にする
+                        if pending is None:
+                            candidate = copy.deepcopy(learner)
+                            pending = gating.submit(_gate, trainer, model, candidate)
+
+                    if pending is not None and pending.done():
+                        model = self._promote(
+                            pending.result(),
+                            model,
+                            candidate,
+                            shared_model,
+                            version,
+                            lock,
+                            metrics,
+                        )
+                        pending = None
+
+                # 最後の候補の判定は待つ
+                if pending is not None:
+                    model = self._promote(
+                        pending.result(),
+                        model,
+                        candidate,
+                        shared_model,
+                        version,
+                        lock,
+                        metrics,
+                    )
+        finally:
+            stop.set()
+            gating.shutdown()
+            # actorがputで止まらないようキューを空にしてから待つ
+            while any(actor.is_alive() for actor in actors):
+                self._receive(episodes, None, False)
+                for actor in actors:
+                    actor.join(timeout=0.1)
+            if hasattr(buffer, "close"):
+                buffer.close()
+        return model
+
+    def _receive(
+        self, episodes: mp.Queue, buffer: Optional["ReplayBuffer"], block: bool
+    ) -> int:
+        """キューにあるエピソードを全てリプレイバッファに加え，加えた経験の数を返す
+
+        Args:
+            episodes (mp.Queue): (版, エピソード)のキュー
+            buffer (Optional[ReplayBuffer]): リプレイバッファ．Noneなら捨てる
+            block (bool): 1つも来ていなければ少し待つならTrue
+
+        Returns:
+            int: 加えた経験の数
+        """
+        received = 0
+        while True:
+            try:
+                _, episode = episodes.get(block=block, timeout=0.1)
+            except queue.Empty:
+                break
+            block = False
+            if buffer is not None:
+                buffer.extend(episode)
+                received += len(episode)
+        if received:
+            buffer.flush()
+        return received
+
+    def _promote(
+        self,
+        gate_result: Tuple[bool, float, int],
+        model: nn.Module,
+        candidate: nn.Module,
+        shared_model: nn.Module,
+        version: mp.Value,
+        lock: mp.Lock,
+        metrics: MetricsLogger,
+    ) -> nn.Module:
+        """判定の結果を記録し，採用されたら共有メモリ上のモデルを書き換える
+
+        Returns:
+            nn.Module: 採用されたモデル
+        """
+        updated, r, num_played = gate_result
+        metrics.log(
+            {"gating_reward": r, "gating_games": num_played, "updated": updated}
+        )
+        if not updated:
+            return model
+        with lock:
+            shared_model.load_state_dict(candidate.state_dict())
+            version.value += 1
+        logging.info(f"model updated to version {version.value}")
+        return candidate
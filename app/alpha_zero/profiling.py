@@ -0,0 +1,165 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import wandb
+
+
+class PhaseTimer:
+    """学習の段階ごとの経過時間を測る
+
+    段階は入れ子にでき，内側の段階の時間は外側の段階に含めない
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self._stack: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """withの中の時間をnameの段階に加える
+
+        Args:
+            name (str): 段階の名前
+        """
+        now = time.perf_counter()
+        if self._stack:
+            # 外側の段階はここまでの時間を加えて止める
+            outer, start = self._stack[-1]
+            self.times[outer] += now - start
+        self._stack.append((name, now))
+        try:
+            yield
+        finally:
+            name, start = self._stack.pop()
+            now = time.perf_counter()
+            self.times[name] += now - start
+            if self._stack:
+                self._stack[-1] = (self._stack[-1][0], now)
+
+    def reset(self) -> dict:
+        """これまでの時間を返して0に戻す
+
+        Returns:
+            dict: 段階の名前から秒数への辞書
+        """
+        times = dict(self.times)
+        self.times.clear()
+        return times
+
+
+class MetricsLogger:
+    """指標をloggingとwandbに別スレッドで書き出す
+
+    logは指標をキューに入れるだけなので，学習のループを待たせない
+    """
+
+    def __init__(self, use_wandb: bool = False):
+        """
+        Args:
+            use_wandb (bool, optional): wandbにも書き出すならTrue. Defaults to False.
+        """
+        self.use_wandb = use_wandb
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def log(self, metrics: dict, echo: bool = True) -> None:
+        """指標を書き出す
+
+        Args:
+            metrics (dict): 指標の名前から値への辞書
+            echo (bool, optional): loggingにも出すならTrue. Defaults to True.
+        """
+        self._queue.put((metrics, echo))
+
+    def close(self) -> None:
+        """キューに残っている指標を書き出してから止める"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self) -> "MetricsLogger":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            metrics, echo = item
+            try:
+                if echo:
+                    logging.info(
+                        ", ".join(f"{k}: {_format(v)}" for k, v in metrics.items())
+                    )
+                if self.use_wandb:
+                    wandb.log(metrics)
+            except Exception:
+                logging.exception("failed to log metrics")
+
+
+def _format(value: object) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
+
+
+class IterationProfiler:
+    """指定した反復，またはSIGUSR1を受けた次の反復をcProfileで計測する
+
+    結果はprofile_dir/iter_{反復}.profに保存し，pstatsやsnakevizで読める．
+    py-spyなど外から計測するツールと同時に使えるよう，計測中の反復とPIDをログに出す
+    """
+
+    def __init__(self, profile_dir: str, iterations: Tuple[int, ...] = ()):
+        """
+        Args:
+            profile_dir (str): 結果を保存するディレクトリ
+            iterations (Tuple[int, ...], optional): 計測する反復. Defaults to ().
+        """
+        self.profile_dir = profile_dir
+        self.iterations = set(iterations)
+        self.requested = False
+        os.makedirs(profile_dir, exist_ok=True)
+        if (
+            hasattr(signal, "SIGUSR1")
+            and threading.current_thread() is threading.main_thread()
+        ):
+            signal.signal(signal.SIGUSR1, self._request)
+
+    def _request(self, signum: int, frame: object) -> None:
+        self.requested = True
+
+    @contextmanager
+    def iteration(self, i: int) -> Iterator[Optional[str]]:
+        """反復iを計測するならwithの中をcProfileで計測する
+
+        Args:
+            i (int): 反復
+
+        Yields:
+            Iterator[Optional[str]]: 保存先，計測しなければNone
+        """
+        if i not in self.iterations and not self.requested:
+            yield None
+            return
+        self.requested = False
+        path = os.path.join(self.profile_dir, f"iter_{i}.prof")
+        logging.info(f"profiling iteration {i} (pid {os.getpid()}) to {path}")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
@@ -0,0 +1,315 @@
+from contextlib import contextmanager
+import fcntl
+import os
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import torch
+
+from ..games.game import Game
+from .utils import get_board_view
+
+
+class ReplayBuffer:
+    """自己対戦の経験を確保済みのテンソルに保存するリングバッファ
+
+    盤面は追加時に1度だけ(2, 高さ, 幅)のテンソルに変換して書き込み，
+    ミニバッチは添字でまとめて取り出すので，学習時にサンプルごとの変換は行わない
+    """
+
+    def __init__(self, game: Game, capacity: int, augment: bool = False):
+        """
+        Args:
+            game (Game): ゲーム
+            capacity (int): 保存する最大の経験数．あふれたら古いものから上書きする
+            augment (bool, optional): 取り出すときにランダムな対称変換をかけるならTrue.
+                Defaults to False.
+        """
+        self.game = game
+        self.capacity = capacity
+        height, width = game.get_height(), game.get_width()
+        action_size = game.get_action_size()
+        self.boards = torch.zeros((capacity, 2, height, width))
+        self.p = torch.zeros((capacity, action_size))
+        self.v = torch.zeros((capacity, 1))
+        self.cursor = 0
+        self.size = 0
+        self._init_augment(augment)
+
+    def _init_augment(self, augment: bool) -> None:
+        """対称変換をマスの並べ替えとしてまとめて適用するための準備をする"""
+        self.augment = augment
+        if augment:
+            game = self.game
+            assert game.get_action_size() == game.get_height() * game.get_width()
+            perms = [perm for _, perm in game.get_symmetries(game.get_initial_board())]
+            self.perms = torch.from_numpy(np.stack(perms))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def extend(
+        self, experiences: List[Tuple[List[List[float]], List[float], float]]
+    ) -> None:
+        """経験を書き込む
+
+        Args:
+            experiences (List[Tuple[List[List[float]], List[float], float]]): (cboard, p, v)
+        """
+        for cboard, p, v in experiences:
+            i = self.cursor
+            self.boards[i] = torch.from_numpy(
+                np.asarray(get_board_view(cboard), dtype=np.float32)
+            )
+            self.p[i] = torch.as_tensor(p)
+            self.v[i, 0] = v
+            self.cursor = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def flush(self) -> None:
+        """書き込んだ内容を永続化する．メモリ上のバッファでは何もしない"""
+
+    def state_dict(self) -> dict:
+        """保存している経験と書き込み位置のコピーを返す
+
+        Returns:
+            dict: バッファの状態
+        """
+        return {
+            "cursor": self.cursor,
+            "size": self.size,
+            "boards": self.boards[: self.size].clone(),
+            "p": self.p[: self.size].clone(),
+            "v": self.v[: self.size].clone(),
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        """state_dictで得た状態に戻す
+
+        Args:
+            state (dict): バッファの状態
+        """
+        size = state["size"]
+        assert size <= self.capacity
+        self.boards[:size] = state["boards"]
+        self.p[:size] = state["p"]
+        self.v[:size] = state["v"]
+        self.cursor = state["cursor"]
+        self.size = size
+
+    def sample(self, batch_size: int) -> Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]:
+        """一様ランダムに重複を許してミニバッチを取り出す
+
+        Args:
+            batch_size (int): バッチサイズ
+
+        Returns:
+            Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]: x, (p, v)
+        """
+        return self.gather(torch.randint(len(self), (batch_size,)))
+
+    def batches(
+        self, batch_size: int, shuffle: bool = True
+    ) -> Iterator[Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]]:
+        """全ての経験を1回ずつミニバッチにして返す
+
+        Args:
+            batch_size (int): バッチサイズ
+            shuffle (bool, optional): 順番をランダムにするならTrue. Defaults to True.
+
+        Yields:
+            Iterator[Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]]: x, (p, v)
+        """
+        size = len(self)
+        order = torch.randperm(size) if shuffle else torch.arange(size)
+        for index in order.split(batch_size):
+            yield self.gather(index)
+
+    def gather(
+        self, index: torch.Tensor
+    ) -> Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]:
+        """添字の経験をまとめて取り出す
+
+        Args:
+            index (torch.Tensor): 添字
+
+        Returns:
+            Tuple[torch.Tensor, Tuple[torch.Tensor, ...]]: x, (p, v)
+        """
+        x, p, v = self._read(index)
+        if self.augment:
+            perm = self.perms[torch.randint(len(self.perms), (len(index),))]
+            shape = x.shape
+            x = x.flatten(2).gather(2, perm.unsqueeze(1).expand(-1, 2, -1))
+            x = x.view(shape)
+            p = p.gather(1, perm)
+        return x, (p, v)
+
+    def _read(self, index: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        """添字の経験を(x, p, v)のテンソルで読み出す"""
+        return self.boards[index], self.p[index], self.v[index]
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """メモリマップしたファイルに経験を保存するリングバッファ
+
+    ファイルはヘッダと固定長のレコードからなり，レコードには盤面(int8)，
+    行動確率(float32)，報酬(float32)が並ぶ．書き込み位置と経験数はヘッダに持つので
+    プロセスを再起動しても続きから使え，読み書きはファイルロックで排他するので
+    複数の学習・自己対戦プロセスから共有できる
+    """
+
+    MAGIC = b"AZRB"
+    VERSION = 1
+    HEADER_SIZE = 64
+    HEADER_DTYPE = np.dtype(
+        [
+            ("magic", "S4"),
+            ("version", "<u4"),
+            ("capacity", "<u8"),
+            ("height", "<u4"),
+            ("width", "<u4"),
+            ("action_size", "<u4"),
+            ("cursor", "<u8"),
+            ("size", "<u8"),
+        ]
+    )
+
+    def __init__(self, path: str, game: Game, capacity: int, augment: bool = False):
+        """
+        Args:
+            path (str): ファイルのパス．存在すれば開き，なければ作る
+            game (Game): ゲーム
+            capacity (int): 保存する最大の経験数．あふれたら古いものから上書きする
+            augment (bool, optional): 取り出すときにランダムな対称変換をかけるならTrue.
+                Defaults to False.
+        """
+        self.game = game
+        self.capacity = capacity
+        self.path = path
+        height, width = game.get_height(), game.get_width()
+        action_size = game.get_action_size()
+        self.record_dtype = np.dtype(
+            [
+                ("board", "i1", (height * width,)),
+                ("p", "<f4", (action_size,)),
+                ("v", "<f4"),
+            ]
+        )
+
+        expected = (capacity, height, width, action_size)
+        self._file = open(path, "a+b")
+        with self._lock(fcntl.LOCK_EX):
+            if os.path.getsize(path) == 0:
+                self._file.truncate(
+                    self.HEADER_SIZE + capacity * self.record_dtype.itemsize
+                )
+                header = np.memmap(path, self.HEADER_DTYPE, "r+", shape=(1,))
+                header[0] = (self.MAGIC, self.VERSION, *expected, 0, 0)
+                header.flush()
+            self.header = np.memmap(path, self.HEADER_DTYPE, "r+", shape=(1,))
+            h = self.header[0]
+            if h["magic"] != self.MAGIC or h["version"] != self.VERSION:
+                raise ValueError(f"{path} is not a replay buffer file")
+            found = tuple(
+                int(h[k]) for k in ["capacity", "height", "width", "action_size"]
+            )
+            if found != expected:
+                raise ValueError(f"{path} was created for {found}, not {expected}")
+        self.records = np.memmap(
+            path, self.record_dtype, "r+", offset=self.HEADER_SIZE, shape=(capacity,)
+        )
+        self._init_augment(augment)
+
+    def __len__(self) -> int:
+        with self._lock(fcntl.LOCK_SH):
+            return int(self.header["size"][0])
+
+    def extend(
+        self, experiences: List[Tuple[List[List[float]], List[float], float]]
+    ) -> None:
+        """経験を書き込む
+
+        Args:
+            experiences (List[Tuple[List[List[float]], List[float], float]]): (cboard, p, v)
+        """
+        with self._lock(fcntl.LOCK_EX):
+            cursor = int(self.header["cursor"][0])
+            size = int(self.header["size"][0])
+            for cboard, p, v in experiences:
+                self.records[cursor] = (np.asarray(cboard, dtype=np.int8).ravel(), p, v)
+                cursor = (cursor + 1) % self.capacity
+                size = min(size + 1, self.capacity)
+            self.header["cursor"][0] = cursor
+            self.header["size"][0] = size
+
+    def flush(self) -> None:
+        """書き込んだ内容をファイルに反映する"""
+        with self._lock(fcntl.LOCK_SH):
+            self.records.flush()
+            self.header.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def state_dict(self) -> dict:
+        """保存している経験と書き込み位置のコピーを返す
+
+        ファイルはこの後も書き込まれるので，今の内容をコピーしておく
+
+        Returns:
+            dict: バッファの状態
+        """
+        with self._lock(fcntl.LOCK_SH):
+            cursor = int(self.header["cursor"][0])
+            size = int(self.header["size"][0])
+            records = self.records[:size]
+            state = {
+                "cursor": cursor,
+                "size": size,
+                "board": torch.from_numpy(records["board"].copy()),
+                "p": torch.from_numpy(records["p"].copy()),
+                "v": torch.from_numpy(records["v"].copy()),
+            }
+        return state
+
+    def load_state_dict(self, state: dict) -> None:
+        """state_dictで得た状態に戻す
+
+        Args:
+            state (dict): バッファの状態
+        """
+        size = state["size"]
+        assert size <= self.capacity
+        with self._lock(fcntl.LOCK_EX):
+            self.records["board"][:size] = state["board"].numpy()
+            self.records["p"][:size] = state["p"].numpy()
+            self.records["v"][:size] = state["v"].numpy()
+            self.header["cursor"][0] = state["cursor"]
+            self.header["size"][0] = size
+        self.flush()
+
+    def _read(self, index: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        """添字のレコードだけを読み出してテンソルにする"""
+        with self._lock(fcntl.LOCK_SH):
+            records = self.records[index.numpy()]
+        board = torch.from_numpy(records["board"].copy())
+        x = torch.stack([board == 1, board == -1], dim=1).float()
+        x = x.view(len(index), 2, self.game.get_height(), self.game.get_width())
+        p = torch.from_numpy(records["p"].copy())
+        v = torch.from_numpy(records["v"].copy())
+        return x, p, v[:, None]
+
+    @contextmanager
+    def _lock(self, operation: int) -> Iterator[None]:
+        """ファイルロックを取る
+
+        Args:
+            operation (int): fcntl.LOCK_SHまたはfcntl.LOCK_EX
+        """
+        fcntl.flock(self._file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
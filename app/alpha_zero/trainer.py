@@ -1,32 +1,54 @@
-from collections import deque
+from collections import Counter
+from contextlib import nullcontext
 import copy
 import logging
-from typing import Tuple, List
+import multiprocessing as mp
+import os
+from typing import Iterator, Optional, Tuple, List, Union
 
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset
 from tqdm import tqdm
-import wandb
 
 from ..games.game import Game
+from ..games.vector_env import make_vector_env
 from ..games.players import MCTSPlayer, RandomPlayer, NeuralNetPlayer
-from .mcts import MCTS
-from .utils import eval_player, get_board_view
+from ..games.sprt import SPRT
+from .checkpoint import CheckpointWriter, get_rng_state, load_checkpoint, set_rng_state
+from .eval_cache import EvaluationCache
+from .inference import InferenceModel, compare_models, inference_model
+from .mcts import MCTS, get_action_probs
+from .pipeline import ActorLearnerPipeline
+from .profiling import IterationProfiler, MetricsLogger, PhaseTimer
+from .replay_buffer import MemmapReplayBuffer, ReplayBuffer
+from .utils import eval_player, eval_player_sprt, get_board_view
 
 
 class AlphaZeroDataset(Dataset):
-    def __init__(self, experiences: List[Tuple[List[List[float]], List[float], float]]):
+    def __init__(
+        self,
+        experiences: List[Tuple[List[List[float]], List[float], float]],
+        game: Optional[Game] = None,
+    ):
         """
         Args:
             experiences (List[Tuple[List[List[float]], List[float], float]]): (cboard, p, v)
+            game (Optional[Game], optional): 渡すと取り出すたびにランダムな対称変換をかける.
+                Defaults to None.
         """
         self.boards, self.p, self.v = zip(*experiences)
+        self.game = game
 
     def __getitem__(self, index):
-        return torch.Tensor(get_board_view(self.boards[index])), (  # type: ignore
-            torch.Tensor(self.p[index]),
+        board, p = self.boards[index], self.p[index]
+        if self.game is not None:
+            symmetries = self.game.get_symmetries(board)
+            board, perm = symmetries[np.random.randint(len(symmetries))]
+            p = np.asarray(p)[perm]
+        return torch.Tensor(get_board_view(board)), (  # type: ignore
+            torch.Tensor(p),
             torch.Tensor([self.v[index]]),
         )
 
@@ -34,6 +56,31 @@ class AlphaZeroDataset(Dataset):
         return len(self.boards)
 
 
+# 自己対戦ワーカーのプロセスごとの状態
+_worker_state = dict()
+
+
+def _init_self_play_worker(trainer: "Trainer", model: nn.Module) -> None:
+    """自己対戦ワーカーの初期化．現在のモデルを受け取って保持する"""
+    torch.set_num_threads(1)
+
+    # ワーカー間で同じ乱数列にならないようにシードを取り直す
+    np.random.seed()
+    torch.seed()
+    _worker_state["trainer"] = trainer
+    _worker_state["model"] = model
+
+
+def _self_play_worker(
+    seeds: List[Optional[int]],
+) -> Tuple[List[List[Tuple[List[List[float]], List[float], float]]], Counter]:
+    """ワーカー内でシードごとに1回ずつ自己対戦を行い，MCTSの累計とともに返す"""
+    trainer = _worker_state["trainer"]
+    trainer.search_counters = Counter()
+    episodes = trainer._play_seeded_episodes(_worker_state["model"], seeds)
+    return episodes, trainer.search_counters
+
+
 class Trainer:
     def __init__(
         self,
@@ -50,6 +97,27 @@ class Trainer:
         tau: float,
         num_search: int,
         use_wandb: float = False,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        cache_size: int = 100000,
+        use_symmetry: bool = False,
+        augment: bool = False,
+        buffer_path: Optional[str] = None,
+        eval_batched: bool = False,
+        eval_workers: int = 1,
+        sprt: Optional[SPRT] = None,
+        sprt_games_per_round: int = 1,
+        num_parallel_episodes: int = 1,
+        compile_inference: bool = False,
+        quantize_inference: bool = False,
+        quantize_holdout: float = 0.05,
+        profile_dir: Optional[str] = None,
+        profile_iterations: Tuple[int, ...] = (),
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval: int = 1,
+        fpu: float = 0.0,
+        dirichlet_alpha: Optional[float] = None,
+        dirichlet_eps: float = 0.25,
     ):
         """
         Args:
@@ -64,6 +132,50 @@ class Trainer:
             tau (float): MCTSのtau
             num_search (int): MCTSのnum_search
             use_wandb (float, optional): wandbを使うならTrue
+            num_workers (int, optional): 自己対戦を行うプロセス数. Defaults to 1.
+            seed (Optional[int], optional): 自己対戦の乱数のシード．
+                指定するとエピソードごとにシードを固定し，プロセス数や同時に進める数によらず
+                同じ結果になる. Defaults to None.
+            cache_size (int, optional): MCTSが共有するモデルの評価のキャッシュの大きさ．
+                0ならキャッシュしない. Defaults to 100000.
+            use_symmetry (bool, optional): MCTSで対称な盤面を同じノードとして扱うならTrue.
+                Defaults to False.
+            augment (bool, optional): 学習時に盤面をランダムに対称変換するならTrue.
+                Defaults to False.
+            buffer_path (Optional[str], optional): 指定すると経験をこのファイルに保存し，
+                再起動後や他のプロセスと共有して使う. Defaults to None.
+            eval_batched (bool, optional): モデルの評価の対戦を同時に進め，
+                モデルの呼び出しをまとめるならTrue. Defaults to False.
+            eval_workers (int, optional): eval_batchedのとき評価の対戦を行うプロセス数.
+                Defaults to 1.
+            sprt (Optional[SPRT], optional): 指定するとモデル更新の判定の対戦を
+                SPRTで判定がついた時点で打ち切り，その結果で更新する．
+                num_game局までに決まらなければ平均報酬で判定する. Defaults to None.
+            sprt_games_per_round (int, optional): sprtの検定の間に先手・後手それぞれで
+                行う対戦数. Defaults to 1.
+            num_parallel_episodes (int, optional): 1プロセスで同時に進める自己対戦の数．
+                1より大きければ全ての対局の葉をまとめてモデルで評価する. Defaults to 1.
+            compile_inference (bool, optional): MCTSでモデルの代わりにTorchScriptへ変換した
+                推論専用のコピーを使うならTrue．コピーはモデルの重みが変わると作り直される.
+                Defaults to False.
+            quantize_inference (bool, optional): 自己対戦とモデル更新の判定のMCTSで
+                全結合層をint8に動的量子化したコピーを使うならTrue．学習はfloat32のまま行う.
+                Defaults to False.
+            quantize_holdout (float, optional): quantize_inferenceのとき，学習に使わずに
+                量子化による評価のずれを測るために取っておく自己対戦の割合．
+                各反復でround(num_episode * quantize_holdout)個のエピソードを等間隔に選び，
+                選ぶエピソードは反復ごとにずらす．0個になる反復ではずれを測らない.
+                Defaults to 0.05.
+            profile_dir (Optional[str], optional): 指定するとprofile_iterationsの反復と，
+                SIGUSR1を受けた次の反復をcProfileで計測してここに保存する. Defaults to None.
+            profile_iterations (Tuple[int, ...], optional): 計測する反復. Defaults to ().
+            checkpoint_path (Optional[str], optional): 指定すると学習の状態をここに保存し，
+                train(resume=True)でその続きから学習できる. Defaults to None.
+            checkpoint_interval (int, optional): 学習の状態を保存する間隔(反復数). Defaults to 1.
+            fpu (float, optional): MCTSで一度も訪れていない子のQとして使う値. Defaults to 0.0.
+            dirichlet_alpha (Optional[float], optional): 指定すると自己対戦のMCTSの根の
+                行動確率にこのパラメータのディリクレノイズを混ぜる. Defaults to None.
+            dirichlet_eps (float, optional): 根の行動確率に混ぜるノイズの割合. Defaults to 0.25.
         """
         self.game = game
         self.num_iter = num_iter
@@ -78,33 +190,139 @@ class Trainer:
         self.tau = tau
         self.num_search = num_search
         self.use_wandb = use_wandb
+        self.num_workers = num_workers
+        self.seed = seed
+        self.eval_cache = EvaluationCache(cache_size) if cache_size > 0 else None
+        self.use_symmetry = use_symmetry
+        self.augment = augment
+        self.buffer_path = buffer_path
+        self.eval_batched = eval_batched
+        self.eval_workers = eval_workers
+        self.sprt = sprt
+        self.sprt_games_per_round = sprt_games_per_round
+        self.num_parallel_episodes = num_parallel_episodes
+        self.compile_inference = compile_inference
+        self.quantize_inference = quantize_inference
+        self.quantize_holdout = quantize_holdout
+        self.profile_dir = profile_dir
+        self.profile_iterations = profile_iterations
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.fpu = fpu
+        self.dirichlet_alpha = dirichlet_alpha
+        self.dirichlet_eps = dirichlet_eps
+        # 自己対戦のMCTSの累計
+        self.search_counters = Counter()
+
+    def make_mcts(
+        self,
+        model: nn.Module,
+        self_play: bool = False,
+        rng: Optional[np.random.RandomState] = None,
+    ) -> MCTS:
+        """学習の設定でMCTSを作る．モデルの評価のキャッシュは全てのMCTSで共有する
+
+        Args:
+            model (nn.Module): boardを受け取り(p, v)を返すモデル
+            self_play (bool, optional): 自己対戦に使うならTrue．根にディリクレノイズを混ぜる.
+                Defaults to False.
+            rng (Optional[np.random.RandomState], optional): ノイズに使う乱数生成器．
+                Noneならnp.randomを使う. Defaults to None.
+
+        Returns:
+            MCTS: MCTS
+        """
+        return MCTS(
+            self.game,
+            self.search_model(model),
+            self.alpha,
+            self.tau,
+            self.num_search,
+            cache=self.eval_cache,
+            use_symmetry=self.use_symmetry,
+            fpu=self.fpu,
+            dirichlet_alpha=self.dirichlet_alpha if self_play else None,
+            dirichlet_eps=self.dirichlet_eps,
+            rng=rng,
+        )
+
+    def search_model(self, model: nn.Module) -> Union[nn.Module, InferenceModel]:
+        """MCTSで用いるモデルを返す．compile_inferenceかquantize_inferenceなら推論用のラッパー
+
+        Args:
+            model (nn.Module): boardを受け取り(p, v)を返すモデル
+
+        Returns:
+            Union[nn.Module, InferenceModel]: MCTSに渡すモデル
+        """
+        if self.compile_inference or self.quantize_inference:
+            return inference_model(model, self.game, self.quantize_inference)
+        return model
+
+    def check_quantization(
+        self,
+        model: nn.Module,
+        experiences: List[Tuple[List[List[float]], List[float], float]],
+    ) -> dict:
+        """量子化したモデルの評価のfloat32のモデルからのずれを測る
+
+        Args:
+            model (nn.Module): float32のモデル
+            experiences (List[Tuple[List[List[float]], List[float], float]]): 学習に使っていない経験
+
+        Returns:
+            dict: 行動確率のKLダイバージェンス(policy_kl)と評価値の平均二乗誤差(value_mse)
+        """
+        x = torch.Tensor(
+            np.array([get_board_view(cboard) for cboard, _, _ in experiences])
+        )
+        return compare_models(model, inference_model(model, self.game, True), x)
+
+    def make_buffer(self) -> ReplayBuffer:
+        """学習の設定でリプレイバッファを作る．buffer_pathがあればファイルに保存する
+
+        Returns:
+            ReplayBuffer: リプレイバッファ
+        """
+        if self.buffer_path is not None:
+            return MemmapReplayBuffer(
+                self.buffer_path, self.game, self.buffer_size, self.augment
+            )
+        return ReplayBuffer(self.game, self.buffer_size, self.augment)
 
     def play_episode(
-        self, model: nn.Module
+        self, model: nn.Module, rng: Optional[np.random.RandomState] = None
     ) -> List[Tuple[List[List[float]], List[float], float]]:
         """ゲームを1回プレイしその履歴を返す
 
         Args:
             model (nn.Module): boardを受け取り(p, v)を返すモデル
+            rng (Optional[np.random.RandomState], optional): 着手の選択と根のノイズに使う
+                乱数生成器．Noneならnp.randomを使う. Defaults to None.
 
         Returns:
             List[Tuple[List[List[float]], List[float], float]]: (cboard, p, v)
         """
-        mcts = MCTS(self.game, model, self.alpha, self.tau, self.num_search)
+        mcts = self.make_mcts(model, self_play=True, rng=rng)
+        if rng is None:
+            rng = np.random
         board = self.game.get_initial_board()
         player = 1
         experience = []
         while not self.game.get_game_ended(board, player):
             cboard = self.game.get_canonical_form(board, player)
-            p = mcts.get_action_prob(cboard)
+            # 実際の盤面で探索し，前の手番の探索の木を再利用する
+            p = mcts.get_action_prob(board, player)
 
             # 学習用にはカノニカルな表現を用いる
             # 報酬は途中解らないのでとりあえずplayerを入れておく
             experience.append([cboard, p, player])
 
-            action = np.random.choice(len(p), p=p)
+            action = rng.choice(len(p), p=p)
             board, player = self.game.get_next_state(board, player, action)
 
+        self.search_counters.update(mcts.counters)
+
         # 報酬を入れ直す
         v = self.game.get_reward(board, 1)
         for i in range(len(experience)):
@@ -113,33 +331,295 @@ class Trainer:
 
         return experience
 
-    def train(self, model_: nn.Module) -> nn.Module:
+    def self_play(
+        self, model: nn.Module, iteration: int = 0
+    ) -> Iterator[List[Tuple[List[List[float]], List[float], float]]]:
+        """num_episode回の自己対戦を行い，終わったエピソードから順に返す
+
+        num_workers > 1ならプロセスを立ててエピソードを分担する
+
+        Args:
+            model (nn.Module): boardを受け取り(p, v)を返すモデル
+            iteration (int, optional): 何回目のモデル更新か．シードの計算に用いる. Defaults to 0.
+
+        Yields:
+            Iterator[List[Tuple[List[List[float]], List[float], float]]]: 1エピソード分の(cboard, p, v)
+        """
+        if self.seed is None:
+            seeds = [None] * self.num_episode
+        else:
+            start = self.seed + iteration * self.num_episode
+            seeds = list(range(start, start + self.num_episode))
+
+        # num_parallel_episodes個ずつ同時に進める
+        chunks = [
+            seeds[start : start + self.num_parallel_episodes]
+            for start in range(0, self.num_episode, self.num_parallel_episodes)
+        ]
+
+        if self.num_workers <= 1:
+            for chunk in chunks:
+                yield from self._play_seeded_episodes(model, chunk)
+            return
+
+        # ログを書くスレッドが動いている中でforkしないよう，spawnで立てる
+        with mp.get_context("spawn").Pool(
+            self.num_workers, _init_self_play_worker, (self, model)
+        ) as pool:
+            for episodes, counters in pool.imap(_self_play_worker, chunks):
+                self.search_counters.update(counters)
+                yield from episodes
+
+    def play_episodes(
+        self,
+        model: nn.Module,
+        num_games: int,
+        rngs: Optional[List[Optional[np.random.RandomState]]] = None,
+    ) -> List[List[Tuple[List[List[float]], List[float], float]]]:
+        """num_games回のゲームを同時に進め，それぞれの履歴を返す
+
+        盤面はVectorEnvでまとめて進め，各手番で全ての対局の探索の葉を
+        1回のモデル呼び出しで評価する
+
+        Args:
+            model (nn.Module): boardを受け取り(p, v)を返すモデル
+            num_games (int): ゲーム数
+            rngs (Optional[List[Optional[np.random.RandomState]]], optional): 各ゲームの
+                着手の選択と根のノイズに使う乱数生成器．Noneのゲームはnp.randomを使う.
+                Defaults to None.
+
+        Returns:
+            List[List[Tuple[List[List[float]], List[float], float]]]: 各ゲームの(cboard, p, v)
+        """
+        if rngs is None:
+            rngs = [None] * num_games
+        env = make_vector_env(self.game, num_games)
+        trees = [self.make_mcts(model, self_play=True, rng=rng) for rng in rngs]
+        rngs = [np.random if rng is None else rng for rng in rngs]
+        experiences = [[] for _ in range(num_games)]
+        actions = np.zeros(num_games, dtype=np.int64)
+        while True:
+            active = np.flatnonzero(~env.is_terminal())
+            if len(active) == 0:
+                break
+
+            boards = [env.get_board(i) for i in active]
+            players = [int(env.players[i]) for i in active]
+            ps = get_action_probs([trees[i] for i in active], boards, players)
+            for i, board, player, p in zip(active, boards, players, ps):
+                # 報酬は途中解らないのでとりあえずplayerを入れておく
+                cboard = self.game.get_canonical_form(board, player)
+                experiences[i].append([cboard, p, player])
+                actions[i] = rngs[i].choice(len(p), p=p)
+            env.step(actions)
+
+        for tree in trees:
+            self.search_counters.update(tree.counters)
+
+        # playerから見た報酬を入れ直す
+        rewards = env.reward()
+        for experience, v in zip(experiences, rewards):
+            for e in experience:
+                e[2] = e[2] * int(v)
+        return experiences
+
+    def _play_seeded_episodes(
+        self, model: nn.Module, seeds: List[Optional[int]]
+    ) -> List[List[Tuple[List[List[float]], List[float], float]]]:
+        """シードごとに1回ずつ自己対戦を行う
+
+        エピソードごとにそのシードの乱数生成器を使うので，同時に進めるかどうかによらず
+        同じシードのエピソードは同じになる．シードがNoneのエピソードはnp.randomを使う
+        """
+        if seeds[0] is not None:
+            torch.manual_seed(seeds[0])
+        rngs = [None if seed is None else np.random.RandomState(seed) for seed in seeds]
+        if len(seeds) == 1:
+            return [self.play_episode(model, rngs[0])]
+        return self.play_episodes(model, len(seeds), rngs)
+
+    def train(self, model_: nn.Module, resume: bool = False) -> nn.Module:
         """モデルのトレーニング
 
+        反復ごとに段階別の時間と自己対戦の速さ，MCTSの累計をログに出す．
+        checkpoint_pathがあればcheckpoint_interval回の反復ごとに学習の状態を保存する
+
         Args:
             model_ (nn.Module): 初期モデル
+            resume (bool, optional): checkpoint_pathに保存した状態があれば
+                その続きから学習するならTrue. Defaults to False.
 
         Returns:
             nn.Module: 学習済みモデル
         """
         model = copy.deepcopy(model_)
-        experiences = deque(maxlen=self.buffer_size)
-        for i in tqdm(range(self.num_iter)):
-            # 自己対戦を行う
-            for episode in range(self.num_episode):
-                experiences.extend(self.play_episode(model))
+        buffer = self.make_buffer()
+        start = 0
+        if resume and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            start = self.load_checkpoint(self.checkpoint_path, model, buffer)
+            logging.info(f"resumed from iteration {start}")
+
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = IterationProfiler(self.profile_dir, self.profile_iterations)
+        writer = None
+        if self.checkpoint_path is not None:
+            writer = CheckpointWriter(self.checkpoint_path)
+        with MetricsLogger(self.use_wandb) as metrics:
+            for i in tqdm(
+                range(start, self.num_iter), initial=start, total=self.num_iter
+            ):
+                with profiler.iteration(i) if profiler else nullcontext():
+                    model = self._train_iteration(i, model, buffer, metrics)
+                last = i + 1 == self.num_iter
+                if writer is not None and (
+                    (i + 1) % self.checkpoint_interval == 0 or last
+                ):
+                    # 書き出しは次の反復と並行して行う
+                    writer.save(self.checkpoint_state(i + 1, model, buffer))
+        if writer is not None:
+            writer.wait()
+        return model
+
+    def checkpoint_state(
+        self,
+        iteration: int,
+        model: nn.Module,
+        buffer: ReplayBuffer,
+    ) -> dict:
+        """学習の状態のコピーを返す
+
+        候補のモデルとoptimizerは反復ごとに作り直すので保存しない
+
+        Args:
+            iteration (int): 終えた反復の数
+            model (nn.Module): 現在のモデル
+            buffer (ReplayBuffer): リプレイバッファ
+
+        Returns:
+            dict: 学習の状態
+        """
+        return {
+            "iteration": iteration,
+            "model": copy.deepcopy(model.state_dict()),
+            "buffer": buffer.state_dict(),
+            "rng": get_rng_state(),
+        }
+
+    def load_checkpoint(self, path: str, model: nn.Module, buffer: ReplayBuffer) -> int:
+        """保存した学習の状態をモデルとリプレイバッファ，乱数に戻す
+
+        Args:
+            path (str): ファイルのパス
+            model (nn.Module): 状態を戻すモデル
+            buffer (ReplayBuffer): 状態を戻すリプレイバッファ
+
+        Returns:
+            int: 終えた反復の数
+        """
+        state = load_checkpoint(path)
+        model.load_state_dict(state["model"])
+        buffer.load_state_dict(state["buffer"])
+        set_rng_state(state["rng"])
+        return state["iteration"]
+
+    def train_async(
+        self,
+        model_: nn.Module,
+        num_steps: int,
+        sample_reuse: float = 4.0,
+        gate_interval: int = 100,
+        max_queue: int = 64,
+    ) -> nn.Module:
+        """自己対戦，学習，モデル更新の判定を並行して進めてモデルを学習する
+
+        num_workers個のプロセスが自己対戦を続け，その間に学習と判定を進める．
+        詳細はActorLearnerPipelineを参照
+
+        Args:
+            model_ (nn.Module): 初期モデル
+            num_steps (int): 学習の更新回数
+            sample_reuse (float, optional): 1つの経験を平均して何回学習に使うか. Defaults to 4.0.
+            gate_interval (int, optional): 判定にかける間隔(学習の更新回数). Defaults to 100.
+            max_queue (int, optional): 学習を待つ最大エピソード数. Defaults to 64.
+
+        Returns:
+            nn.Module: 最後に採用されたモデル
+        """
+        pipeline = ActorLearnerPipeline(
+            self, self.num_workers, sample_reuse, gate_interval, max_queue
+        )
+        return pipeline.run(model_, num_steps)
+
+    def _held_out_episodes(self, iteration: int) -> set:
+        """量子化による評価のずれを測るために学習に使わないエピソードの番号を返す
+
+        round(num_episode * quantize_holdout)個を等間隔に選び，反復ごとにずらす．
+        0個なら空集合を返し，ずれは測らない
+
+        Args:
+            iteration (int): 何回目の反復か
+
+        Returns:
+            set: 取っておくエピソードの番号
+        """
+        if not self.quantize_inference:
+            return set()
+        num_held_out = round(self.num_episode * self.quantize_holdout)
+        if num_held_out == 0:
+            return set()
+        stride = self.num_episode / num_held_out
+        return {
+            (iteration + int(k * stride)) % self.num_episode
+            for k in range(num_held_out)
+        }
+
+    def _train_iteration(
+        self,
+        i: int,
+        model: nn.Module,
+        buffer: ReplayBuffer,
+        metrics: MetricsLogger,
+    ) -> nn.Module:
+        """自己対戦，学習，モデル更新の判定，評価を1回ずつ行う
+
+        Args:
+            i (int): 何回目の反復か
+            model (nn.Module): 現在のモデル
+            buffer (ReplayBuffer): リプレイバッファ
+            metrics (MetricsLogger): 指標の書き出し先
 
-            # new_modelに対して学習を行う
+        Returns:
+            nn.Module: 反復後のモデル
+        """
+        timer = PhaseTimer()
+        self.search_counters = Counter()
+        num_positions = 0
+
+        # 自己対戦を行う．量子化するなら一部のエピソードは評価のずれを測るために取っておく
+        held_out = []
+        held_out_episodes = self._held_out_episodes(i)
+        with timer.phase("self_play"):
+            for j, experience in enumerate(self.self_play(model, i)):
+                num_positions += len(experience)
+                with timer.phase("buffer"):
+                    if j in held_out_episodes:
+                        held_out.extend(experience)
+                    else:
+                        buffer.extend(experience)
+        with timer.phase("buffer"):
+            buffer.flush()
+
+        # new_modelに対して学習を行う
+        with timer.phase("train"):
             new_model = copy.deepcopy(model)
             optimizer = torch.optim.Adam(new_model.parameters(), self.lr)
-            logging.info(len(experiences))
-            dataset = AlphaZeroDataset(list(experiences))
-            dataloader = DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
+            logging.info(len(buffer))
             for epoch in range(self.num_epoch):
                 loss_p_ave = 0
                 loss_v_ave = 0
                 cnt = 0
-                for x, (p, v) in dataloader:
+                for x, (p, v) in buffer.batches(self.batch_size):
                     p_pred, v_pred = new_model(x)
                     loss_p = self.loss_p(p, p_pred)
                     loss_v = self.loss_v(v, v_pred)
@@ -149,40 +629,145 @@ class Trainer:
                     optimizer.zero_grad()
 
                     # 平均損失を計算
-                    loss_p_ave += loss_p * v.size()[0]
-                    loss_v_ave += loss_v * v.size()[0]
+                    loss_p_ave += loss_p.item() * v.size()[0]
+                    loss_v_ave += loss_v.item() * v.size()[0]
                     cnt += v.size()[0]
 
                 # 平均損失を表示
                 loss_p_ave /= cnt
                 loss_v_ave /= cnt
                 logging.info(f"loss for p: {loss_p_ave}, loss for v: {loss_v_ave}")
-                if self.use_wandb:
-                    wandb.log({"loss": loss_p_ave + loss_v_ave})
-
-            # modelと対戦時のnew_modelの平均報酬を計算
-            pmcts = MCTS(self.game, model, self.alpha, self.tau, self.num_search)
-            nmcts = MCTS(self.game, new_model, self.alpha, self.tau, self.num_search)
-            prev_player = MCTSPlayer(pmcts)
-            next_player = MCTSPlayer(nmcts)
-            r = eval_player(next_player, prev_player, self.game, self.num_game)
-            logging.info(f"average reward: {r}")
+                metrics.log({"loss": loss_p_ave + loss_v_ave}, echo=False)
+
+        # modelと対戦時のnew_modelの平均報酬を計算
+        with timer.phase("gating"):
+            updated, r, num_played = self.gate(model, new_model)
+        if self.sprt is not None:
+            metrics.log({"gating_games": num_played}, echo=False)
 
-            # 平均報酬がr_threshより高ければモデルを更新
-            if r > self.r_thresh:
-                logging.info("model updated")
-                model = new_model
+        # 平均報酬がr_threshより高ければ(SPRTではH1を採択すれば)モデルを更新
+        # 使わなくなった方のモデルの評価はキャッシュから捨てる
+        if updated:
+            logging.info("model updated")
+            model, new_model = new_model, model
+        if self.eval_cache is not None:
+            self.eval_cache.invalidate(self.search_model(new_model))
+            logging.info(f"evaluation cache: {self.eval_cache.stats()}")
+        if held_out:
+            with timer.phase("quantization_check"):
+                error = self.check_quantization(model, held_out)
+            logging.info(f"quantization error: {error}")
+            metrics.log({f"quantization_{k}": v for k, v in error.items()}, echo=False)
 
-            # 学習前のモデルを用いたmctsと対戦させ評価
+        # 学習前のモデルを用いたmctsと対戦させ評価
+        with timer.phase("evaluation"):
             random_player = RandomPlayer(self.game)
             nnet_player = NeuralNetPlayer(self.game, model)
-            r = eval_player(nnet_player, random_player, self.game, self.num_game)
-            logging.info(f"average reward(v.s. random: {r}")
-            if self.use_wandb:
-                wandb.log({"ave_reward": r})
+            r = eval_player(
+                nnet_player,
+                random_player,
+                self.game,
+                self.num_game,
+                self.eval_batched,
+                self.eval_workers,
+            )
+        logging.info(f"average reward(v.s. random: {r}")
+        metrics.log({"ave_reward": r}, echo=False)
 
+        metrics.log(
+            self._iteration_metrics(i, timer.reset(), num_positions, len(buffer))
+        )
         return model
 
+    def gate(self, model: nn.Module, new_model: nn.Module) -> Tuple[bool, float, int]:
+        """new_modelをmodelとMCTSで対戦させ，モデルを更新するか判定する
+
+        平均報酬がr_threshより高ければ(SPRTではH1を採択すれば)更新する
+
+        Args:
+            model (nn.Module): 現在のモデル
+            new_model (nn.Module): 学習したモデル
+
+        Returns:
+            Tuple[bool, float, int]: 更新するならTrue，new_modelの平均報酬，対戦数
+        """
+        prev_player = MCTSPlayer(self.make_mcts(model))
+        next_player = MCTSPlayer(self.make_mcts(new_model))
+        if self.sprt is None:
+            r = eval_player(
+                next_player,
+                prev_player,
+                self.game,
+                self.num_game,
+                self.eval_batched,
+                self.eval_workers,
+            )
+            logging.info(f"average reward: {r}")
+            return r > self.r_thresh, r, 2 * self.num_game
+
+        r, num_played, result = eval_player_sprt(
+            next_player,
+            prev_player,
+            self.game,
+            self.num_game,
+            self.sprt,
+            self.eval_batched,
+            self.eval_workers,
+            self.sprt_games_per_round,
+        )
+        logging.info(f"average reward: {r}, games: {num_played}, sprt: {result}")
+        updated = result if result is not None else r > self.r_thresh
+        return updated, r, num_played
+
+    def _iteration_metrics(
+        self, i: int, times: dict, num_positions: int, buffer_size: int
+    ) -> dict:
+        """反復の段階別の時間，自己対戦の速さ，自己対戦のMCTSの累計をまとめる
+
+        Args:
+            i (int): 何回目の反復か
+            times (dict): 段階の名前から秒数への辞書
+            num_positions (int): 自己対戦で得た局面数
+            buffer_size (int): リプレイバッファの経験数
+
+        Returns:
+            dict: 指標
+        """
+        counters = self.search_counters
+        self_play_time = times.get("self_play", 0.0)
+        search_time = counters["search_time"]
+        network_calls = counters["network_calls"]
+        evaluations = counters["cache_hits"] + counters["network_positions"]
+        searches = counters["searches"]
+        result = {"iteration": i, "buffer_size": buffer_size}
+        result.update({f"time/{k}": v for k, v in times.items()})
+        result.update(
+            {
+                "self_play/positions": num_positions,
+                "self_play/positions_per_sec": (
+                    num_positions / self_play_time if self_play_time > 0 else 0.0
+                ),
+                "mcts/simulations": counters["simulations"],
+                "mcts/simulations_per_sec": (
+                    counters["simulations"] / search_time if search_time > 0 else 0.0
+                ),
+                "mcts/nodes_expanded": counters["nodes_expanded"],
+                "mcts/network_calls": network_calls,
+                "mcts/mean_batch_size": (
+                    counters["network_positions"] / network_calls
+                    if network_calls
+                    else 0.0
+                ),
+                "mcts/cache_hit_rate": (
+                    counters["cache_hits"] / evaluations if evaluations else 0.0
+                ),
+                "mcts/mean_tree_size": (
+                    counters["tree_size"] / searches if searches else 0.0
+                ),
+            }
+        )
+        return result
+
     def loss_p(self, p: torch.Tensor, p_pred: torch.Tensor) -> torch.Tensor:
         """行動確率pに関する損失
 
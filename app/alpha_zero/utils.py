@@ -1,21 +1,95 @@
-from typing import List
+from typing import List, Optional, Tuple
 
 import numpy as np
 
-from ..games.arena import Arena
+from ..games.arena import Arena, BatchedArena
 from ..games.player_base import Player
 from ..games.game import Game
+from ..games.sprt import SPRT
 
 
 def eval_player(
-    eval_player: Player, standard_player: Player, game: Game, num_game: int
+    eval_player: Player,
+    standard_player: Player,
+    game: Game,
+    num_game: int,
+    batched: bool = False,
+    num_workers: int = 1,
 ) -> float:
-    arena1 = Arena(eval_player, standard_player, game)
-    arena2 = Arena(standard_player, eval_player, game)
-    r = (arena1.play_games(num_game) - arena2.play_games(num_game)) / 2
+    if batched:
+        arena1 = BatchedArena(
+            eval_player, standard_player, game, num_workers=num_workers
+        )
+        arena2 = BatchedArena(
+            standard_player, eval_player, game, num_workers=num_workers
+        )
+    else:
+        arena1 = Arena(eval_player, standard_player, game)
+        arena2 = Arena(standard_player, eval_player, game)
+    with arena1, arena2:
+        r = (arena1.play_games(num_game) - arena2.play_games(num_game)) / 2
     return r
 
 
+def eval_player_sprt(
+    eval_player: Player,
+    standard_player: Player,
+    game: Game,
+    num_game: int,
+    sprt: SPRT,
+    batched: bool = False,
+    num_workers: int = 1,
+    games_per_round: int = 1,
+) -> Tuple[float, int, Optional[bool]]:
+    """先手と後手を入れ替えながら対戦し，SPRTで判定がついたら打ち切る
+
+    Args:
+        eval_player (Player): 評価するプレイヤー
+        standard_player (Player): 基準のプレイヤー
+        game (Game): ゲーム
+        num_game (int): 先手・後手それぞれの最大対戦数
+        sprt (SPRT): 検定の設定
+        batched (bool, optional): 1ラウンドの対戦を同時に進めるならTrue. Defaults to False.
+        num_workers (int, optional): batchedのとき対戦を行うプロセス数. Defaults to 1.
+        games_per_round (int, optional): 検定の間に先手・後手それぞれで行う対戦数. Defaults to 1.
+
+    Returns:
+        Tuple[float, int, Optional[bool]]: eval_playerの平均報酬，対戦数，
+            検定の結果(eval_playerの方が強ければTrue，そうでなければFalse，決まらなければNone)
+    """
+    if batched:
+        arena1 = BatchedArena(
+            eval_player, standard_player, game, num_workers=num_workers
+        )
+        arena2 = BatchedArena(
+            standard_player, eval_player, game, num_workers=num_workers
+        )
+    else:
+        arena1 = Arena(eval_player, standard_player, game)
+        arena2 = Arena(standard_player, eval_player, game)
+
+    rewards = []
+    result = None
+    played = 0
+    # 対局のプロセスは全てのラウンドで使い回す
+    with arena1, arena2:
+        while played < num_game and result is None:
+            n = min(games_per_round, num_game - played)
+            if batched:
+                rewards += arena1.play_games_results(n)
+                rewards += [-r for r in arena2.play_games_results(n)]
+            else:
+                for _ in range(n):
+                    rewards.append(arena1.play_game())
+                    rewards.append(-arena2.play_game())
+            played += n
+
+            wins = sum(r > 0 for r in rewards)
+            losses = sum(r < 0 for r in rewards)
+            result = sprt.test(wins, len(rewards) - wins - losses, losses)
+    return sum(rewards) / len(rewards), len(rewards), result
+
+
 def get_board_view(cboard: List[List[float]]):
     board = np.array(cboard)
     return [(board == 1).tolist(), (board == -1).tolist()]
@@ -1,4 +1,10 @@
 import logging
+import multiprocessing as mp
+from multiprocessing.pool import Pool
+from typing import List, Optional
+
+import numpy as np
+import torch
 
 from .game import Game
 from .player_base import Player
@@ -18,6 +24,12 @@ class Arena:
         self.player1 = player1
         self.player2 = player2
 
+    def __enter__(self) -> "Arena":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
     def play_game(self, verbose: int = 0) -> float:
         """ゲームを1回実行
 
@@ -44,10 +56,11 @@ class Arena:
                 self.game.get_canonical_form(board, cur_player)
             )
             # 合法種でなければエラー
-            if not self.game.is_valid(board, cur_player, action):
+            valid = self.game.get_valid_moves(board, cur_player)
+            if not valid[action]:
                 logging.error(f"player: {cur_player}, board: {board}")
                 logging.error(f"Action {action} is not valid")
-                assert self.game.is_valid(board, cur_player, action)
+                assert valid[action]
 
             board, cur_player = self.game.get_next_state(board, cur_player, action)
             turn += 1
@@ -72,3 +85,154 @@ class Arena:
             r = self.play_game()
             ave_r += r / n
         return ave_r
+
+
+# 対局ワーカーのプロセスごとの状態
+_worker_state = dict()
+
+
+def _init_play_games_worker(player1: Player, player2: Player, game: Game) -> None:
+    """対局ワーカーの初期化．プレイヤーとゲームを受け取って保持する"""
+    _worker_state["arena"] = BatchedArena(player1, player2, game)
+
+
+def _play_games_worker(args: tuple) -> List[float]:
+    """プロセス内で対局をまとめて行う"""
+    n, seed = args
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    return _worker_state["arena"].play_games_results(n)
+
+
+class BatchedArena(Arena):
+    """複数の対局を同時に進めるArena
+
+    手番を待つ全ての対局の盤面をまとめてプレイヤーのplay_batchに渡すので，
+    ニューラルネットを使うプレイヤーは1手ごとにまとめてモデルを呼べる．
+    num_workers > 1のときwithの中では対局のプロセスを1度だけ立てて使い回し，
+    withの外では呼び出しごとに立てる
+    """
+
+    def __init__(
+        self,
+        player1: Player,
+        player2: Player,
+        game: Game,
+        num_parallel: int = 100,
+        num_workers: int = 1,
+    ):
+        """
+        Args:
+            player1 (Player): プレイヤー1
+            player2 (Player): プレイヤー2
+            game (Game): ゲーム
+            num_parallel (int, optional): 1プロセスで同時に進める最大対局数. Defaults to 100.
+            num_workers (int, optional): 対局を分担するプロセス数. Defaults to 1.
+        """
+        super().__init__(player1, player2, game)
+        self.num_parallel = num_parallel
+        self.num_workers = num_workers
+        self._pool: Optional[Pool] = None
+
+    def __enter__(self) -> "BatchedArena":
+        if self.num_workers > 1 and self._pool is None:
+            self._pool = self._make_pool()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """対局のプロセスを止める"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _make_pool(self) -> Pool:
+        """プレイヤーとゲームを渡した対局のプロセスを立てる"""
+        # 学習中はログを書くスレッドが動いているので，forkせずspawnで立てる
+        return mp.get_context("spawn").Pool(
+            self.num_workers,
+            _init_play_games_worker,
+            (self.player1, self.player2, self.game),
+        )
+
+    def play_games(self, n: int) -> float:
+        """ゲームをn回実行する
+
+        Args:
+            n (int): ゲーム数
+
+        Returns:
+            float: プレイヤー1から見た平均報酬
+        """
+        return sum(self.play_games_results(n)) / n
+
+    def play_games_results(self, n: int) -> List[float]:
+        """ゲームをn回実行し，各ゲームの報酬を返す
+
+        Args:
+            n (int): ゲーム数
+
+        Returns:
+            List[float]: 各ゲームのプレイヤー1から見た報酬
+        """
+        if self.num_workers > 1 and n > 1:
+            # 各プロセスに対局を割り振る．乱数はプロセスごとに取り直す
+            sizes = [len(c) for c in np.array_split(range(n), self.num_workers)]
+            seeds = np.random.randint(2**31, size=len(sizes))
+            args = [(size, int(seed)) for size, seed in zip(sizes, seeds) if size > 0]
+            if self._pool is not None:
+                results = self._pool.map(_play_games_worker, args)
+            else:
+                with self._make_pool() as pool:
+                    results = pool.map(_play_games_worker, args)
+            return [r for rs in results for r in rs]
+
+        results = []
+        for start in range(0, n, self.num_parallel):
+            results.extend(self._play_lockstep(min(self.num_parallel, n - start)))
+        return results
+
+    def _play_lockstep(self, n: int) -> List[float]:
+        """n局を同時に進める
+
+        Args:
+            n (int): ゲーム数
+
+        Returns:
+            List[float]: 各ゲームのプレイヤー1から見た報酬
+        """
+        self.player1.reset()
+        self.player2.reset()
+
+        boards = [self.game.get_initial_board() for _ in range(n)]
+        cur_players = [1] * n
+        players = {1: self.player1, -1: self.player2}
+        active = [i for i in range(n) if not self.game.get_game_ended(boards[i], 1)]
+        while active:
+            for cur_player in [1, -1]:
+                ids = [i for i in active if cur_players[i] == cur_player]
+                if not ids:
+                    continue
+                actions = players[cur_player].play_batch(
+                    [self.game.get_canonical_form(boards[i], cur_player) for i in ids],
+                    ids,
+                )
+                for i, action in zip(ids, actions):
+                    # 合法種でなければエラー
+                    valid = self.game.get_valid_moves(boards[i], cur_player)
+                    if not valid[action]:
+                        logging.error(f"player: {cur_player}, board: {boards[i]}")
+                        logging.error(f"Action {action} is not valid")
+                        assert valid[action]
+                    boards[i], cur_players[i] = self.game.get_next_state(
+                        boards[i], cur_player, action
+                    )
+                active = [
+                    i
+                    for i in active
+                    if not self.game.get_game_ended(boards[i], cur_players[i])
+                ]
+        return [self.game.get_reward(board, 1) for board in boards]
@@ -1,4 +1,50 @@
-from typing import List, Tuple, Hashable
+from functools import lru_cache
+from typing import Any, List, Tuple, Hashable
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def square_symmetry_perms(n: int) -> Tuple[np.ndarray, ...]:
+    """n x nの盤の8つの対称変換(回転と反転)をマスの並べ替えとして返す
+
+    変換後の盤面のi番目のマスは変換前のperm[i]番目のマスに対応するので，
+    盤面も行動確率もx[perm]で変換できる
+
+    Args:
+        n (int): 盤のサイズ
+
+    Returns:
+        Tuple[np.ndarray, ...]: 恒等変換から始まる8つの並べ替え
+    """
+    index = np.arange(n * n).reshape(n, n)
+    perms = []
+    for flip in [False, True]:
+        for k in range(4):
+            t = np.rot90(index, k)
+            if flip:
+                t = np.fliplr(t)
+            perms.append(t.ravel())
+    return tuple(perms)
+
+
+class GameState:
+    """探索中にmake_moveとunmake_moveで書き換える局面
+
+    boardはゲームの各メソッドにそのまま渡せるが，書き換えられるので
+    探索の外に持ち出すときはGame.get_boardで複製する
+    """
+
+    __slots__ = ("board", "player")
+
+    def __init__(self, board: List[List[float]], player: int):
+        """
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): 手番のプレイヤー
+        """
+        self.board = board
+        self.player = player
 
 
 class Game:
@@ -43,6 +89,20 @@ class Game:
         """
         raise NotImplementedError()
 
+    def get_valid_moves(self, board: List[List[float]], player: int) -> np.ndarray:
+        """全てのactionについて合法手かどうかをまとめて判定
+
+        Args:
+            board (List[List[float]]): 現在の盤面
+            player (int): 現在のプレイヤー
+
+        Returns:
+            np.ndarray: actionが合法手である位置がTrueのbool配列
+        """
+        return np.array(
+            [self.is_valid(board, player, a) for a in range(self.get_action_size())]
+        )
+
     def get_game_ended(self, board: List[List[float]], player: int) -> bool:
         """ゲームの終了判定
 
@@ -81,6 +141,73 @@ class Game:
         """
         raise NotImplementedError()
 
+    def get_symmetries(
+        self, board: List[List[float]]
+    ) -> List[Tuple[List[List[float]], np.ndarray]]:
+        """盤面を対称変換したものと，対応する行動の並べ替えを返す
+
+        行動確率piは変換後の盤面ではpi[perm]になる．
+        対称性を持たないゲームでは恒等変換のみを返す
+
+        Args:
+            board (List[List[float]]): 盤面
+
+        Returns:
+            List[Tuple[List[List[float]], np.ndarray]]: (変換後の盤面, perm)のリスト
+        """
+        return [(board, np.arange(self.get_action_size()))]
+
+    def get_state(self, board: List[List[float]], player: int) -> GameState:
+        """make_moveで書き換える局面を作る
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): 手番のプレイヤー
+
+        Returns:
+            GameState: 局面
+        """
+        return GameState(board, player)
+
+    def make_move(self, state: GameState, action: int) -> Any:
+        """局面を書き換えて着手する
+
+        デフォルトではget_next_stateで次の盤面を作って差し替える．
+        盤面を直接書き換えられるゲームはオーバーライドして複製を省く
+
+        Args:
+            state (GameState): 局面
+            action (int): 行動
+
+        Returns:
+            Any: unmake_moveに渡して着手を取り消すための値
+        """
+        undo = (state.board, state.player)
+        state.board, state.player = self.get_next_state(
+            state.board, state.player, action
+        )
+        return undo
+
+    def unmake_move(self, state: GameState, undo: Any) -> None:
+        """make_moveによる着手を取り消す
+
+        Args:
+            state (GameState): 局面
+            undo (Any): make_moveが返した値
+        """
+        state.board, state.player = undo
+
+    def get_board(self, state: GameState) -> List[List[float]]:
+        """書き換えられない局面の盤面を返す
+
+        Args:
+            state (GameState): 局面
+
+        Returns:
+            List[List[float]]: 盤面
+        """
+        return state.board
+
     def get_action_size(self) -> int:
         """非合法手を含めたactionの数を返す
 
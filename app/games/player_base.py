@@ -8,5 +8,20 @@ class Player:
     def play(self, board: List[List[float]]) -> int:
         raise NotImplementedError()
 
+    def play_batch(self, boards: List[List[List[float]]], ids: List[int]) -> List[int]:
+        """複数の対局の手をまとめて返す
+
+        idsは対局ごとに異なる番号で，対局ごとに状態を持つプレイヤーはこれで区別する．
+        デフォルトではplayを順に呼ぶ
+
+        Args:
+            boards (List[List[List[float]]]): 各対局のプレイヤー1から見た盤面
+            ids (List[int]): 各対局の番号
+
+        Returns:
+            List[int]: 各対局のaction
+        """
+        return [self.play(board) for board in boards]
+
     def reset(self) -> None:
         return
@@ -1,10 +1,14 @@
+import time
+from typing import Hashable, List, Optional
+
 import numpy as np
 import torch.nn as nn
 import torch
 
 from .game import Game
-from ..alpha_zero.mcts import MCTS
+from ..alpha_zero.mcts import MCTS, get_action_probs
 from .player_base import Player
+from .zobrist import TranspositionTable
 from ..alpha_zero.utils import get_board_view
 
 
@@ -15,10 +19,7 @@ class RandomPlayer(Player):
         self.game = game
 
     def play(self, board):
-        a = np.random.randint(self.game.get_action_size())
-        while not self.game.is_valid(board, 1, a):
-            a = np.random.randint(self.game.get_action_size())
-        return a
+        return np.random.choice(np.flatnonzero(self.game.get_valid_moves(board, 1)))
 
 
 class HumanPlayer(Player):
@@ -37,13 +38,23 @@ class HumanPlayer(Player):
 class MCTSPlayer(Player):
     def __init__(self, mcts: MCTS):
         self.mcts = mcts
+        self.trees = dict()
 
     def play(self, board):
         p = self.mcts.get_action_prob(board)
         return np.random.choice(list(range(len(p))), p=p)
 
+    def play_batch(self, boards, ids):
+        # 対局ごとに木を持ち，全ての木の葉をまとめて評価する
+        for i in ids:
+            if i not in self.trees:
+                self.trees[i] = self.mcts.clone()
+        ps = get_action_probs([self.trees[i] for i in ids], boards)
+        return [np.random.choice(len(p), p=p) for p in ps]
+
     def reset(self):
         self.mcts.reset()
+        self.trees = dict()
 
 
 class NeuralNetPlayer(Player):
@@ -52,50 +63,292 @@ class NeuralNetPlayer(Player):
         self.model = model
 
     def play(self, board):
-        p, v = self.model(torch.Tensor(get_board_view(board)))
-        p = p[0].detach().numpy()
-        for a in range(self.game.get_action_size()):
-            if not self.game.is_valid(board, 1, a):
-                p[a] = 0
+        with torch.no_grad():
+            p, v = self.model(torch.Tensor(get_board_view(board)))
+        p = p[0].numpy()
+        p[~self.game.get_valid_moves(board, 1)] = 0
         return np.argmax(p)
 
+    def play_batch(self, boards, ids):
+        x = torch.Tensor(np.array([get_board_view(board) for board in boards]))
+        with torch.no_grad():
+            p, v = self.model(x)
+        p = p.numpy()
+        for i, board in enumerate(boards):
+            p[i, ~self.game.get_valid_moves(board, 1)] = 0
+        return [int(a) for a in np.argmax(p, axis=1)]
+
+
+class _SearchTimeout(Exception):
+    """探索の時間またはノード数の上限に達した"""
+
 
 class AlphaBetaPlayer(Player):
-    def __init__(self, game: Game):
+    """alpha-beta探索で手を選ぶプレイヤー
+
+    上限を指定しなければ終局まで読み切る．上限を指定すると反復深化を行い，
+    深さの上限に達した局面はmodelの評価値(なければ0)で打ち切る．
+    時間またはノード数の上限に達したら，最後に読み終えた深さでの最善手を返す．
+    探索結果は盤面のハッシュをキーとする置換表に保存して手をまたいで使い，
+    置換表の最善手，キラー手，ヒストリーの順に手を並べて読む
+    """
+
+    def __init__(
+        self,
+        game: Game,
+        max_depth: Optional[int] = None,
+        time_limit: Optional[float] = None,
+        max_nodes: Optional[int] = None,
+        model: Optional[nn.Module] = None,
+        tt_size: int = 2**16,
+        tt_replacement: str = "depth",
+    ):
+        """
+        Args:
+            game (Game): ゲーム
+            max_depth (Optional[int], optional): 読む最大の深さ. Defaults to None.
+            time_limit (Optional[float], optional): 1手の探索の最大秒数. Defaults to None.
+            max_nodes (Optional[int], optional): 1手で訪れる最大ノード数. Defaults to None.
+            model (Optional[nn.Module], optional): 深さの上限に達した局面を評価する
+                (p, v)を返すモデル. Defaults to None.
+            tt_size (int, optional): 置換表に保存できる局面数．0なら置換表を使わない.
+                Defaults to 2**16.
+            tt_replacement (str, optional): 置換表の置き換え方．"depth"または"always".
+                Defaults to "depth".
+        """
         self.game = game
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.model = model
+        self.tt = None
+        if tt_size > 0:
+            self.tt = TranspositionTable(tt_size, tt_replacement)
+        self.killers = dict()
+        self.history = np.zeros(game.get_action_size())
+        self.nodes = 0
+        self.last_search = {"nodes": 0, "time": 0.0, "depth": 0, "score": 0.0}
+        self._deadline = None
+        self._cutoff = False
 
     def play(self, board):
-        best_action = 0
+        start = time.perf_counter()
+        self.nodes = 0
+        self._deadline = None if self.time_limit is None else start + self.time_limit
+        # キラー手は手ごとに捨て，ヒストリーは古いものほど軽くする
+        self.killers = dict()
+        self.history /= 2
+        limited = self.time_limit is not None or self.max_nodes is not None
+        if not limited:
+            # 時間とノード数の上限がなければ反復深化せずに読む
+            depths = [float("inf") if self.max_depth is None else self.max_depth]
+        else:
+            depths = range(1, (self.max_depth or self.game.get_action_size()) + 1)
+
+        actions = list(np.flatnonzero(self.game.get_valid_moves(board, 1)))
+        best_action = actions[0]
+        best_score = 0.0
+        completed = 0
+        # 1つの局面を着手と取り消しで書き換えながら読む
+        state = self.game.get_state(board, 1)
+        for depth in depths:
+            self._cutoff = False
+            try:
+                action, score = self._search_root(state, actions, depth)
+            except _SearchTimeout:
+                break
+            best_action, best_score = action, score
+            completed = depth
+            # 前の深さの最善手から読む
+            actions.remove(action)
+            actions.insert(0, action)
+            # 打ち切った局面がなければ読み切れている
+            if not self._cutoff:
+                break
+
+        self.last_search = {
+            "nodes": self.nodes,
+            "time": time.perf_counter() - start,
+            "depth": completed,
+            "score": best_score,
+        }
+        return best_action
+
+    def _search_root(self, state, actions, depth):
+        best_action = actions[0]
         alpha = -float("inf")
         beta = float("inf")
-        for action in range(self.game.get_action_size()):
-            if self.game.is_valid(board, 1, action):
-                next_board, next_player = self.game.get_next_state(board, 1, action)
-                if next_player == 1:
-                    score = self.search(next_board, next_player, alpha, beta)
-                else:
-                    score = -self.search(next_board, next_player, -beta, -alpha)
-                if alpha < score:
-                    alpha = score
-                    best_action = action
-        return best_action
+        for action in actions:
+            undo = self.game.make_move(state, action)
+            if state.player == 1:
+                score = self._search(state, alpha, beta, depth - 1, 1)
+            else:
+                score = -self._search(state, -beta, -alpha, depth - 1, 1)
+            self.game.unmake_move(state, undo)
+            if alpha < score:
+                alpha = score
+                best_action = action
+        return best_action, alpha
+
+    def search(self, board, player, alpha, beta, depth=float("inf"), ply=1):
+        return self._search(self.game.get_state(board, player), alpha, beta, depth, ply)
+
+    def _search(self, state, alpha, beta, depth, ply):
+        self._count_node()
+        board, player = state.board, state.player
+
+        # 十分な深さで読んだ結果が置換表にあれば使う
+        key = None
+        tt_move = None
+        if self.tt is not None:
+            key = self.game.hash(board, player)
+            entry = self.tt.get(key)
+            if entry is not None:
+                tt_depth, value, flag, tt_move = entry
+                if tt_depth >= depth and (
+                    flag == TranspositionTable.EXACT
+                    or (flag == TranspositionTable.LOWER and beta <= value)
+                    or (flag == TranspositionTable.UPPER and value <= alpha)
+                ):
+                    # 評価値で打ち切った探索の結果なら読み切れていない
+                    if tt_depth != float("inf"):
+                        self._cutoff = True
+                    return value
 
-    def search(self, board, player, alpha, beta):
         if self.game.get_game_ended(board, player):
-            return self.game.get_reward(board, player)
-
-        for action in range(self.game.get_action_size()):
-            if self.game.is_valid(board, player, action):
-                next_board, next_player = self.game.get_next_state(
-                    board, player, action
-                )
-                # playerから見たboardの評価値
-                if next_player == player:
-                    score = self.search(next_board, next_player, alpha, beta)
-                else:
-                    score = -self.search(next_board, next_player, -beta, -alpha)
-                # 関心のある値の上限であるbetaをscoreが超えたら打ち切り
-                if beta <= score:
-                    return score
-                alpha = max(alpha, score)
+            value = self.game.get_reward(board, player)
+            self._store(key, float("inf"), value, TranspositionTable.EXACT, None)
+            return value
+
+        # 深さの上限に達したら評価値で打ち切る
+        if depth <= 0:
+            self._cutoff = True
+            value = self.evaluate(board, player)
+            self._store(key, 0, value, TranspositionTable.EXACT, None)
+            return value
+
+        # この局面より下で打ち切ったかを調べるため一旦下ろす
+        cutoff = self._cutoff
+        self._cutoff = False
+        alpha_orig = alpha
+        best_move = None
+        valid = np.flatnonzero(self.game.get_valid_moves(board, player))
+        for action in self._order_moves(valid, tt_move, ply):
+            undo = self.game.make_move(state, action)
+            # playerから見たboardの評価値
+            if state.player == player:
+                score = self._search(state, alpha, beta, depth - 1, ply + 1)
+            else:
+                score = -self._search(state, -beta, -alpha, depth - 1, ply + 1)
+            self.game.unmake_move(state, undo)
+            # 関心のある値の上限であるbetaをscoreが超えたら打ち切り
+            if beta <= score:
+                self._update_ordering(action, depth, ply)
+                self._finish_node(key, depth, score, TranspositionTable.LOWER, action)
+                self._cutoff |= cutoff
+                return score
+            if alpha < score:
+                alpha = score
+                best_move = action
+
+        flag = TranspositionTable.EXACT
+        if alpha <= alpha_orig:
+            flag = TranspositionTable.UPPER
+        self._finish_node(key, depth, alpha, flag, best_move)
+        self._cutoff |= cutoff
         return alpha
+
+    def _order_moves(
+        self, actions: np.ndarray, tt_move: Optional[int], ply: int
+    ) -> List[int]:
+        """置換表の最善手，キラー手，ヒストリーの大きい手の順に並べる
+
+        Args:
+            actions (np.ndarray): 合法手
+            tt_move (Optional[int]): 置換表の最善手
+            ply (int): 根からの手数
+
+        Returns:
+            List[int]: 並べ替えた合法手
+        """
+        killers = self.killers.get(ply, ())
+        return sorted(
+            (int(a) for a in actions),
+            key=lambda a: (a != tt_move, a not in killers, -self.history[a]),
+        )
+
+    def _update_ordering(self, action: int, depth: float, ply: int) -> None:
+        """betaカットを起こした手をキラー手とヒストリーに加える"""
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        # 読み切る探索では残りの手数の見積もりを深さとする
+        if depth == float("inf"):
+            depth = max(self.game.get_action_size() - ply, 1)
+        self.history[action] += depth * depth
+
+    def _finish_node(
+        self,
+        key: Optional[Hashable],
+        depth: float,
+        value: float,
+        flag: int,
+        move: int,
+    ) -> None:
+        """探索を終えた局面を置換表に保存する
+
+        下で打ち切っていなければ読み切れているので，深さを無限として保存する
+        """
+        self._store(key, depth if self._cutoff else float("inf"), value, flag, move)
+
+    def _store(
+        self,
+        key: Optional[Hashable],
+        depth: float,
+        value: float,
+        flag: int,
+        move: Optional[int],
+    ) -> None:
+        """置換表を使うなら探索結果を保存する"""
+        if key is not None:
+            self.tt.put(key, depth, value, flag, move)
+
+    def evaluate(self, board: List[List[float]], player: int) -> float:
+        """終局していない局面のplayerから見た評価値
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): プレイヤー
+
+        Returns:
+            float: modelの評価値，modelがなければ0
+        """
+        if self.model is None:
+            return 0.0
+        cboard = self.game.get_canonical_form(board, player)
+        with torch.no_grad():
+            _, v = self.model(torch.Tensor(get_board_view(cboard)))
+        return float(v[0, 0])
+
+    def stats(self) -> dict:
+        """直前の探索のノード数，時間(秒)，1秒あたりのノード数，読み終えた深さを返す
+
+        Returns:
+            dict: 統計
+        """
+        elapsed = self.last_search["time"]
+        return {
+            **self.last_search,
+            "nodes_per_second": (
+                self.last_search["nodes"] / elapsed if elapsed > 0 else 0.0
+            ),
+        }
+
+    def _count_node(self) -> None:
+        """訪れたノードを数え，上限に達していたら探索を打ち切る"""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise _SearchTimeout()
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise _SearchTimeout()
@@ -1,7 +1,142 @@
-import copy
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Tuple, Union
 
-from .game import Game
+import numpy as np
+
+from .game import Game, GameState, square_symmetry_perms
+from .zobrist import zobrist_hash
+
+
+class ReversiBoard:
+    """ビットボードで表したオセロの盤面
+
+    マス(x, y)をx * n + yビット目に対応させ，プレイヤー1の石をblack,
+    プレイヤー-1の石をwhiteの整数で持つ．
+    盤面のZobristハッシュkeyと，石の色を入れ替えた盤面のハッシュswapped_keyも持ち，
+    着手のたびに置いた石と返した石の分だけ更新する．
+    ReversiGame.make_move/unmake_moveはGameStateが持つ盤面をその場で書き換えるので，
+    探索中の盤面を残すときはget_boardかcopy.copyで複製する．
+    get_next_stateなどが返す盤面は以後書き換えられない．
+    board[x][y]やnp.array(board)で従来のリスト形式の盤面と同じように読める
+    """
+
+    __slots__ = ("n", "black", "white", "key", "swapped_key")
+
+    def __init__(
+        self,
+        n: int,
+        black: int,
+        white: int,
+        key: Optional[int] = None,
+        swapped_key: Optional[int] = None,
+    ):
+        """
+        Args:
+            n (int): 盤のサイズ
+            black (int): プレイヤー1の石のビットボード
+            white (int): プレイヤー-1の石のビットボード
+            key (Optional[int], optional): 盤面のハッシュ．Noneなら計算する. Defaults to None.
+            swapped_key (Optional[int], optional): 石の色を入れ替えた盤面のハッシュ．
+                Noneなら計算する. Defaults to None.
+        """
+        self.n = n
+        self.black = black
+        self.white = white
+        if key is None or swapped_key is None:
+            zobrist = zobrist_hash(n * n)
+            key = zobrist.board_key_bits(black, white)
+            swapped_key = zobrist.board_key_bits(white, black)
+        self.key = key
+        self.swapped_key = swapped_key
+
+    @classmethod
+    def from_list(cls, board: List[List[float]]) -> "ReversiBoard":
+        """リスト形式の盤面から変換する
+
+        Args:
+            board (List[List[float]]): 盤面
+
+        Returns:
+            ReversiBoard: ビットボード
+        """
+        n = len(board)
+        black = white = 0
+        for x in range(n):
+            for y in range(n):
+                if board[x][y] == 1:
+                    black |= 1 << (x * n + y)
+                elif board[x][y] == -1:
+                    white |= 1 << (x * n + y)
+        return cls(n, black, white)
+
+    def to_list(self) -> List[List[int]]:
+        """リスト形式の盤面に変換する
+
+        Returns:
+            List[List[int]]: 盤面
+        """
+        return self.__array__().tolist()
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        board = _bits_to_array(self.black, self.n * self.n).astype(np.int64)
+        board -= _bits_to_array(self.white, self.n * self.n)
+        board = board.reshape(self.n, self.n)
+        return board if dtype is None else board.astype(dtype)
+
+    def __getitem__(self, x: int) -> List[int]:
+        row = []
+        for y in range(self.n):
+            i = x * self.n + y
+            row.append((self.black >> i & 1) - (self.white >> i & 1))
+        return row
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return (self[x] for x in range(self.n))
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ReversiBoard):
+            return (self.black, self.white) == (other.black, other.white)
+        return self.to_list() == other
+
+    def __hash__(self) -> int:
+        return self.key
+
+    def __repr__(self) -> str:
+        return str(self.to_list())
+
+    def __copy__(self) -> "ReversiBoard":
+        return ReversiBoard(self.n, self.black, self.white, self.key, self.swapped_key)
+
+    def __deepcopy__(self, memo) -> "ReversiBoard":
+        return self.__copy__()
+
+
+def _bits_to_array(bits: int, size: int) -> np.ndarray:
+    """整数のビットをbool配列に展開する
+
+    Args:
+        bits (int): ビットボード
+        size (int): マスの数
+
+    Returns:
+        np.ndarray: i番目がiビット目を表すbool配列
+    """
+    buf = np.frombuffer(bits.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(buf, bitorder="little")[:size].astype(bool)
+
+
+def _array_to_bits(a: np.ndarray) -> int:
+    """bool配列をi番目がiビット目になる整数に詰める
+
+    Args:
+        a (np.ndarray): bool配列
+
+    Returns:
+        int: ビットボード
+    """
+    return int.from_bytes(np.packbits(a, bitorder="little").tobytes(), "little")
 
 
 class ReversiGame(Game):
@@ -14,6 +149,7 @@ class ReversiGame(Game):
         """
         assert n % 2 == 0
         self.n = n
+        self.zobrist = zobrist_hash(n * n)
         self.dirs = [
             (0, 1),
             (-1, 0),
@@ -25,32 +161,39 @@ class ReversiGame(Game):
             (1, -1),
         ]
 
+        # 各方向へのシフト量と，端から反対側の端へ回り込んだ石を消すマスク
+        self.full = (1 << (n * n)) - 1
+        left = sum(1 << (x * n) for x in range(n))
+        right = left << (n - 1)
+        self.shifts = []
+        for dx, dy in self.dirs:
+            mask = self.full
+            if dy == 1:
+                mask &= ~left
+            elif dy == -1:
+                mask &= ~right
+            self.shifts.append((dx * n + dy, mask))
+
     def get_initial_board(self):
-        board = [[0] * self.n for _ in range(self.n)]
-        board[self.n // 2][self.n // 2] = -1
-        board[self.n // 2][self.n // 2 - 1] = 1
-        board[self.n // 2 - 1][self.n // 2] = 1
-        board[self.n // 2 - 1][self.n // 2 - 1] = -1
-        return board
+        n = self.n
+        black = 1 << ((n // 2) * n + n // 2 - 1) | 1 << ((n // 2 - 1) * n + n // 2)
+        white = 1 << ((n // 2) * n + n // 2) | 1 << ((n // 2 - 1) * n + n // 2 - 1)
+        return ReversiBoard(n, black, white)
 
     def get_next_state(self, board, player, action):
-        x, y = action // self.n, action % self.n
-        flip_stones = self.get_flip_stones(board, player, action)
-
-        next_board = copy.deepcopy(board)
-        next_board[x][y] = player
-        for fx, fy in flip_stones:
-            next_board[fx][fy] = player
-
-        # -playerがパスならもう一度playerの番
-        if not self.is_pass(board, -player):
-            player *= -1
-        return (next_board, player)
+        # 複製した盤面に着手したものを次の盤面とする
+        state = self.get_state(board, player)
+        self.make_move(state, action)
+        return (state.board, state.player)
 
     def is_valid(self, board, player, action):
         # 返せる石がない場所には置けない
-        flip_stones = self.get_flip_stones(board, player, action)
-        return len(flip_stones) > 0
+        own, opp = self._split(self._as_board(board), player)
+        return self._moves(own, opp) >> int(action) & 1 == 1
+
+    def get_valid_moves(self, board, player):
+        own, opp = self._split(self._as_board(board), player)
+        return _bits_to_array(self._moves(own, opp), self.n * self.n)
 
     def get_game_ended(self, board, player):
         # 本来は-playerに対してもpassか判定する必要があるが，
@@ -59,13 +202,8 @@ class ReversiGame(Game):
         return self.is_pass(board, player)  # and self.is_pass(board, -player)
 
     def get_reward(self, board, player):
-        diff = 0
-        for x in range(self.n):
-            for y in range(self.n):
-                if board[x][y] == player:
-                    diff += 1
-                elif board[x][y] == -player:
-                    diff -= 1
+        own, opp = self._split(self._as_board(board), player)
+        diff = own.bit_count() - opp.bit_count()
 
         # 半分より多くとっていれば+1,半分より少なければ-1,ちょうど半分なら0
         if diff > 0:
@@ -76,20 +214,79 @@ class ReversiGame(Game):
             return 0
 
     def get_canonical_form(self, board, player):
-        b = copy.deepcopy(board)
+        board = self._as_board(board)
         if player == 1:
-            return b
+            return board
         else:
-            for x in range(self.n):
-                for y in range(self.n):
-                    b[x][y] *= -1
-            return b
+            return ReversiBoard(
+                self.n, board.white, board.black, board.swapped_key, board.key
+            )
+
+    def get_symmetries(self, board):
+        board = self._as_board(board)
+        size = self.n * self.n
+        black = _bits_to_array(board.black, size)
+        white = _bits_to_array(board.white, size)
+        return [
+            (
+                ReversiBoard(
+                    self.n, _array_to_bits(black[perm]), _array_to_bits(white[perm])
+                ),
+                perm,
+            )
+            for perm in square_symmetry_perms(self.n)
+        ]
 
     def get_action_size(self):
         return self.n * self.n
 
+    def get_state(self, board, player):
+        # 探索専用の盤面を用意し，以降はそれを書き換える
+        board = self._as_board(board)
+        return GameState(
+            ReversiBoard(
+                self.n, board.black, board.white, board.key, board.swapped_key
+            ),
+            player,
+        )
+
+    def make_move(self, state, action):
+        board = state.board
+        player = state.player
+        undo = (board.black, board.white, board.key, board.swapped_key, player)
+        own, opp = self._split(board, player)
+        action = int(action)
+        flips = self._flips(own, opp, action)
+        own |= flips | 1 << action
+        opp ^= flips
+
+        # 置いた石と返した石の分だけハッシュを更新する
+        zobrist = self.zobrist
+        flip_key = zobrist.flip_key(flips)
+        black_key, white_key = zobrist.black[action], zobrist.white[action]
+        if player == -1:
+            black_key, white_key = white_key, black_key
+        board.black, board.white = self._join(own, opp, player)
+        board.key ^= black_key ^ flip_key
+        board.swapped_key ^= white_key ^ flip_key
+
+        # -playerがパスならもう一度playerの番
+        if self._moves(opp, own):
+            state.player = -player
+        return undo
+
+    def unmake_move(self, state, undo):
+        board = state.board
+        board.black, board.white, board.key, board.swapped_key, state.player = undo
+
+    def get_board(self, state):
+        board = state.board
+        return ReversiBoard(
+            self.n, board.black, board.white, board.key, board.swapped_key
+        )
+
     def hash(self, board, player):
-        return (str(board), player)
+        return self.zobrist.with_side(self._as_board(board).key, player)
 
     def get_height(self) -> int:
         return self.n
@@ -98,12 +295,12 @@ class ReversiGame(Game):
         return self.n
 
     def get_flip_stones(
-        self, board: List[List[float]], player: int, action: int
+        self, board: Union[ReversiBoard, List[List[float]]], player: int, action: int
     ) -> List[Tuple[int, int]]:
         """返される石の場所のリストを返す
 
         Args:
-            board (List[List[int]]): 盤面
+            board (Union[ReversiBoard, List[List[float]]]): 盤面
             player (int): プレイヤー
             action (int): アクション
 
@@ -111,28 +308,11 @@ class ReversiGame(Game):
             List[Tuple[int, int]]: ひっくり返る相手の石の場所のリスト
         """
 
-        x, y = action // self.n, action % self.n
-
-        # 空きマス出ないなら置けない
-        if board[x][y] != 0:
-            return []
-
-        flip_stones = []
-        for dx, dy in self.dirs:
-            nx, ny = x + dx, y + dy
-            tmp = []
-
-            # 相手のコマがある限り進む
-            while self.on_board(nx, ny) and board[nx][ny] == -player:
-                tmp.append((nx, ny))
-                nx += dx
-                ny += dy
-
-            # 自分のコマに当たればひっくり返せる
-            if self.on_board(nx, ny) and board[nx][ny] == player:
-                flip_stones.extend(tmp)
-
-        return flip_stones
+        own, opp = self._split(self._as_board(board), player)
+        flips = self._flips(own, opp, action)
+        return [
+            (i // self.n, i % self.n) for i in range(self.n * self.n) if flips >> i & 1
+        ]
 
     def on_board(self, x: int, y: int) -> bool:
         """盤内にあるかのutil関数
@@ -147,21 +327,103 @@ class ReversiGame(Game):
 
         return (0 <= x < self.n) and (0 <= y < self.n)
 
-    def is_pass(self, board: List[List[float]], player: int) -> bool:
+    def is_pass(
+        self, board: Union[ReversiBoard, List[List[float]]], player: int
+    ) -> bool:
         """パスか判定
 
         Args:
-            board (List[List[int]]): 盤面
+            board (Union[ReversiBoard, List[List[float]]]): 盤面
             player (int): プレイヤー
 
         Returns:
             bool: パスならばTrue, おける場所があるならFalse
         """
 
-        for x in range(self.n):
-            for y in range(self.n):
-                action = x * self.n + y
-                flip_stones = self.get_flip_stones(board, player, action)
-                if len(flip_stones) > 0:
-                    return False
-        return True
+        own, opp = self._split(self._as_board(board), player)
+        return self._moves(own, opp) == 0
+
+    def _as_board(self, board: Union[ReversiBoard, List[List[float]]]) -> ReversiBoard:
+        """リスト形式の盤面が渡されたらビットボードに変換する"""
+        if isinstance(board, ReversiBoard):
+            return board
+        return ReversiBoard.from_list(board)
+
+    def _split(self, board: ReversiBoard, player: int) -> Tuple[int, int]:
+        """playerから見た(自分の石, 相手の石)のビットボードを返す"""
+        if player == 1:
+            return board.black, board.white
+        return board.white, board.black
+
+    def _join(self, own: int, opp: int, player: int) -> Tuple[int, int]:
+        """playerから見た石を(black, white)の順に戻す"""
+        if player == 1:
+            return own, opp
+        return opp, own
+
+    def _shift(self, bits: int, shift: int, mask: int) -> int:
+        """全ての石を1マスずらす．盤外に出た石は消える
+
+        Args:
+            bits (int): ビットボード
+            shift (int): ビット番号の増分
+            mask (int): 回り込みを消すマスク
+
+        Returns:
+            int: ずらしたビットボード
+        """
+        if shift > 0:
+            return (bits << shift) & mask
+        return (bits >> -shift) & mask
+
+    def _moves(self, own: int, opp: int) -> int:
+        """合法手のビットボードを返す
+
+        Args:
+            own (int): 手番のプレイヤーの石
+            opp (int): 相手の石
+
+        Returns:
+            int: 置けるマスのビットが立った整数
+        """
+        empty = ~(own | opp) & self.full
+        moves = 0
+        for shift, mask in self.shifts:
+            # 自分の石から相手の石が続く限り伸ばし，その先の空きマスに置ける
+            line = self._shift(own, shift, mask) & opp
+            for _ in range(self.n - 3):
+                line |= self._shift(line, shift, mask) & opp
+            moves |= self._shift(line, shift, mask) & empty
+        return moves
+
+    def _flips(self, own: int, opp: int, action: int) -> int:
+        """actionに置いたときに返る石のビットボードを返す
+
+        Args:
+            own (int): 手番のプレイヤーの石
+            opp (int): 相手の石
+            action (int): アクション
+
+        Returns:
+            int: ひっくり返る相手の石のビットが立った整数
+        """
+        put = 1 << int(action)
+
+        # 空きマスでないなら置けない
+        if (own | opp) & put:
+            return 0
+
+        flips = 0
+        for shift, mask in self.shifts:
+            tmp = 0
+            cur = self._shift(put, shift, mask)
+
+            # 相手のコマがある限り進む
+            while cur & opp:
+                tmp |= cur
+                cur = self._shift(cur, shift, mask)
+
+            # 自分のコマに当たればひっくり返せる
+            if cur & own:
+                flips |= tmp
+        return flips
@@ -0,0 +1,91 @@
+import math
+from typing import Optional
+
+
+def elo_to_score(elo: float) -> float:
+    """Eloレーティングの差を期待スコアに変換する
+
+    Args:
+        elo (float): レーティング差
+
+    Returns:
+        float: 勝ちを1，引き分けを0.5，負けを0としたときの期待スコア
+    """
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+class SPRT:
+    """逐次確率比検定
+
+    H0: レーティング差がelo0，H1: レーティング差がelo1 として，
+    勝ち・引き分け・負けの数から対数尤度比(LLR)を正規近似で計算し，
+    LLRが上限を超えたらH1，下限を下回ったらH0を採択する．
+    1局ごとに判定できるので，差がはっきりしていれば少ない対局数で打ち切れる
+    """
+
+    def __init__(
+        self,
+        elo0: float = 0,
+        elo1: float = 50,
+        alpha: float = 0.05,
+        beta: float = 0.05,
+    ):
+        """
+        Args:
+            elo0 (float, optional): H0のレーティング差. Defaults to 0.
+            elo1 (float, optional): H1のレーティング差. Defaults to 50.
+            alpha (float, optional): 第1種の誤り(H0が正しいのにH1を採択する)確率. Defaults to 0.05.
+            beta (float, optional): 第2種の誤り(H1が正しいのにH0を採択する)確率. Defaults to 0.05.
+        """
+        assert elo0 < elo1
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.alpha = alpha
+        self.beta = beta
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def llr(self, wins: int, draws: int, losses: int) -> float:
+        """対数尤度比を返す
+
+        結果が1種類しかないと分散が0になるので，
+        平均と分散は各結果に0.5局ずつ加えて計算する
+
+        Args:
+            wins (int): 勝ち数
+            draws (int): 引き分け数
+            losses (int): 負け数
+
+        Returns:
+            float: 対数尤度比
+        """
+        n = wins + draws + losses
+        if n == 0:
+            return 0.0
+        win, draw, loss = wins + 0.5, draws + 0.5, losses + 0.5
+        total = win + draw + loss
+        score = (win + draw / 2) / total
+        var = (
+            win * (1 - score) ** 2 + draw * (0.5 - score) ** 2 + loss * score**2
+        ) / total
+        s0, s1 = elo_to_score(self.elo0), elo_to_score(self.elo1)
+        return n * (s1 - s0) * (2 * score - s0 - s1) / (2 * var)
+
+    def test(self, wins: int, draws: int, losses: int) -> Optional[bool]:
+        """検定を行う
+
+        Args:
+            wins (int): 勝ち数
+            draws (int): 引き分け数
+            losses (int): 負け数
+
+        Returns:
+            Optional[bool]: H1を採択したらTrue，H0を採択したらFalse，
+                まだ決まらなければNone
+        """
+        llr = self.llr(wins, draws, losses)
+        if llr >= self.upper:
+            return True
+        if llr <= self.lower:
+            return False
+        return None
@@ -1,6 +1,48 @@
-import copy
+from typing import List, Optional
 
-from .game import Game
+import numpy as np
+
+from .game import Game, GameState, square_symmetry_perms
+from .zobrist import zobrist_hash
+
+
+class TicTacToeBoard(list):
+    """Zobristハッシュを持つn目並べの盤面
+
+    リスト形式の盤面と同じように読めるリストで，盤面のハッシュkeyと，
+    石の色を入れ替えた盤面のハッシュswapped_keyを持つ．
+    ハッシュはmake_move/unmake_moveで置いた石の分だけ更新するので，
+    board[x][y]に直接書き込んだ後はrehashで計算し直すこと
+    """
+
+    def __init__(
+        self,
+        board: List[List[float]],
+        key: Optional[int] = None,
+        swapped_key: Optional[int] = None,
+    ):
+        """
+        Args:
+            board (List[List[float]]): 盤面
+            key (Optional[int], optional): 盤面のハッシュ．Noneなら計算する. Defaults to None.
+            swapped_key (Optional[int], optional): 石の色を入れ替えた盤面のハッシュ．
+                Noneなら計算する. Defaults to None.
+        """
+        super().__init__(list(row) for row in board)
+        if key is None or swapped_key is None:
+            self.rehash()
+        else:
+            self.key = key
+            self.swapped_key = swapped_key
+
+    def __copy__(self) -> "TicTacToeBoard":
+        return TicTacToeBoard(self, self.key, self.swapped_key)
+
+    def rehash(self) -> None:
+        """盤面全体からハッシュを計算し直す"""
+        zobrist = zobrist_hash(len(self) * len(self))
+        self.key = zobrist.board_key(self)
+        self.swapped_key = zobrist.board_key([[-c for c in row] for row in self])
 
 
 class TicTacToeGame(Game):
@@ -12,23 +54,27 @@ class TicTacToeGame(Game):
             n (int): 盤のサイズ
         """
         self.n = n
+        self.zobrist = zobrist_hash(n * n)
 
     def get_initial_board(self):
-        board = [[0] * self.n for _ in range(self.n)]
+        board = TicTacToeBoard([[0] * self.n for _ in range(self.n)], 0, 0)
         return board
 
     def get_next_state(self, board, player, action):
         x, y = action // self.n, action % self.n
         assert board[x][y] == 0
-        next_board = copy.deepcopy(board)
-        next_board[x][y] = player
-        player *= -1
-        return (next_board, player)
+        # 複製した盤面に着手したものを次の盤面とする
+        state = self.get_state(board, player)
+        self.make_move(state, action)
+        return (state.board, state.player)
 
     def is_valid(self, board, player, action):
         x, y = action // self.n, action % self.n
         return board[x][y] == 0
 
+    def get_valid_moves(self, board, player):
+        return np.asarray(board).ravel() == 0
+
     def judge(self, board):
         # 横
         for x in range(self.n):
@@ -93,23 +139,66 @@ class TicTacToeGame(Game):
             return -result
 
     def get_canonical_form(self, board, player):
-        b = copy.deepcopy(board)
+        board = self._as_board(board)
         if player == 1:
-            return b
+            return board
         else:
-            for x in range(self.n):
-                for y in range(self.n):
-                    b[x][y] *= -1
-            return b
+            return TicTacToeBoard(
+                [[-c for c in row] for row in board], board.swapped_key, board.key
+            )
+
+    def get_symmetries(self, board):
+        flat = np.asarray(board).ravel()
+        return [
+            (TicTacToeBoard(flat[perm].reshape(self.n, self.n).tolist()), perm)
+            for perm in square_symmetry_perms(self.n)
+        ]
 
     def get_action_size(self):
         return self.n * self.n
 
+    def get_state(self, board, player):
+        # 探索専用の盤面を用意し，以降はそれを書き換える
+        board = self._as_board(board)
+        return GameState(TicTacToeBoard(board, board.key, board.swapped_key), player)
+
+    def make_move(self, state, action):
+        board = state.board
+        player = state.player
+        undo = (action, player, board.key, board.swapped_key)
+
+        # 置いた石の分だけハッシュを更新する
+        black_key, white_key = self.zobrist.black[action], self.zobrist.white[action]
+        if player == -1:
+            black_key, white_key = white_key, black_key
+        board[action // self.n][action % self.n] = player
+        board.key ^= black_key
+        board.swapped_key ^= white_key
+        state.player = -player
+        return undo
+
+    def unmake_move(self, state, undo):
+        action, state.player, key, swapped_key = undo
+        board = state.board
+        board[action // self.n][action % self.n] = 0
+        board.key = key
+        board.swapped_key = swapped_key
+
+    def get_board(self, state):
+        board = state.board
+        return TicTacToeBoard(board, board.key, board.swapped_key)
+
     def hash(self, board, player):
-        return (str(board), player)
+        return self.zobrist.with_side(self._as_board(board).key, player)
 
     def get_height(self) -> int:
         return self.n
 
     def get_width(self) -> int:
         return self.n
+
+    def _as_board(self, board: List[List[float]]) -> TicTacToeBoard:
+        """リスト形式の盤面が渡されたらハッシュを持つ盤面に変換する"""
+        if isinstance(board, TicTacToeBoard):
+            return board
+        return TicTacToeBoard(board)
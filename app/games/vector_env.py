@@ -0,0 +1,273 @@
+from typing import List, Optional
+
+import numpy as np
+
+from .game import Game
+from .reversi import ReversiBoard, ReversiGame
+from .tictactoe import TicTacToeBoard, TicTacToeGame
+
+
+class VectorEnv:
+    """B個の対局をまとめて進める環境
+
+    盤面を(B, 高さ, 幅)のint8配列，手番を(B,)のint8配列で持ち，
+    合法手や終局判定を全ての対局についてまとめて返す．
+    このクラスはGameのメソッドを対局ごとに呼ぶ汎用の実装で，
+    ゲームごとのサブクラスが配列演算で置き換える
+    """
+
+    def __init__(self, game: Game, num_envs: int):
+        """
+        Args:
+            game (Game): ゲーム
+            num_envs (int): 同時に進める対局数
+        """
+        self.game = game
+        self.num_envs = num_envs
+        self.height = game.get_height()
+        self.width = game.get_width()
+        self.action_size = game.get_action_size()
+        self.boards = np.zeros((num_envs, self.height, self.width), dtype=np.int8)
+        self.players = np.ones(num_envs, dtype=np.int8)
+        self.reset()
+
+    def reset(self, indices: Optional[np.ndarray] = None) -> None:
+        """対局を初期盤面に戻す
+
+        Args:
+            indices (Optional[np.ndarray], optional): 戻す対局の番号．Noneなら全て.
+                Defaults to None.
+        """
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        self.boards[indices] = np.asarray(self.game.get_initial_board())
+        self.players[indices] = 1
+
+    def legal_moves(self) -> np.ndarray:
+        """各対局の手番のプレイヤーの合法手を返す．終局した対局は全てFalse
+
+        Returns:
+            np.ndarray: (B, action_size)のbool配列
+        """
+        legal = np.stack(
+            [
+                self.game.get_valid_moves(self.get_board(i), int(self.players[i]))
+                for i in range(self.num_envs)
+            ]
+        )
+        legal[self.is_terminal()] = False
+        return legal
+
+    def step(self, actions: np.ndarray) -> None:
+        """終局していない対局を1手ずつ進める．終局した対局の行動は無視する
+
+        Args:
+            actions (np.ndarray): (B,)の各対局の行動
+        """
+        for i in np.flatnonzero(~self.is_terminal()):
+            board, player = self.game.get_next_state(
+                self.get_board(i), int(self.players[i]), int(actions[i])
+            )
+            self.boards[i] = np.asarray(board)
+            self.players[i] = player
+
+    def canonical_form(self) -> np.ndarray:
+        """各対局の手番のプレイヤーから見た盤面を返す
+
+        Returns:
+            np.ndarray: (B, 高さ, 幅)の盤面
+        """
+        return self.boards * self.players[:, None, None]
+
+    def is_terminal(self) -> np.ndarray:
+        """各対局が終局しているかを返す
+
+        Returns:
+            np.ndarray: (B,)のbool配列
+        """
+        return np.array(
+            [
+                self.game.get_game_ended(self.get_board(i), int(self.players[i]))
+                for i in range(self.num_envs)
+            ]
+        )
+
+    def reward(self) -> np.ndarray:
+        """終局した各対局のプレイヤー1から見た報酬を返す．終局していない対局は0
+
+        Returns:
+            np.ndarray: (B,)の報酬
+        """
+        terminal = self.is_terminal()
+        return np.array(
+            [
+                self.game.get_reward(self.get_board(i), 1) if terminal[i] else 0
+                for i in range(self.num_envs)
+            ],
+            dtype=np.int8,
+        )
+
+    def get_board(self, i: int) -> List[List[float]]:
+        """i番目の対局の盤面をGameの盤面として返す
+
+        Args:
+            i (int): 対局の番号
+
+        Returns:
+            List[List[float]]: 盤面
+        """
+        return self.boards[i].tolist()
+
+
+class TicTacToeVectorEnv(VectorEnv):
+    """n目並べのVectorEnv"""
+
+    def __init__(self, game: TicTacToeGame, num_envs: int):
+        super().__init__(game, num_envs)
+        n = game.n
+        # 縦，横，斜めの各列のマスの番号
+        index = np.arange(n * n).reshape(n, n)
+        self.lines = np.concatenate(
+            [index, index.T, [index.diagonal()], [np.fliplr(index).diagonal()]]
+        )
+
+    def legal_moves(self):
+        legal = self.boards.reshape(self.num_envs, -1) == 0
+        legal[self.is_terminal()] = False
+        return legal
+
+    def step(self, actions):
+        active = np.flatnonzero(~self.is_terminal())
+        flat = self.boards.reshape(self.num_envs, -1)
+        assert (flat[active, actions[active]] == 0).all()
+        flat[active, actions[active]] = self.players[active]
+        self.players[active] *= -1
+
+    def is_terminal(self):
+        return (self._winner() != 0) | (self.boards != 0).all(axis=(1, 2))
+
+    def reward(self):
+        return self._winner()
+
+    def get_board(self, i):
+        return TicTacToeBoard(self.boards[i].tolist())
+
+    def _winner(self) -> np.ndarray:
+        """揃った列があればその石のプレイヤー，なければ0を返す"""
+        n = self.game.n
+        sums = self.boards.reshape(self.num_envs, -1)[:, self.lines].sum(axis=2)
+        winner = np.zeros(self.num_envs, dtype=np.int8)
+        winner[(sums == -n).any(axis=1)] = -1
+        winner[(sums == n).any(axis=1)] = 1
+        return winner
+
+
+class ReversiVectorEnv(VectorEnv):
+    """オセロのVectorEnv
+
+    石を返す処理と合法手の計算は8方向へのずらしを配列全体に対して行う
+    """
+
+    def legal_moves(self):
+        own, opp = self._split(self.boards, self.players)
+        return self._moves(own, opp).reshape(self.num_envs, -1)
+
+    def step(self, actions):
+        active = np.flatnonzero(~self.is_terminal())
+        actions = np.asarray(actions)[active]
+        own, opp = self._split(self.boards[active], self.players[active])
+
+        put = np.zeros_like(own)
+        put.reshape(len(active), -1)[np.arange(len(active)), actions] = True
+        assert not (put & (own | opp)).any()
+        flips = np.zeros_like(own)
+        for dx, dy in self.game.dirs:
+            # 置いた石から相手の石が続く限り伸ばし，その先が自分の石なら返す
+            line = _shift(put, dx, dy) & opp
+            for _ in range(self.game.n - 3):
+                line |= _shift(line, dx, dy) & opp
+            bounded = (_shift(line, dx, dy) & own).any(axis=(1, 2))
+            flips[bounded] |= line[bounded]
+        own |= put | flips
+        opp &= ~flips
+
+        players = self.players[active]
+        self.boards[active] = np.where(own, players[:, None, None], 0) + np.where(
+            opp, -players[:, None, None], 0
+        )
+
+        # 相手がパスならもう一度同じプレイヤーの番
+        opponent_can_move = self._moves(opp, own).any(axis=(1, 2))
+        self.players[active] = np.where(opponent_can_move, -players, players)
+
+    def is_terminal(self):
+        own, opp = self._split(self.boards, self.players)
+        return ~self._moves(own, opp).any(axis=(1, 2))
+
+    def reward(self):
+        diff = self.boards.sum(axis=(1, 2), dtype=np.int64)
+        return (np.sign(diff) * self.is_terminal()).astype(np.int8)
+
+    def get_board(self, i):
+        return ReversiBoard.from_list(self.boards[i].tolist())
+
+    def _split(self, boards: np.ndarray, players: np.ndarray) -> tuple:
+        """各盤面のplayersから見た(自分の石, 相手の石)のbool配列を返す"""
+        own = boards == players[:, None, None]
+        opp = boards == -players[:, None, None]
+        return own, opp
+
+    def _moves(self, own: np.ndarray, opp: np.ndarray) -> np.ndarray:
+        """合法手のbool配列を返す
+
+        Args:
+            own (np.ndarray): 手番のプレイヤーの石
+            opp (np.ndarray): 相手の石
+
+        Returns:
+            np.ndarray: 置けるマスがTrueの(B, n, n)配列
+        """
+        empty = ~(own | opp)
+        moves = np.zeros_like(own)
+        for dx, dy in self.game.dirs:
+            line = _shift(own, dx, dy) & opp
+            for _ in range(self.game.n - 3):
+                line |= _shift(line, dx, dy) & opp
+            moves |= _shift(line, dx, dy) & empty
+        return moves
+
+
+def _shift(a: np.ndarray, dx: int, dy: int) -> np.ndarray:
+    """(B, n, n)の配列の全てのマスを(dx, dy)だけずらす．盤外に出たものは消える
+
+    Args:
+        a (np.ndarray): 配列
+        dx (int): 縦方向のずらす量
+        dy (int): 横方向のずらす量
+
+    Returns:
+        np.ndarray: ずらした配列
+    """
+    out = np.zeros_like(a)
+    n, m = a.shape[1], a.shape[2]
+    out[:, max(dx, 0) : n + min(dx, 0), max(dy, 0) : m + min(dy, 0)] = a[
+        :, max(-dx, 0) : n + min(-dx, 0), max(-dy, 0) : m + min(-dy, 0)
+    ]
+    return out
+
+
+def make_vector_env(game: Game, num_envs: int) -> VectorEnv:
+    """ゲームに合ったVectorEnvを作る
+
+    Args:
+        game (Game): ゲーム
+        num_envs (int): 同時に進める対局数
+
+    Returns:
+        VectorEnv: 配列演算で実装したものがあればそれ，なければ汎用の実装
+    """
+    if isinstance(game, ReversiGame):
+        return ReversiVectorEnv(game, num_envs)
+    if isinstance(game, TicTacToeGame):
+        return TicTacToeVectorEnv(game, num_envs)
+    return VectorEnv(game, num_envs)
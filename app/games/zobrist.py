@@ -0,0 +1,235 @@
+from functools import lru_cache
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class ZobristHash:
+    """盤面と手番を64bitの整数に写すZobristハッシュ
+
+    マスと石の色の組ごと，および手番ごとに乱数を割り当て，
+    盤上の石と手番に対応する乱数のxorをハッシュとする
+    """
+
+    def __init__(self, num_squares: int, seed: int = 0):
+        """
+        Args:
+            num_squares (int): マスの数
+            seed (int, optional): 乱数のシード. Defaults to 0.
+        """
+        rng = np.random.default_rng(seed)
+        self.num_squares = num_squares
+        # table[i, 0]はマスiのプレイヤー1の石，table[i, 1]はプレイヤー-1の石
+        self.table = rng.integers(0, 2**64, size=(num_squares, 2), dtype=np.uint64)
+        self.side = int(rng.integers(0, 2**64, dtype=np.uint64))
+        self.black = [int(k) for k in self.table[:, 0]]
+        self.white = [int(k) for k in self.table[:, 1]]
+
+        # ビットボードを8マスずつ引くための表
+        self._black_bytes = self._byte_tables(self.black)
+        self._white_bytes = self._byte_tables(self.white)
+        self._flip_bytes = self._byte_tables(
+            [b ^ w for b, w in zip(self.black, self.white)]
+        )
+
+    def _byte_tables(self, keys: List[int]) -> List[List[int]]:
+        """8マスごとに，その8マスの石の有無(0〜255)からハッシュへの表を作る"""
+        tables = []
+        for start in range(0, self.num_squares, 8):
+            chunk = keys[start : start + 8]
+            table = [0] * 256
+            for byte in range(1, 256):
+                low = byte & -byte
+                i = low.bit_length() - 1
+                table[byte] = table[byte ^ low] ^ (chunk[i] if i < len(chunk) else 0)
+            tables.append(table)
+        return tables
+
+    def key(self, board: List[List[float]], player: int) -> int:
+        """盤面と手番のハッシュを返す
+
+        Args:
+            board (List[List[float]]): 盤面
+            player (int): 手番のプレイヤー
+
+        Returns:
+            int: ハッシュ
+        """
+        return self.with_side(self.board_key(board), player)
+
+    def with_side(self, board_key: int, player: int) -> int:
+        """盤面だけのハッシュに手番を加える
+
+        Args:
+            board_key (int): 盤面だけのハッシュ
+            player (int): 手番のプレイヤー
+
+        Returns:
+            int: ハッシュ
+        """
+        return board_key ^ self.side if player == -1 else board_key
+
+    def board_key(self, board: List[List[float]]) -> int:
+        """手番を含めない盤面だけのハッシュを返す
+
+        Args:
+            board (List[List[float]]): 盤面
+
+        Returns:
+            int: ハッシュ
+        """
+        key = 0
+        i = 0
+        for row in board:
+            for cell in row:
+                if cell == 1:
+                    key ^= self.black[i]
+                elif cell == -1:
+                    key ^= self.white[i]
+                i += 1
+        return key
+
+    def board_key_bits(self, black: int, white: int) -> int:
+        """ビットボードで表した盤面の，手番を含めないハッシュを返す
+
+        Args:
+            black (int): プレイヤー1の石のビットボード
+            white (int): プレイヤー-1の石のビットボード
+
+        Returns:
+            int: ハッシュ
+        """
+        key = 0
+        for black_table, white_table in zip(self._black_bytes, self._white_bytes):
+            key ^= black_table[black & 0xFF] ^ white_table[white & 0xFF]
+            black >>= 8
+            white >>= 8
+        return key
+
+    def flip_key(self, bits: int) -> int:
+        """bitsのマスの石の色を全て入れ替えたときにハッシュにxorする値を返す
+
+        Args:
+            bits (int): 色が変わるマスのビットボード
+
+        Returns:
+            int: xorする値
+        """
+        key = 0
+        for table in self._flip_bytes:
+            key ^= table[bits & 0xFF]
+            bits >>= 8
+        return key
+
+
+@lru_cache(maxsize=None)
+def zobrist_hash(num_squares: int) -> ZobristHash:
+    """マスの数ごとに共有するZobristハッシュを返す
+
+    シードを固定しているので，プロセスをまたいでも同じ盤面は同じハッシュになる
+
+    Args:
+        num_squares (int): マスの数
+
+    Returns:
+        ZobristHash: Zobristハッシュ
+    """
+    return ZobristHash(num_squares)
+
+
+class TranspositionTable:
+    """alpha-beta探索の結果を保存する固定長の置換表
+
+    ハッシュをsizeで割った余りの位置に1局面ずつ保存する．
+    位置が埋まっているときの置き換え方はreplacementで選ぶ
+    """
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    REPLACEMENTS = ("depth", "always")
+
+    def __init__(self, size: int = 2**16, replacement: str = "depth"):
+        """
+        Args:
+            size (int, optional): 保存できる局面数. Defaults to 2**16.
+            replacement (str, optional): "depth"なら別の局面はより深く読んだものだけで
+                置き換え，"always"なら常に新しいもので置き換える. Defaults to "depth".
+        """
+        if replacement not in self.REPLACEMENTS:
+            raise ValueError(f"Invalid replacement policy: {replacement}")
+        self.size = size
+        self.replacement = replacement
+        self.clear()
+
+    def __len__(self) -> int:
+        return self.size - self.keys.count(None)
+
+    def get(self, key: Hashable) -> Optional[Tuple[float, float, int, Optional[int]]]:
+        """保存された探索結果を返す
+
+        Args:
+            key (Hashable): 局面のハッシュ
+
+        Returns:
+            Optional[Tuple[float, float, int, Optional[int]]]: (深さ, 評価値, 種類, 最善手),
+                保存されていなければNone
+        """
+        i = hash(key) % self.size
+        if self.keys[i] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.entries[i]
+
+    def put(
+        self,
+        key: Hashable,
+        depth: float,
+        value: float,
+        flag: int,
+        move: Optional[int],
+    ) -> None:
+        """探索結果を保存する
+
+        Args:
+            key (Hashable): 局面のハッシュ
+            depth (float): 読んだ深さ
+            value (float): 評価値
+            flag (int): 評価値が正確な値(EXACT)，下限(LOWER)，上限(UPPER)のどれか
+            move (Optional[int]): 最善手
+        """
+        i = hash(key) % self.size
+        stored = self.keys[i]
+        if (
+            stored is not None
+            and stored != key
+            and self.replacement == "depth"
+            and self.entries[i][0] > depth
+        ):
+            return
+        self.keys[i] = key
+        self.entries[i] = (depth, value, flag, move)
+
+    def clear(self) -> None:
+        """全ての探索結果と統計を捨てる"""
+        self.keys: List[Optional[Hashable]] = [None] * self.size
+        self.entries: List[Optional[Tuple[float, float, int, Optional[int]]]] = [
+            None
+        ] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        """ヒット数，ミス数，ヒット率，保存している局面数を返す
+
+        Returns:
+            dict: 統計
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self),
+        }
@@ -0,0 +1,70 @@
+"""モデルの1回の呼び出しにかかる時間を，呼び出し方とバッチの大きさごとに測る
+
+python -m benchmarks.inference --game reversi6 --batch_sizes 1 8 64
+"""
+
+import argparse
+import time
+
+import torch
+
+from app.alpha_zero.inference import InferenceModel, compare_models
+from app.alpha_zero.models import ReversiModel, TicTacToeModel
+from app.games.reversi import ReversiGame
+from app.games.tictactoe import TicTacToeGame
+
+GAMES = {
+    "tictactoe": lambda: (TicTacToeGame(3), TicTacToeModel),
+    "reversi6": lambda: (ReversiGame(6), ReversiModel),
+    "reversi8": lambda: (ReversiGame(8), ReversiModel),
+}
+
+
+def measure(f, x: torch.Tensor, num_calls: int) -> float:
+    """fをnum_calls回呼んだときの1回あたりの秒数を返す"""
+    for _ in range(10):
+        f(x)
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        f(x)
+    return (time.perf_counter() - start) / num_calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--game", choices=GAMES, default="reversi6")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 64, 256])
+    parser.add_argument("--num_calls", type=int, default=1000)
+    parser.add_argument("--num_threads", type=int, default=1)
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    game, model_class = GAMES[args.game]()
+    model = model_class(game)
+    compiled = InferenceModel(model, game)
+    quantized = InferenceModel(model, game, quantize=True)
+
+    def no_grad(x):
+        with torch.no_grad():
+            return model(x)
+
+    runners = {
+        "eager": model,
+        "no_grad": no_grad,
+        "compiled": compiled,
+        "quantized": quantized,
+    }
+    print(f"{'batch':>6}" + "".join(f"{name:>12}" for name in runners) + "  (us/call)")
+    for batch_size in args.batch_sizes:
+        x = torch.rand(batch_size, 2, game.get_height(), game.get_width())
+        times = [measure(f, x, args.num_calls) for f in runners.values()]
+        print(f"{batch_size:>6}" + "".join(f"{t * 1e6:>12.1f}" for t in times))
+
+    # 学習していないモデルなので，盤面は実際の局面の代わりにランダムな石の配置を使う
+    board = torch.randint(-1, 2, (1000, game.get_height(), game.get_width()))
+    x = torch.stack([board == 1, board == -1], dim=1).float()
+    print(f"quantized vs fp32: {compare_models(model, quantized, x)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""MCTSの選択則ごとに，alpha-beta探索のプレイヤーに対して目標の成績に届く探索回数を測る
+
+--modelを指定しなければ小さな設定で自己対戦から学習したモデルを使う．
+同じモデルでucb(事前確率を使わない)とpuct(ネットワークの事前確率を使う)を比べる
+
+    python -m benchmarks.puct --game tictactoe3 --output puct.json
+    python -m benchmarks.puct --game reversi4 --depth 2 --target 0.9
+"""
+
+import argparse
+import json
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.models import ReversiModel, TicTacToeModel
+from app.alpha_zero.trainer import Trainer
+from app.alpha_zero.utils import eval_player
+from app.games.game import Game
+from app.games.players import AlphaBetaPlayer, MCTSPlayer
+from app.games.reversi import ReversiGame
+from app.games.tictactoe import TicTacToeGame
+
+from .suite import metadata, seed_all
+
+GAMES = {
+    "tictactoe3": lambda: (TicTacToeGame(3), TicTacToeModel),
+    "reversi4": lambda: (ReversiGame(4), ReversiModel),
+}
+
+
+def train_model(game: Game, model_class: type, num_iter: int) -> nn.Module:
+    """自己対戦から小さな設定でモデルを学習する"""
+    trainer = Trainer(
+        game,
+        num_iter=num_iter,
+        buffer_size=10000,
+        num_episode=100,
+        num_epoch=20,
+        num_game=10,
+        lr=0.002,
+        batch_size=100,
+        r_thresh=0,
+        alpha=1.0,
+        tau=1.0,
+        num_search=25,
+        dirichlet_alpha=0.3,
+    )
+    return trainer.train(model_class(game))
+
+
+def sweep(
+    game: Game,
+    model: nn.Module,
+    selection: str,
+    alpha: float,
+    tau: float,
+    num_searches: List[int],
+    opponent: AlphaBetaPlayer,
+    num_game: int,
+) -> Dict[int, float]:
+    """探索回数ごとの相手に対する平均報酬(先後を入れ替えて各num_game局)"""
+    results = dict()
+    for num_search in num_searches:
+        seed_all(0)
+        mcts = MCTS(game, model, alpha, tau, num_search, selection=selection)
+        results[num_search] = eval_player(MCTSPlayer(mcts), opponent, game, num_game)
+        print(
+            f"{selection:>5} num_search={num_search:>4} reward={results[num_search]:+.3f}"
+        )
+    return results
+
+
+def first_reaching(results: Dict[int, float], target: float) -> Optional[int]:
+    """平均報酬がtarget以上になる最小の探索回数．届かなければNone"""
+    for num_search, r in sorted(results.items()):
+        if r >= target:
+            return num_search
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--game", choices=GAMES, default="tictactoe3")
+    parser.add_argument("--model", help="torch.saveで保存したモデル")
+    parser.add_argument("--train_iter", type=int, default=3, help="学習する反復の数")
+    parser.add_argument(
+        "--num_searches", type=int, nargs="+", default=[2, 5, 10, 25, 50, 100]
+    )
+    parser.add_argument("--alpha", type=float, default=1.0, help="探索の定数")
+    parser.add_argument("--tau", type=float, default=0.25, help="手を選ぶ温度")
+    parser.add_argument("--num_game", type=int, default=20, help="先後それぞれの対局数")
+    parser.add_argument(
+        "--depth", type=int, default=None, help="alpha-betaの深さ．省略すると読み切る"
+    )
+    parser.add_argument("--target", type=float, default=-0.5, help="目標の平均報酬")
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    game, model_class = GAMES[args.game]()
+    seed_all(0)
+    if args.model is not None:
+        model = torch.load(args.model)
+    else:
+        model = train_model(game, model_class, args.train_iter)
+    model.eval()
+    opponent = AlphaBetaPlayer(game, max_depth=args.depth)
+
+    report = {"metadata": metadata(), "config": vars(args), "results": dict()}
+    for selection in MCTS.SELECTIONS:
+        results = sweep(
+            game,
+            model,
+            selection,
+            args.alpha,
+            args.tau,
+            args.num_searches,
+            opponent,
+            args.num_game,
+        )
+        reached = first_reaching(results, args.target)
+        print(f"{selection:>5} reaches {args.target:+.2f} at num_search={reached}")
+        report["results"][selection] = {
+            "rewards": results,
+            "num_search_to_target": reached,
+        }
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""ゲーム，探索，学習，対戦の速さを測り，結果をJSONに保存する
+
+乱数のシードと局面を固定し，毎回同じ量の処理にかかる時間を測るので，
+コミット間で結果を比べられる
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.models import ConstantModel, ReversiModel, TicTacToeModel
+from app.alpha_zero.replay_buffer import ReplayBuffer
+from app.alpha_zero.trainer import AlphaZeroDataset, Trainer
+from app.games.arena import Arena
+from app.games.game import Game
+from app.games.players import MCTSPlayer, RandomPlayer
+from app.games.reversi import ReversiGame
+from app.games.tictactoe import TicTacToeGame
+
+GAMES = {
+    "tictactoe3": lambda: TicTacToeGame(3),
+    "reversi4": lambda: ReversiGame(4),
+    "reversi6": lambda: ReversiGame(6),
+    "reversi8": lambda: ReversiGame(8),
+}
+
+
+def seed_all(seed: int) -> None:
+    """numpyとtorchの乱数のシードを設定する"""
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def timed(f: Callable[[], None], repeat: int) -> float:
+    """fをrepeat回実行し，最も速かった回の秒数を返す．毎回同じ乱数で実行する"""
+    times = []
+    for _ in range(repeat):
+        seed_all(0)
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def positions(game: Game, num_positions: int, seed: int = 0) -> List[Tuple]:
+    """ランダムに指して現れた終局していない局面を返す
+
+    Args:
+        game (Game): ゲーム
+        num_positions (int): 局面数
+        seed (int, optional): 乱数のシード. Defaults to 0.
+
+    Returns:
+        List[Tuple]: (盤面, 手番, その局面で指すランダムな合法手)
+    """
+    rng = np.random.default_rng(seed)
+    result = []
+    while len(result) < num_positions:
+        board = game.get_initial_board()
+        player = 1
+        while not game.get_game_ended(board, player):
+            action = int(
+                rng.choice(np.flatnonzero(game.get_valid_moves(board, player)))
+            )
+            result.append((board, player, action))
+            board, player = game.get_next_state(board, player, action)
+    return result[:num_positions]
+
+
+def bench_games(scale: float, repeat: int) -> Dict[str, float]:
+    """合法手の生成とget_next_stateの1秒あたりの回数"""
+    results = dict()
+    for name, make_game in GAMES.items():
+        game = make_game()
+        data = positions(game, int(2000 * scale))
+
+        def valid_moves():
+            for board, player, _ in data:
+                game.get_valid_moves(board, player)
+
+        def next_state():
+            for board, player, action in data:
+                game.get_next_state(board, player, action)
+
+        results[f"{name}/valid_moves_per_sec"] = len(data) / timed(valid_moves, repeat)
+        results[f"{name}/next_state_per_sec"] = len(data) / timed(next_state, repeat)
+    return results
+
+
+def bench_mcts(scale: float, repeat: int) -> Dict[str, float]:
+    """固定した局面からのMCTSの1秒あたりのシミュレーション数"""
+    results = dict()
+    num_search = int(200 * scale)
+    for name in ["reversi6", "reversi8"]:
+        game = GAMES[name]()
+        data = positions(game, 10)
+        for model_name, model_class in [
+            ("constant", ConstantModel),
+            ("reversi_model", ReversiModel),
+        ]:
+            seed_all(0)
+            model = model_class(game)
+
+            def search():
+                for board, player, _ in data:
+                    MCTS(game, model, 1.0, 1.0, num_search).get_action_prob(
+                        board, player
+                    )
+
+            results[f"{name}/{model_name}/simulations_per_sec"] = (
+                len(data) * num_search / timed(search, repeat)
+            )
+    return results
+
+
+def bench_training(scale: float, repeat: int) -> Dict[str, float]:
+    """AlphaZeroDatasetとリプレイバッファからの学習の1秒あたりのサンプル数"""
+    results = dict()
+    game = GAMES["reversi6"]()
+    action_size = game.get_action_size()
+    data = positions(game, int(5000 * scale))
+    rng = np.random.default_rng(0)
+    experiences = [
+        (game.get_canonical_form(board, player), rng.dirichlet(np.ones(action_size)), 1)
+        for board, player, _ in data
+    ]
+    trainer = Trainer(
+        game,
+        num_iter=1,
+        buffer_size=len(data),
+        num_episode=1,
+        num_epoch=1,
+        num_game=1,
+        lr=0.001,
+        batch_size=100,
+        r_thresh=0,
+        alpha=1.0,
+        tau=1.0,
+        num_search=1,
+    )
+
+    def train(batches):
+        seed_all(0)
+        model = ReversiModel(game)
+        optimizer = torch.optim.Adam(model.parameters(), trainer.lr)
+        for x, (p, v) in batches:
+            p_pred, v_pred = model(x)
+            loss = trainer.loss_p(p, p_pred) + trainer.loss_v(v, v_pred)
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+
+    dataset = AlphaZeroDataset(experiences)
+    loader = DataLoader(dataset, batch_size=trainer.batch_size, shuffle=True)
+    results["reversi6/dataset_samples_per_sec"] = len(data) / timed(
+        lambda: train(loader), repeat
+    )
+
+    buffer = ReplayBuffer(game, len(data))
+    buffer.extend(experiences)
+    results["reversi6/replay_buffer_samples_per_sec"] = len(data) / timed(
+        lambda: train(buffer.batches(trainer.batch_size)), repeat
+    )
+    return results
+
+
+def bench_arena(scale: float, repeat: int) -> Dict[str, float]:
+    """対戦の1秒あたりの対局数"""
+    results = dict()
+    num_games = int(100 * scale)
+    for name in ["tictactoe3", "reversi6"]:
+        game = GAMES[name]()
+        seed_all(0)
+        arena = Arena(RandomPlayer(game), RandomPlayer(game), game)
+        results[f"{name}/random_games_per_sec"] = num_games / timed(
+            lambda: arena.play_games(num_games), repeat
+        )
+
+    game = GAMES["tictactoe3"]()
+    seed_all(0)
+    mcts = MCTS(game, TicTacToeModel(game), 1.0, 1.0, 25)
+    arena = Arena(MCTSPlayer(mcts), RandomPlayer(game), game)
+    num_games = max(int(10 * scale), 2)
+    results["tictactoe3/mcts_games_per_sec"] = num_games / timed(
+        lambda: arena.play_games(num_games), repeat
+    )
+    return results
+
+
+BENCHMARKS = {
+    "games": bench_games,
+    "mcts": bench_mcts,
+    "training": bench_training,
+    "arena": bench_arena,
+}
+
+
+def metadata() -> dict:
+    """結果を比べるときに必要な実行環境の情報"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float]) -> None:
+    """基準の結果からの変化を表示する"""
+    for key, value in results.items():
+        if key in baseline:
+            change = value / baseline[key] - 1
+            print(f"{key:>50} {baseline[key]:>14.1f} -> {value:>14.1f} ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--only", choices=BENCHMARKS, nargs="+", default=list(BENCHMARKS)
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="処理量の倍率")
+    parser.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数")
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比べる以前の結果のJSONファイル")
+    args = parser.parse_args()
+    torch.set_num_threads(args.num_threads)
+
+    results = dict()
+    for name in args.only:
+        seed_all(0)
+        for key, value in BENCHMARKS[name](args.scale, args.repeat).items():
+            results[key] = value
+            print(f"{key:>50} {value:>14.1f}")
+
+    if args.output is not None:
+        report = {
+            "metadata": metadata(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
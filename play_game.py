@@ -21,25 +21,32 @@ def main():
     parser.add_argument("game")
     parser.add_argument("type")
     parser.add_argument("--white", action="store_true")
+    parser.add_argument("--num_search", type=int, default=50)
+    parser.add_argument("--time_limit", type=float, default=None)
     args = parser.parse_args()
     game_type = args.game
     player_type = args.type
     play_white = args.white
 
-    game_dict = {"tictactoe": TicTacToeGame(3), "reversi4": ReversiGame(4)}
+    game_dict = {
+        "tictactoe": TicTacToeGame(3),
+        "reversi4": ReversiGame(4),
+        "reversi6": ReversiGame(6),
+        "reversi8": ReversiGame(8),
+    }
     game = game_dict[game_type]
     player1 = HumanPlayer(game)
     if player_type == "random":
         player2 = RandomPlayer(game)
     elif player_type == "mcts":
         model = ConstantModel(game)
-        mcts = MCTS(game, model, 0.1, 0, 50)
+        mcts = MCTS(game, model, 0.1, 0, args.num_search, time_limit=args.time_limit)
         player2 = MCTSPlayer(mcts)
     elif player_type == "nnet":
         model = torch.load(f"models/{game_type}_model.pt")
         player2 = NeuralNetPlayer(game, model)
     elif player_type == "alphabeta":
-        player2 = AlphaBetaPlayer(game)
+        player2 = AlphaBetaPlayer(game, time_limit=args.time_limit)
     else:
         raise ValueError(f"Invalid player type: {player_type}")
 
@@ -1,6 +1,11 @@
+import time
+
 from app.games.tictactoe import TicTacToeGame
+from app.games.reversi import ReversiGame
 from app.games.players import RandomPlayer, AlphaBetaPlayer
+from app.games.zobrist import TranspositionTable
 from app.alpha_zero.utils import eval_player
+from app.games.arena import BatchedArena
 
 
 # 完全読みでランダムプレイヤーに9割勝てるか
@@ -12,3 +17,76 @@ def test_alpha_beta():
 
     r = eval_player(alpha_beta_player, random_player, game, 20)
     assert r > 0.9
+
+
+# 対戦を同時に進めても完全読み同士は引き分けになるか
+def test_alpha_beta_batched_arena():
+    game = TicTacToeGame(3)
+
+    player1, player2 = AlphaBetaPlayer(game), AlphaBetaPlayer(game)
+
+    arena = BatchedArena(player1, player2, game, num_parallel=3)
+    assert arena.play_games_results(5) == [0] * 5
+
+
+# 時間の上限があっても読み切れる局面では上限なしと同じ手を選ぶか
+def test_alpha_beta_iterative_deepening():
+    game = TicTacToeGame(3)
+    board = [[1, 1, 0], [-1, -1, 0], [0, 0, 0]]
+
+    player = AlphaBetaPlayer(game, time_limit=10)
+    assert player.play(board) == AlphaBetaPlayer(game).play(board)
+    assert player.stats()["depth"] < 9
+
+
+# 読み切れない盤でも時間内に合法手を返すか
+def test_alpha_beta_time_limit():
+    game = ReversiGame(8)
+    board = game.get_initial_board()
+
+    player = AlphaBetaPlayer(game, time_limit=0.2)
+    start = time.perf_counter()
+    action = player.play(board)
+    assert time.perf_counter() - start < 1
+    assert game.is_valid(board, 1, action)
+    assert player.stats()["nodes_per_second"] > 0
+
+    player = AlphaBetaPlayer(game, max_nodes=500)
+    assert game.is_valid(board, 1, player.play(board))
+    assert player.stats()["nodes"] <= 501
+
+
+# 置換表と手の並べ替えを使っても同じ評価値で，訪れるノードが減るか
+def test_alpha_beta_transposition_table():
+    for game in [TicTacToeGame(3), ReversiGame(4)]:
+        board = game.get_initial_board()
+
+        plain = AlphaBetaPlayer(game, tt_size=0)
+        plain.play(board)
+        for replacement in TranspositionTable.REPLACEMENTS:
+            player = AlphaBetaPlayer(game, tt_replacement=replacement)
+            player.play(board)
+            assert player.stats()["score"] == plain.stats()["score"]
+            assert player.stats()["nodes"] < plain.stats()["nodes"]
+
+            # 2回目は根の子の結果を全て置換表から引ける
+            player.play(board)
+            assert player.stats()["nodes"] == game.get_valid_moves(board, 1).sum()
+
+
+# 置き換え方の設定どおりに置き換えるか
+def test_transposition_table():
+    tt = TranspositionTable(4, "depth")
+    tt.put(1, 3, 0.5, TranspositionTable.EXACT, 2)
+    tt.put(5, 1, -0.5, TranspositionTable.LOWER, 0)
+    assert tt.get(5) is None
+    assert tt.get(1) == (3, 0.5, TranspositionTable.EXACT, 2)
+    tt.put(1, 1, 0.0, TranspositionTable.UPPER, 1)
+    assert tt.get(1) == (1, 0.0, TranspositionTable.UPPER, 1)
+
+    tt = TranspositionTable(4, "always")
+    tt.put(1, 3, 0.5, TranspositionTable.EXACT, 2)
+    tt.put(5, 1, -0.5, TranspositionTable.LOWER, 0)
+    assert tt.get(1) is None
+    assert tt.get(5) == (1, -0.5, TranspositionTable.LOWER, 0)
+    assert len(tt) == 1
@@ -1,7 +1,12 @@
+import copy
+
+import numpy as np
+
 from app.games.tictactoe import TicTacToeGame
 from app.games.reversi import ReversiGame
 from app.games.arena import Arena
 from app.games.players import RandomPlayer
+from app.games.vector_env import VectorEnv, make_vector_env
 
 
 # ゲームが正しくプレイできているか
@@ -20,3 +25,141 @@ def test_reversi():
     player1, player2 = RandomPlayer(game), RandomPlayer(game)
     arena = Arena(player1, player2, game)
     arena.play_game(verbose=1)
+
+
+# get_valid_movesがis_validと一致するか
+def test_valid_moves():
+    for game in [TicTacToeGame(3), ReversiGame(4), ReversiGame(6)]:
+        board = game.get_initial_board()
+        player = 1
+        while not game.get_game_ended(board, player):
+            valid = game.get_valid_moves(board, player)
+            for a in range(game.get_action_size()):
+                assert valid[a] == game.is_valid(board, player, a)
+            board, player = game.get_next_state(
+                board,
+                player,
+                RandomPlayer(game).play(game.get_canonical_form(board, player)),
+            )
+
+
+# ビットボードの盤面がリスト形式と同じように読めるか
+def test_reversi_board_view():
+    game = ReversiGame(4)
+    board = game.get_initial_board()
+    expected = [[0, 0, 0, 0], [0, -1, 1, 0], [0, 1, -1, 0], [0, 0, 0, 0]]
+    assert board.to_list() == expected
+    assert [row for row in board] == expected
+    assert board[1][2] == 1
+    assert game.get_next_state(expected, 1, 4) == game.get_next_state(board, 1, 4)
+
+
+# 対称変換した盤面で合法手が行動の並べ替えと対応しているか
+def test_symmetries():
+    for game in [TicTacToeGame(3), ReversiGame(4)]:
+        board, player = game.get_next_state(game.get_initial_board(), 1, 1)
+        valid = game.get_valid_moves(board, player)
+        symmetries = game.get_symmetries(board)
+        assert len(symmetries) == 8
+        for sym_board, perm in symmetries:
+            assert (game.get_valid_moves(sym_board, player) == valid[perm]).all()
+
+
+# 着手ごとに更新したハッシュが盤面から計算し直したものと一致するか
+def test_zobrist_keys():
+    for game in [TicTacToeGame(3), ReversiGame(4), ReversiGame(6)]:
+        board = game.get_initial_board()
+        player = 1
+        while not game.get_game_ended(board, player):
+            cboard = game.get_canonical_form(board, player)
+            lists = np.asarray(cboard).tolist()
+            assert game.hash(cboard, 1) == game.hash(lists, 1)
+            assert game.hash(board, player) != game.hash(board, -player)
+            board, player = game.get_next_state(
+                board,
+                player,
+                RandomPlayer(game).play(cboard),
+            )
+
+
+# 盤面に直接書き込んだ後にrehashすると，盤面から計算し直したハッシュと一致するか
+def test_zobrist_keys_rehash():
+    game = TicTacToeGame(3)
+    board = game.get_initial_board()
+    before = game.hash(board, 1)
+    board[1][1] = 1
+    board.rehash()
+    assert game.hash(board, 1) != before
+    assert game.hash(board, 1) == game.hash(np.asarray(board).tolist(), 1)
+    board[0][:] = [-1, 0, 1]
+    board[2] = [1, -1, 0]
+    board.rehash()
+    assert game.hash(board, 1) == game.hash(np.asarray(board).tolist(), 1)
+    cboard = game.get_canonical_form(board, -1)
+    assert game.hash(cboard, 1) == game.hash(np.asarray(cboard).tolist(), 1)
+    board[1][1] = 0
+    board[0][:] = [0, 0, 0]
+    board[2] = [0, 0, 0]
+    board.rehash()
+    assert game.hash(board, 1) == before
+
+
+# make_moveとunmake_moveがget_next_stateと一致し，元の局面に戻せるか
+def test_make_unmake_move():
+    for game in [TicTacToeGame(3), ReversiGame(4), ReversiGame(6)]:
+        board = game.get_initial_board()
+        player = 1
+        state = game.get_state(board, player)
+        undos = []
+        history = []
+        while not game.get_game_ended(board, player):
+            action = RandomPlayer(game).play(game.get_canonical_form(board, player))
+            history.append((game.get_board(state), state.player))
+            undos.append(game.make_move(state, action))
+            board, player = game.get_next_state(board, player, action)
+            assert game.get_board(state) == board
+            assert state.player == player
+            assert game.hash(state.board, state.player) == game.hash(board, player)
+
+        for undo, (prev_board, prev_player) in zip(reversed(undos), reversed(history)):
+            game.unmake_move(state, undo)
+            assert game.get_board(state) == prev_board
+            assert state.player == prev_player
+            assert game.hash(state.board, state.player) == game.hash(
+                prev_board, prev_player
+            )
+
+
+# make_moveで書き換えた盤面の複製は元の局面のままか
+def test_reversi_board_copy():
+    game = ReversiGame(4)
+    state = game.get_state(game.get_initial_board(), 1)
+    shallow = copy.copy(state.board)
+    deep = copy.deepcopy(state.board)
+    assert shallow is not state.board and deep is not state.board
+
+    game.make_move(state, int(np.flatnonzero(game.get_valid_moves(state.board, 1))[0]))
+    assert shallow == deep == game.get_initial_board()
+    assert shallow != state.board
+    assert hash(shallow) == hash(game.get_initial_board())
+
+
+# 配列演算で進めるVectorEnvがGameのメソッドで進める汎用の実装と一致するか
+def test_vector_env():
+    np.random.seed(0)
+    for game in [TicTacToeGame(3), ReversiGame(4), ReversiGame(6)]:
+        env = make_vector_env(game, 16)
+        reference = VectorEnv(game, 16)
+        assert type(env) is not VectorEnv
+        while not env.is_terminal().all():
+            legal = env.legal_moves()
+            assert (legal == reference.legal_moves()).all()
+            actions = np.array(
+                [np.random.choice(np.flatnonzero(m)) if m.any() else 0 for m in legal]
+            )
+            env.step(actions)
+            reference.step(actions)
+            assert (env.boards == reference.boards).all()
+            assert (env.players == reference.players).all()
+            assert (env.is_terminal() == reference.is_terminal()).all()
+        assert (env.reward() == reference.reward()).all()
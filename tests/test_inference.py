@@ -0,0 +1,87 @@
+import gc
+import pickle
+import weakref
+
+import numpy as np
+import pytest
+import torch
+
+from app.alpha_zero.inference import InferenceModel, compare_models, inference_model
+from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.models import ReversiModel, TicTacToeModel
+from app.games.reversi import ReversiGame
+from app.games.tictactoe import TicTacToeGame
+
+
+# 推論用に変換したモデルが元のモデルと同じ値を返し，探索結果も変わらないか
+def test_inference_model():
+    game = ReversiGame(6)
+    model = ReversiModel(game)
+    compiled = inference_model(model, game)
+    assert inference_model(model, game) is compiled
+    for batch_size in [1, 3, 64]:
+        x = torch.rand(batch_size, 2, 6, 6)
+        p, v = compiled(x)
+        with torch.no_grad():
+            p_expected, v_expected = model(x)
+        assert not p.requires_grad
+        assert torch.allclose(p, p_expected, atol=1e-6)
+        assert torch.allclose(v, v_expected, atol=1e-6)
+
+    board = game.get_initial_board()
+    expected = MCTS(game, model, 1.0, 1, 50).get_action_prob(board)
+    result = MCTS(game, compiled, 1.0, 1, 50).get_action_prob(board)
+    assert np.allclose(result, expected)
+    assert compiled.num_builds == 1
+
+
+# 元のモデルの重みを学習で書き換えたら作り直され，pickleしても使えるか
+def test_inference_model_refresh():
+    game = TicTacToeGame(3)
+    model = TicTacToeModel(game)
+    compiled = InferenceModel(model, game)
+    x = torch.rand(4, 2, 3, 3)
+    compiled(x)
+
+    optimizer = torch.optim.SGD(model.parameters(), 0.1)
+    model(x)[1].sum().backward()
+    optimizer.step()
+    p, v = compiled(x)
+    assert compiled.num_builds == 2
+    with torch.no_grad():
+        assert torch.allclose(v, model(x)[1], atol=1e-6)
+
+    restored = pickle.loads(pickle.dumps(compiled))
+    assert torch.allclose(restored(x)[1], v, atol=1e-6)
+
+
+# int8に量子化したモデルの評価のずれが小さく，元のモデルの重みは変わらないか
+def test_quantized_model():
+    game = ReversiGame(6)
+    model = ReversiModel(game)
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    quantized = inference_model(model, game, quantize=True)
+    assert quantized is not inference_model(model, game)
+
+    board = torch.randint(-1, 2, (200, 6, 6))
+    x = torch.stack([board == 1, board == -1], dim=1).float()
+    error = compare_models(model, quantized, x)
+    assert error["policy_kl"] < 1e-3
+    assert error["value_mse"] < 1e-3
+    for k, v in model.state_dict().items():
+        assert v.dtype == torch.float32
+        assert torch.equal(v, state[k])
+
+
+# 共有する推論用のラッパーがあってもモデルを消せば解放されるか
+def test_inference_model_released():
+    game = TicTacToeGame(3)
+    model = TicTacToeModel(game)
+    compiled = inference_model(model, game)
+    compiled(torch.rand(2, 2, 3, 3))
+    ref = weakref.ref(model)
+    del model
+    gc.collect()
+    assert ref() is None
+    with pytest.raises(ReferenceError):
+        compiled(torch.rand(2, 2, 3, 3))
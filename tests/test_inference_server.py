@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+import torch
+
+from app.alpha_zero.inference_server import InferenceServer
+from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.models import TicTacToeModel
+from app.games.tictactoe import TicTacToeGame
+
+
+# 複数スレッドの探索から来た盤面をまとめて評価し，モデルと同じ結果を返すか
+def test_inference_server():
+    game = TicTacToeGame(3)
+    model = TicTacToeModel(game)
+    board = game.get_initial_board()
+    expected = MCTS(game, model, 1.0, 1, 50).get_action_prob(board)
+
+    results = [None] * 8
+    with InferenceServer(model, max_batch_size=8, max_wait=0.01) as server:
+
+        def run(i):
+            results[i] = MCTS(game, server, 1.0, 1, 50).get_action_prob(board)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        x = torch.rand(3, 2, 3, 3)
+        p, v = server(x)
+        with torch.no_grad():
+            assert torch.allclose(p, model(x)[0])
+
+    for p in results:
+        assert torch.allclose(torch.Tensor(p), torch.Tensor(expected))
+    stats = server.stats()
+    assert stats["num_requests"] == 8 * 50 + 1
+    assert max(stats["batch_size_histogram"]) <= 8
+    assert stats["mean_batch_size"] > 1
+
+
+# 止めるのと同時に要求しても，受け付けた要求は全て結果かエラーが返るか
+def test_inference_server_close():
+    game = TicTacToeGame(3)
+    model = TicTacToeModel(game)
+    x = torch.rand(1, 2, 3, 3)
+    server = InferenceServer(model, max_batch_size=4)
+    futures = []
+    stats = []
+
+    def run():
+        while True:
+            try:
+                futures.append(server.submit(x))
+            except RuntimeError:
+                return
+            stats.append(server.stats())
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    while len(futures) < 100:
+        time.sleep(0.001)
+    server.close()
+    for t in threads:
+        t.join()
+
+    for future in futures:
+        future.result(timeout=1)
+    assert server.stats()["num_requests"] == len(futures)
+    with pytest.raises(RuntimeError):
+        server(x)
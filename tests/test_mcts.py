@@ -1,7 +1,14 @@
-from app.alpha_zero.mcts import MCTS
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from app.alpha_zero.mcts import MCTS, get_action_probs
 from app.games.tictactoe import TicTacToeGame
 from app.games.players import RandomPlayer, MCTSPlayer
-from app.alpha_zero.models import ConstantModel
+from app.alpha_zero.eval_cache import EvaluationCache
+from app.alpha_zero.models import ConstantModel, OneLayerModel, TicTacToeModel
 from app.alpha_zero.utils import eval_player
 
 
@@ -17,3 +24,282 @@ def test_mcts():
 
     r = eval_player(mcts_player, random_player, game, 20)
     assert r > 0.9
+
+
+# 葉をまとめて評価しても勝ちの手を選べるか
+def test_mcts_batch():
+    game = TicTacToeGame(3)
+
+    net = ConstantModel(game)
+    mcts = MCTS(game, net, 0.1, 0, 100, batch_size=8)
+    board = [[1, 1, 0], [-1, -1, 0], [0, 0, 0]]
+
+    p = mcts.get_action_prob(board)
+    assert p[2] == 1
+    assert mcts.nodes.N[mcts.nodes.get(game.hash(board, 1))].sum() == 99
+
+
+# まとめて評価しても1局面ずつ評価した場合と同じ(p, v)になるか
+def test_mcts_evaluate_batch():
+    torch.manual_seed(0)
+    game = TicTacToeGame(3)
+    b1 = game.get_initial_board()
+    b2 = [[1, 0, 0], [0, -1, 0], [0, 0, 1]]
+    for net in (OneLayerModel(game), TicTacToeModel(game)):
+        mcts = MCTS(game, net, 0.1, 1, 10)
+        batched = mcts._evaluate([b1, b2])
+        for (p, v), board in zip(batched, (b1, b2)):
+            (p1, v1), = mcts._evaluate([board])
+            assert np.allclose(p, p1, atol=1e-6)
+            assert abs(v - v1) < 1e-6
+
+
+# キャッシュを共有したMCTSは同じ局面でモデルを呼ばずに同じ結果を返すか
+def test_mcts_cache():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    cache = EvaluationCache(1000)
+    board = game.get_initial_board()
+
+    p1 = MCTS(game, net, 0.1, 1, 50, cache=cache).get_action_prob(board)
+    misses = cache.misses
+    p2 = MCTS(game, net, 0.1, 1, 50, cache=cache).get_action_prob(board)
+    assert p1 == p2
+    assert cache.misses == misses
+    assert cache.hits == misses
+
+    cache.invalidate(net)
+    assert len(cache) == 0
+
+
+# 複数のスレッドから同時に読み書きしても壊れないか
+def test_eval_cache_threads():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    cache = EvaluationCache(8)
+    p = np.zeros(game.get_action_size())
+
+    def work(offset):
+        for i in range(2000):
+            cache.put(net, (offset + i) % 16, p, 0.0)
+            cache.get(net, (offset + i + 1) % 16)
+
+    threads = [threading.Thread(target=work, args=(j,)) for j in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cache) == 8
+    assert cache.hits + cache.misses == 8000
+
+
+# 対称な盤面をまとめても勝ちの手を選べ，ノード数が減るか
+def test_mcts_symmetry():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    board = [[0, -1, 0], [0, 1, -1], [0, 0, 1]]
+
+    mcts = MCTS(game, net, 0.1, 0, 200)
+    sym_mcts = MCTS(game, net, 0.1, 0, 200, use_symmetry=True)
+    assert sym_mcts.get_action_prob(board)[0] == 1
+    assert mcts.get_action_prob(board)[0] == 1
+
+    board = game.get_initial_board()
+    mcts.reset()
+    mcts.get_action_prob(board)
+    sym_mcts.reset()
+    sym_mcts.get_action_prob(board)
+    assert len(sym_mcts.nodes) < len(mcts.nodes)
+
+
+# 対称な盤面をまとめても，展開済みの子へ降りるときは対称変換を求め直さないか
+def test_mcts_symmetry_cached_transforms():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    board = game.get_initial_board()
+    mcts = MCTS(game, net, 1.0, 1, 300, use_symmetry=True)
+    mcts.get_action_prob(board)
+
+    calls = []
+    symmetric_form = mcts._symmetric_form
+
+    def _symmetric_form(board, player):
+        calls.append(board)
+        return symmetric_form(board, player)
+
+    mcts._symmetric_form = _symmetric_form
+    linked = (mcts.nodes.children >= 0).sum()
+    for _ in range(100):
+        mcts.search_batch(board, 1, 1)
+    linked = (mcts.nodes.children >= 0).sum() - linked
+    # 根で1回と，初めてたどる辺で1回ずつだけ求める
+    assert len(calls) == 100 + linked
+
+
+# 対戦を同時に進め，複数プロセスで分担してもランダムプレイヤーに勝ち越せるか
+def test_mcts_batched_arena():
+    np.random.seed(0)
+    game = TicTacToeGame(3)
+
+    net = ConstantModel(game)
+    mcts = MCTS(game, net, 0.1, 1, 100, batch_size=4)
+    mcts_player = MCTSPlayer(mcts)
+
+    random_player = RandomPlayer(game)
+
+    r = eval_player(mcts_player, random_player, game, 20, batched=True, num_workers=2)
+    assert r > 0.5
+
+
+# 次の手番で部分木を再利用し，到達できないノードを解放するか
+def test_mcts_reuse():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    mcts = MCTS(game, net, 0.1, 1, 100)
+
+    board = game.get_initial_board()
+    mcts.get_action_prob(board, 1)
+    size = len(mcts.nodes)
+
+    board, player = game.get_next_state(board, 1, 4)
+    s = game.hash(board, player)
+    visits = mcts.nodes.N[mcts.nodes.get(s)].sum()
+    assert visits > 0
+
+    mcts.get_action_prob(board, player)
+    root = mcts.nodes.get(s)
+    assert mcts.nodes.N[root].sum() == 100
+    assert len(mcts.nodes) < size + 100 - visits
+    assert len(mcts.nodes) + len(mcts.nodes.free) == mcts.nodes.size
+
+    # 木にない局面なら作り直す
+    board = [[1, 1, 0], [-1, -1, 0], [0, 0, 0]]
+    mcts.get_action_prob(board)
+    assert mcts.nodes.N[mcts.nodes.get(game.hash(board, 1))].sum() == 99
+
+
+# まとめて評価して展開した葉も子としてつなぎ，部分木の再利用で解放しないか
+def test_mcts_reuse_batch():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    board = game.get_initial_board()
+    for use_symmetry in (False, True):
+        mcts = MCTS(game, net, 1.0, 1, 200, batch_size=8, use_symmetry=use_symmetry)
+        mcts.get_action_prob(board)
+        size = len(mcts.nodes)
+        visits = mcts.nodes.N.copy()
+        root = mcts.nodes.get(game.hash(board, 1))
+        assert mcts.nodes.prune(root) == 0
+        assert len(mcts.nodes) == size
+        assert np.array_equal(mcts.nodes.N, visits)
+
+        # 次の手番でも子の部分木の全てのノードが残る
+        child, player = game.get_next_state(board, 1, 4)
+        node = mcts.nodes.get(game.hash(child, player))
+        mcts.nodes.prune(node)
+        expanded = mcts.counters["nodes_expanded"]
+        mcts.get_action_prob(child, player)
+        assert mcts.nodes.N[node].sum() == 200
+        assert mcts.counters["nodes_expanded"] - expanded <= 200 - visits[node].sum()
+
+
+# 時間の上限に達したら探索を打ち切るか
+def test_mcts_time_limit():
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    mcts = MCTS(game, net, 0.1, 1, 10**9, time_limit=0.1)
+
+    p = mcts.get_action_prob(game.get_initial_board())
+    stats = mcts.stats()
+    assert 0.1 <= stats["time"] < 1
+    assert 0 < stats["simulations"] < 10**9
+    assert abs(sum(p) - 1) < 1e-6
+
+
+class _FixedPolicyModel(nn.Module):
+    """常に同じ行動確率と評価値0を返すモデル"""
+
+    def __init__(self, p):
+        super().__init__()
+        self.p = torch.Tensor(p)
+
+    def forward(self, x):
+        batch = x.view(-1, 2 * 9).size(0)
+        return self.p.repeat(batch, 1), torch.zeros(batch, 1)
+
+
+# PUCTではモデルの行動確率の高い手を多く読み，UCBでは行動確率を使わないか
+def test_mcts_puct():
+    game = TicTacToeGame(3)
+    p = np.full(9, 0.01)
+    p[8] = 0.92
+    net = _FixedPolicyModel(p)
+    board = game.get_initial_board()
+
+    puct = MCTS(game, net, 1.0, 1, 50)
+    puct.get_action_prob(board)
+    visits = puct.nodes.N[puct.nodes.get(game.hash(board, 1))]
+    assert visits[8] > visits.sum() / 2
+
+    ucb = MCTS(game, net, 1.0, 1, 50, selection="ucb")
+    ucb.get_action_prob(board)
+    visits = ucb.nodes.N[ucb.nodes.get(game.hash(board, 1))]
+    assert visits[8] < visits.sum() / 2
+
+    # 非合法手の確率は除いて正規化する
+    board = [[1, 0, 0], [0, 0, 0], [0, 0, -1]]
+    puct.get_action_prob(board)
+    prior = puct.nodes.P[puct.nodes.get(game.hash(board, 1))]
+    assert prior[0] == prior[8] == 0
+    assert abs(prior.sum() - 1) < 1e-6
+
+
+# 根にだけディリクレノイズを混ぜ，次の探索では元の行動確率に戻すか
+def test_mcts_dirichlet_noise():
+    np.random.seed(0)
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    mcts = MCTS(game, net, 1.0, 1, 30, dirichlet_alpha=0.3)
+    board = game.get_initial_board()
+    mcts.get_action_prob(board)
+    root = mcts.nodes.get(game.hash(board, 1))
+    prior = mcts.nodes.P[root].copy()
+    assert abs(prior.sum() - 1) < 1e-6
+    assert not np.allclose(prior, 1 / 9)
+
+    board, player = game.get_next_state(board, 1, 4)
+    mcts.get_action_prob(board, player)
+    assert mcts.nodes.get(game.hash(game.get_initial_board(), 1)) is None
+    child = mcts.nodes.get(game.hash(board, player))
+    assert not np.allclose(mcts.nodes.P[child][mcts.nodes.valid[child]], 1 / 8)
+    for node in mcts.nodes.index.values():
+        if node != child:
+            valid = mcts.nodes.valid[node]
+            assert np.allclose(mcts.nodes.P[node][valid], 1 / valid.sum())
+
+
+# 葉をまとめて評価する場合も，最初のバッチからノイズを混ぜた行動確率で子を選ぶか
+def test_mcts_dirichlet_noise_batch():
+    np.random.seed(0)
+    game = TicTacToeGame(3)
+    net = ConstantModel(game)
+    board = game.get_initial_board()
+    s = game.hash(board, 1)
+    for search in (
+        lambda mcts: mcts.get_action_prob(board),
+        lambda mcts: get_action_probs([mcts], [board]),
+    ):
+        mcts = MCTS(game, net, 1.0, 1, 30, batch_size=8, dirichlet_alpha=0.3)
+        batches = []
+        collect = mcts._collect
+
+        def _collect(board, player, k):
+            root = mcts.nodes.get(s)
+            noised = root is not None and not np.allclose(mcts.nodes.P[root], 1 / 9)
+            batches.append((k, noised))
+            return collect(board, player, k)
+
+        mcts._collect = _collect
+        search(mcts)
+        assert batches[0] == (1, False)
+        assert all(k > 1 and noised for k, noised in batches[1:])
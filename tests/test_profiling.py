@@ -0,0 +1,54 @@
+import os
+import pstats
+import time
+
+import numpy as np
+
+from app.alpha_zero.eval_cache import EvaluationCache
+from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.models import TicTacToeModel
+from app.alpha_zero.profiling import IterationProfiler, PhaseTimer
+from app.games.tictactoe import TicTacToeGame
+
+
+# 入れ子の段階の時間が外側の段階に含まれず，指定した反復だけ計測されるか
+def test_phase_timer(tmp_path):
+    timer = PhaseTimer()
+    with timer.phase("outer"):
+        time.sleep(0.02)
+        with timer.phase("inner"):
+            time.sleep(0.05)
+    times = timer.reset()
+    assert 0.02 <= times["outer"] < 0.05
+    assert times["inner"] >= 0.05
+    assert timer.reset() == dict()
+
+    profiler = IterationProfiler(str(tmp_path), iterations=(1,))
+    for i in range(3):
+        with profiler.iteration(i) as path:
+            assert (path is not None) == (i == 1)
+            sum(range(1000))
+    assert os.listdir(tmp_path) == ["iter_1.prof"]
+    pstats.Stats(str(tmp_path / "iter_1.prof"))
+
+
+# MCTSの累計がシミュレーション数，展開したノード数，モデルの評価数と合っているか
+def test_mcts_counters():
+    game = TicTacToeGame(3)
+    mcts = MCTS(game, TicTacToeModel(game), 1.0, 1, 30, cache=EvaluationCache())
+    board = game.get_initial_board()
+    # 最も訪れた手に進めば，再利用する部分木が必ずある
+    action = int(np.argmax(mcts.get_action_prob(board)))
+    board, player = game.get_next_state(board, 1, action)
+    mcts.get_action_prob(board, player)
+
+    counters = mcts.counters
+    assert counters["searches"] == 2
+    # 2回目の探索は再利用した部分木の訪問回数の分だけ少ない
+    assert 30 < counters["simulations"] < 60
+    assert counters["nodes_expanded"] == (
+        counters["cache_hits"] + counters["network_positions"]
+    )
+    assert counters["network_calls"] == counters["network_positions"]
+    assert counters["tree_size"] >= len(mcts.nodes)
+    assert mcts.stats()["tree_size"] == len(mcts.nodes)
@@ -0,0 +1,75 @@
+import multiprocessing as mp
+
+from app.games.arena import BatchedArena
+from app.games.tictactoe import TicTacToeGame
+from app.games.players import RandomPlayer, AlphaBetaPlayer
+from app.games.sprt import SPRT
+from app.alpha_zero.utils import eval_player_sprt
+
+
+# 勝ち続ければH1，引き分け続ければH0を採択するか
+def test_sprt():
+    sprt = SPRT(0, 50, 0.05, 0.05)
+    assert sprt.test(0, 0, 0) is None
+    assert sprt.test(2, 0, 0) is None
+    assert sprt.test(20, 0, 0) is True
+    assert sprt.test(0, 100, 0) is False
+    assert sprt.test(0, 0, 20) is False
+    assert sprt.llr(10, 5, 0) > sprt.llr(5, 5, 5)
+
+
+# 完全読みはランダムプレイヤーとの対戦を少ない対戦数で打ち切れるか
+def test_eval_player_sprt():
+    game = TicTacToeGame(3)
+
+    alpha_beta_player = AlphaBetaPlayer(game)
+    random_player = RandomPlayer(game)
+
+    r, num_played, result = eval_player_sprt(
+        alpha_beta_player, random_player, game, 100, SPRT(0, 50)
+    )
+    assert result is True
+    assert num_played < 50
+    assert r > 0.5
+
+    r, num_played, result = eval_player_sprt(
+        alpha_beta_player,
+        alpha_beta_player,
+        game,
+        100,
+        SPRT(0, 50),
+        batched=True,
+        games_per_round=5,
+    )
+    assert result is False
+    assert r == 0
+    assert num_played % 10 == 0
+
+
+# 複数プロセスで対戦しても，プロセスはラウンドごとでなく対戦全体で1度だけ立てるか
+def test_eval_player_sprt_workers(monkeypatch):
+    game = TicTacToeGame(3)
+    alpha_beta_player = AlphaBetaPlayer(game)
+
+    pools = []
+    make_pool = BatchedArena._make_pool
+
+    def _make_pool(self):
+        pools.append(self)
+        return make_pool(self)
+
+    monkeypatch.setattr(BatchedArena, "_make_pool", _make_pool)
+    r, num_played, result = eval_player_sprt(
+        alpha_beta_player,
+        alpha_beta_player,
+        game,
+        100,
+        SPRT(0, 50),
+        batched=True,
+        num_workers=2,
+        games_per_round=2,
+    )
+    assert result is False
+    assert num_played > 4
+    assert len(pools) == 2
+    assert mp.active_children() == []
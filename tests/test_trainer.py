@@ -1,6 +1,12 @@
+import multiprocessing as mp
+import numpy as np
+
+import torch
+
 from app.alpha_zero.trainer import Trainer
-from app.alpha_zero.models import OneLayerModel
+from app.alpha_zero.models import OneLayerModel, TicTacToeModel
 from app.alpha_zero.mcts import MCTS
+from app.alpha_zero.replay_buffer import MemmapReplayBuffer, ReplayBuffer
 from app.games.arena import Arena
 from app.games.tictactoe import TicTacToeGame
 from app.games.players import RandomPlayer, MCTSPlayer
@@ -19,3 +25,204 @@ def test_trainer():
     win_rate = (r + 1) / 2
     # 勝率9割以上
     assert win_rate > 0.9
+
+
+def _self_play_config(game, **args):
+    return dict(
+        game=game,
+        num_iter=1,
+        buffer_size=100,
+        num_episode=5,
+        num_epoch=1,
+        num_game=1,
+        lr=0.01,
+        batch_size=10,
+        r_thresh=0.1,
+        alpha=1.0,
+        tau=1.0,
+        num_search=10,
+        seed=0,
+        cache_size=0,
+        dirichlet_alpha=0.3,
+        **args,
+    )
+
+
+def _sequential_episodes(trainer, model):
+    """各エピソードをそのシードで1つずつplay_episodeした結果"""
+    return [
+        trainer.play_episode(model, np.random.RandomState(seed))
+        for seed in range(trainer.num_episode)
+    ]
+
+
+def _assert_same_episodes(episodes, expected):
+    assert len(episodes) == len(expected)
+    for episode, expected_episode in zip(episodes, expected):
+        assert len(episode) == len(expected_episode)
+        for (board, p, v), (e_board, e_p, e_v) in zip(episode, expected_episode):
+            assert board == e_board
+            assert np.allclose(p, e_p)
+            assert v == e_v
+
+
+# 複数プロセスで自己対戦しても同じシードなら1つずつ行った場合と同じ結果になるか
+def test_self_play_workers():
+    game = TicTacToeGame(3)
+    torch.manual_seed(0)
+    model = TicTacToeModel(game)
+    trainer = Trainer(**_self_play_config(game, num_workers=2))
+    expected = _sequential_episodes(trainer, model)
+    _assert_same_episodes(list(trainer.self_play(model)), expected)
+
+
+# 複数の対局を同時に進めても同じシードなら1つずつ行った場合と同じ結果になるか
+def test_self_play_lockstep():
+    game = TicTacToeGame(3)
+    torch.manual_seed(0)
+    model = TicTacToeModel(game)
+    trainer = Trainer(**_self_play_config(game, num_parallel_episodes=4))
+    expected = _sequential_episodes(trainer, model)
+    _assert_same_episodes(list(trainer.self_play(model)), expected)
+    # 対局によって長さや結果が違うことも確かめておく
+    assert len({(len(e), e[0][2]) for e in expected}) > 1
+
+
+# 量子化のずれを測るエピソードが割合どおりの数だけ選ばれ，反復ごとにずれるか
+def test_quantize_holdout():
+    game = TicTacToeGame(3)
+    config = dict(
+        game=game,
+        num_iter=1,
+        buffer_size=100,
+        num_epoch=1,
+        num_game=1,
+        lr=0.01,
+        batch_size=10,
+        r_thresh=0.1,
+        alpha=1.0,
+        tau=1.0,
+        num_search=10,
+        quantize_inference=True,
+    )
+    assert Trainer(num_episode=2, **config)._held_out_episodes(0) == set()
+    trainer = Trainer(num_episode=40, quantize_holdout=0.1, **config)
+    assert trainer._held_out_episodes(0) == {0, 10, 20, 30}
+    assert trainer._held_out_episodes(1) == {1, 11, 21, 31}
+
+
+# リングバッファが古い経験から上書きし，全ての経験をミニバッチで返すか
+def test_replay_buffer():
+    game = TicTacToeGame(3)
+    buffer = ReplayBuffer(game, 4, augment=True)
+    board = [[1, 0, 0], [0, -1, 0], [0, 0, 0]]
+    p = [0.0, 0.5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5]
+    buffer.extend([(board, p, float(v)) for v in range(6)])
+    assert len(buffer) == 4
+
+    vs = []
+    for x, (p_batch, v_batch) in buffer.batches(3):
+        vs.extend(v_batch[:, 0].tolist())
+        # 対称変換しても空きマスにだけ確率が残る
+        empty = (x.sum(dim=1).flatten(1) == 0).float()
+        assert torch.allclose((p_batch * empty).sum(dim=1), torch.ones(len(x)))
+    assert sorted(vs) == [2.0, 3.0, 4.0, 5.0]
+
+
+def _extend_memmap_buffer(path):
+    game = TicTacToeGame(3)
+    buffer = MemmapReplayBuffer(path, game, 100)
+    for _ in range(10):
+        buffer.extend([(game.get_initial_board(), [1 / 9] * 9, 1.0)] * 3)
+
+
+# ファイルに保存した経験を開き直して読めるか，複数プロセスから書き込めるか
+def test_memmap_replay_buffer(tmp_path):
+    game = TicTacToeGame(3)
+    path = str(tmp_path / "buffer.bin")
+    board = [[1, 0, 0], [0, -1, 0], [0, 0, 0]]
+    p = [0.0, 0.5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5]
+    buffer = MemmapReplayBuffer(path, game, 100)
+    buffer.extend([(board, p, -1.0)])
+    buffer.close()
+
+    processes = [
+        mp.Process(target=_extend_memmap_buffer, args=(path,)) for _ in range(2)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    buffer = MemmapReplayBuffer(path, game, 100)
+    assert len(buffer) == 61
+    x, (p_batch, v_batch) = buffer.gather(torch.tensor([0]))
+    assert x[0, 0, 0, 0] == 1 and x[0, 1, 1, 1] == 1 and x.sum() == 2
+    assert torch.allclose(p_batch[0], torch.Tensor(p))
+    assert v_batch[0, 0] == -1.0
+
+
+# 自己対戦と学習と判定を並行して進めるモードが最後まで進み，プロセスを片付けるか
+def test_train_async():
+    game = TicTacToeGame(3)
+    trainer = Trainer(
+        game=game,
+        num_iter=1,
+        buffer_size=1000,
+        num_episode=1,
+        num_epoch=1,
+        num_game=2,
+        lr=0.01,
+        batch_size=16,
+        r_thresh=-2.0,
+        alpha=1.0,
+        tau=1.0,
+        num_search=5,
+        num_workers=2,
+        seed=0,
+    )
+    model = TicTacToeModel(game)
+    trained = trainer.train_async(model, 20, sample_reuse=2.0, gate_interval=10)
+    # r_thresh=-2なので判定にかけた候補は必ず採用される
+    assert trained is not model
+    assert not torch.equal(trained.fc_v.weight, model.fc_v.weight)
+    assert mp.active_children() == []
+
+
+# 保存した状態から再開した学習が，止めずに学習した場合と同じモデルになるか
+def test_resume(tmp_path):
+    game = TicTacToeGame(3)
+    config = dict(
+        game=game,
+        num_iter=2,
+        buffer_size=100,
+        num_episode=2,
+        num_epoch=1,
+        num_game=1,
+        lr=0.01,
+        batch_size=10,
+        r_thresh=-2.0,
+        alpha=1.0,
+        tau=1.0,
+        num_search=5,
+        cache_size=0,
+    )
+    model = TicTacToeModel(game)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    expected = Trainer(**config).train(model)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    path = str(tmp_path / "checkpoint.pt")
+    Trainer(**{**config, "num_iter": 1}, checkpoint_path=path).train(model)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    resumed = Trainer(**config, checkpoint_path=path).train(model, resume=True)
+
+    for k, v in expected.state_dict().items():
+        assert torch.equal(v, resumed.state_dict()[k])
+    state = torch.load(path)
+    assert state["iteration"] == 2
+    assert state["buffer"]["size"] == len(state["buffer"]["v"]) > 0
@@ -12,6 +12,9 @@ from app.games.reversi import ReversiGame
 def main():
     parser = ArgumentParser()
     parser.add_argument("--use_wandb", action="store_true")
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--checkpoint", default="models/reversi4_checkpoint.pt")
+    parser.add_argument("--resume", action="store_true")
     args = parser.parse_args()
     use_wandb = args.use_wandb
 
@@ -31,9 +34,15 @@ def main():
     if use_wandb:
         wandb.init(project="alpha-zero", config=config)
     game = ReversiGame(4)
-    trainer = Trainer(game, **config, use_wandb=use_wandb)
+    trainer = Trainer(
+        game,
+        **config,
+        use_wandb=use_wandb,
+        num_workers=args.num_workers,
+        checkpoint_path=args.checkpoint,
+    )
     model = ReversiModel(game)
-    model = trainer.train(model)
+    model = trainer.train(model, resume=args.resume)
     torch.save(model, "models/reversi4_model.pt")
 
 
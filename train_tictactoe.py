@@ -1,4 +1,5 @@
 import logging
+from argparse import ArgumentParser
 
 import torch
 import wandb
@@ -9,6 +10,12 @@ from app.games.tictactoe import TicTacToeGame
 
 
 def main():
+    parser = ArgumentParser()
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--checkpoint", default="models/tictactoe_checkpoint.pt")
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+
     config = {
         "num_iter": 20,
         "buffer_size": 30000,
@@ -26,9 +33,14 @@ def main():
     if config["use_wandb"]:
         wandb.init(project="alpha-zero", config=config)
     game = TicTacToeGame(3)
-    trainer = Trainer(game, **config)
+    trainer = Trainer(
+        game,
+        **config,
+        num_workers=args.num_workers,
+        checkpoint_path=args.checkpoint,
+    )
     model = TicTacToeModel(game)
-    model = trainer.train(model)
+    model = trainer.train(model, resume=args.resume)
     torch.save(model, "models/tictactoe_model.pt")
 
 